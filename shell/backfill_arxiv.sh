@@ -0,0 +1,34 @@
+#!/bin/bash
+
+# This rebuilds or extends the arxiv table from a directory of saved listings
+# (data/*-UT-arxiv.pkl pickles, saved /new page HTML, or the raw listing
+# snapshots in run/cache). It can be interrupted and run again to resume.
+# Example:
+# /path/to/astroph-coffee/shell/backfill_arxiv.sh /path/to/astroph-coffee \
+# /path/to/saved/listings > \
+# /path/to/astroph-coffee/run/logs/arxiv-backfill.log 2>&1
+
+
+if [ $# -lt 2 ]
+then
+    echo "Usage: $0 <astroph-coffee basepath> <saved listings directory>"
+    exit 2
+fi
+
+
+BASEPATH=$1
+LISTINGDIR=$(cd $2 && pwd)
+
+echo "arxiv backfill started at:" `date`
+echo "astro-coffee server directory: $BASEPATH"
+echo "saved listings directory: $LISTINGDIR"
+
+cd $BASEPATH/run
+source $BASEPATH/run/bin/activate
+
+python -c "import arxivdb; arxivdb.backfill_articles('$LISTINGDIR',fullname_match_threshold=72,firstname_match_threshold=93)"
+
+deactivate
+
+echo "arxiv backfill ended at: " `date`
+cd -
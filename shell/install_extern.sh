@@ -9,6 +9,10 @@ pip install pip -U
 pip install tornado==4.5.2
 pip install requests==2.18.4
 pip install BeautifulSoup4==4.6.0
+
+# faster parser backend for arxiv listings
+pip install lxml==4.1.1
+
 pip install selenium==3.7.0
 pip install pytz
 pip install itsdangerous==0.24
@@ -22,10 +22,18 @@ echo "astro-coffee server directory: $BASEPATH"
 cd $BASEPATH/run
 source $BASEPATH/run/bin/activate
 
-# fakery = False means one can run this on a headless server
-python -c 'import arxivutils, arxivdb; x = arxivutils.arxiv_update(fakery=False); arxivdb.insert_articles(x,fullname_match_threshold=72,firstname_match_threshold=93)'
+# bring the database schema and indices up to date before ingesting
+python -c 'import dbschema; dbschema.migrate_database()'
+
+# the stage timings for each run are recorded in the ingest_runs table. to rerun
+# a failed run from its failing stage, use arxivingest.ingest_arxiv(resume=True)
+python -c 'import arxivingest; arxivingest.ingest_arxiv(fullname_match_threshold=72,firstname_match_threshold=93)'
+INGEST_STATUS=$?
 
 deactivate
 
 echo "arxiv update ended at: " `date`
 cd -
+
+# a failed ingest makes cron report the error
+exit $INGEST_STATUS
@@ -18,15 +18,20 @@ except:
 
 import os
 import os.path
+import json
+import time
 import ConfigParser
+from hashlib import sha1
+from multiprocessing import Pool
 from datetime import datetime, date, timedelta
 from pytz import utc
 import re
 
-from tornado.escape import squeeze
+from tornado.escape import squeeze, xhtml_escape
 
 # for matching local author names
 from fuzzywuzzy import process
+from fuzzywuzzy import utils as fuzzyutils
 
 # to get rid of parens in author names
 # these are applied in order
@@ -53,6 +58,10 @@ AFFIL_DICT = {x.strip():y.strip()
 
 RESERVE_INTERVAL_DAYS = int(CONF.get('times','reserve_interval_days'))
 
+# the archive backfill keeps its resume checkpoint here
+CACHEDIR = CONF.get('paths','cache')
+BACKFILL_CHECKPOINT = os.path.join(CACHEDIR, 'arxiv-backfill-checkpoint.json')
+
 
 
 def opendb():
@@ -72,6 +81,28 @@ def opendb():
 
 ## LOCAL AUTHORS
 
+def normalize_local_author_names(names):
+    '''
+    This normalizes local author names so they can be matched against the paper
+    authors. Returns the normalized full names and first-initial-lastname
+    pairs.
+
+    '''
+
+    local_authors = [x.lower() for x in names]
+    local_authors = [x.replace('.',' ') for x in local_authors]
+    local_authors = [squeeze(x) for x in local_authors]
+
+    # this contains firstinitial-lastname pairs
+    local_author_fnames = [x.split() for x in local_authors]
+    local_author_fnames = [''.join([x[0][0],x[-1]])
+                           for x in local_author_fnames]
+    local_authors = [x.replace(' ','') for x in local_authors]
+
+    return local_authors, local_author_fnames
+
+
+
 def get_local_authors_from_db(database=None):
     '''
     This just pulls out the authors from the local_authors table.
@@ -94,15 +125,9 @@ def get_local_authors_from_db(database=None):
     rows = cursor.fetchall()
     if rows and len(rows) > 0:
         local_authors, author_emails = list(zip(*rows))
-        local_authors = [x.lower() for x in local_authors]
-        local_authors = [x.replace('.',' ') for x in local_authors]
-        local_authors = [squeeze(x) for x in local_authors]
-
-        # this contains firstinitial-lastname pairs
-        local_author_fnames = [x.split() for x in local_authors]
-        local_author_fnames = [''.join([x[0][0],x[-1]])
-                               for x in local_author_fnames]
-        local_authors = [x.replace(' ','') for x in local_authors]
+        local_authors, local_author_fnames = normalize_local_author_names(
+            local_authors
+        )
 
     else:
         local_authors, local_author_fnames, author_emails = [], [], []
@@ -116,6 +141,261 @@ def get_local_authors_from_db(database=None):
 
 
 
+def _char_occurrence_keys(processed):
+    '''
+    This turns a string into its (character, occurrence number) keys, so
+    e.g. 'anna' becomes [('a',1), ('n',1), ('n',2), ('a',2)]. The number of
+    keys two strings share is the size of the intersection of their character
+    multisets.
+
+    '''
+
+    seen = {}
+    keys = []
+
+    for char in processed:
+        seen[char] = seen.get(char, 0) + 1
+        keys.append((char, seen[char]))
+
+    return keys
+
+
+
+def build_author_block_index(names):
+    '''
+    This builds a blocking index for fuzzy matching against names (the local
+    author full names or first-initial-lastname pairs from
+    get_local_authors_from_db). It's built once per tagging run, and then
+    get_author_block_candidates uses it to pick out the few names that could
+    possibly match a paper author, so fuzzywuzzy only has to score those.
+
+    '''
+
+    index = {'names':names,
+             'lengths':[],
+             'postings':{},
+             'unblocked':[]}
+
+    for ind, name in enumerate(names):
+
+        # this is what fuzzywuzzy's extractOne turns each choice into
+        processed = fuzzyutils.full_process(name, force_ascii=True)
+        index['lengths'].append(len(processed))
+
+        # names that fuzzywuzzy splits into several tokens go through the
+        # token set/sort scorers in ways the bound below doesn't cover, so
+        # these are always candidates
+        if ' ' in processed:
+            index['unblocked'].append(ind)
+            continue
+
+        for key in _char_occurrence_keys(processed):
+            index['postings'].setdefault(key, []).append(ind)
+
+    return index
+
+
+
+def get_author_block_candidates(index, name, score_cutoff):
+    '''
+    This returns the sorted indices of the names in the blocking index that can
+    score at least score_cutoff against name with fuzzywuzzy's default WRatio
+    scorer.
+
+    For single-token strings of lengths n1 <= n2 that share nshared characters
+    (as a multiset), the full ratio part of WRatio can't be more than 100 *
+    2*nshared/(n1 + n2). The partial ratio part only counts if n2 >= 1.5*n1,
+    and then it can't be more than 90 (or 60 if n2 > 8*n1) *
+    2*nshared/(n1 + nshared). Every name whose bound falls short of the cutoff
+    (minus a point for rounding) is skipped, so matching against just the
+    candidates gives exactly the same result as matching against all the names.
+
+    '''
+
+    # this is what fuzzywuzzy's extractOne turns the query into
+    processed = fuzzyutils.full_process(fuzzyutils.full_process(name),
+                                        force_ascii=True)
+
+    if score_cutoff <= 0 or len(processed) == 0 or ' ' in processed:
+        return range(len(index['names']))
+
+    shared = {}
+    for key in _char_occurrence_keys(processed):
+        for ind in index['postings'].get(key, ()):
+            shared[ind] = shared.get(ind, 0) + 1
+
+    candidates = index['unblocked'][::]
+    nquery = len(processed)
+
+    for ind, nshared in shared.iteritems():
+
+        minlen = float(min(nquery, index['lengths'][ind]))
+        maxlen = float(max(nquery, index['lengths'][ind]))
+
+        score_bound = 200.0*nshared/(minlen + maxlen)
+
+        if maxlen >= 1.5*minlen:
+            partial_scale = 0.6 if maxlen > 8.0*minlen else 0.9
+            score_bound = max(score_bound,
+                              partial_scale*200.0*nshared/(minlen + nshared))
+
+        if score_bound >= score_cutoff - 1.0:
+            candidates.append(ind)
+
+    return sorted(candidates)
+
+
+
+def match_local_author(index, name, score_cutoff):
+    '''
+    This is a drop-in replacement for process.extractOne(name, names,
+    score_cutoff=score_cutoff) that only scores the candidates from the
+    blocking index for names.
+
+    '''
+
+    candidates = get_author_block_candidates(index, name, score_cutoff)
+
+    return process.extractOne(
+        name,
+        [index['names'][x] for x in candidates],
+        score_cutoff=score_cutoff
+    )
+
+
+
+## AUTHOR MATCH CACHE
+
+def ensure_author_match_cache_table(database):
+    '''
+    This creates the author_match_cache table in databases created before it
+    existed.
+
+    '''
+
+    cursor = database.cursor()
+    cursor.execute(
+        'create table if not exists author_match_cache ('
+        'roster_hash text, '
+        'paper_author text, '
+        'paper_fname text, '
+        'matched_fname text, '
+        'fname_score integer, '
+        'matched_author text, '
+        'fullname_score integer, '
+        'primary key (roster_hash, paper_author, paper_fname))'
+    )
+    database.commit()
+    cursor.close()
+
+
+
+def get_roster_hash(local_authors,
+                    local_author_fnames,
+                    firstname_match_threshold,
+                    fullname_match_threshold):
+    '''
+    This returns a hash of the normalized local author roster and the match
+    thresholds. Cached match decisions are only valid for the same hash, so
+    changing the roster or the thresholds invalidates them.
+
+    '''
+
+    # the order matters because extractOne picks the first of several equally
+    # good matches
+    roster = u'\x1e'.join([u'\x1f'.join(x) for x in zip(local_authors,
+                                                         local_author_fnames)])
+    roster = u'%s\x1e%s\x1e%s' % (roster,
+                                  firstname_match_threshold,
+                                  fullname_match_threshold)
+
+    return sha1(roster.encode('utf-8')).hexdigest()
+
+
+
+def load_author_match_cache(roster_hash, paper_authors, database,
+                            batchsize=500):
+    '''
+    This loads the cached match decisions for roster_hash and the normalized
+    paper author names in paper_authors into a dict keyed by (paper_author,
+    paper_fname). Each value is a tuple of (first name match, full name match),
+    each of which is either None or a (local author, score) tuple as returned
+    by process.extractOne.
+
+    The names are looked up batchsize at a time, since the cache only grows and
+    loading all of it for every day of a backfill gets slow.
+
+    '''
+
+    paper_authors = sorted(set(paper_authors))
+    match_cache = {}
+
+    cursor = database.cursor()
+
+    for batchind in range(0, len(paper_authors), batchsize):
+
+        batch = paper_authors[batchind:batchind+batchsize]
+
+        cursor.execute(
+            'select paper_author, paper_fname, matched_fname, fname_score, '
+            'matched_author, fullname_score from author_match_cache '
+            'where roster_hash = ? and paper_author in (%s)' %
+            ','.join(['?']*len(batch)),
+            [roster_hash] + batch
+        )
+
+        for row in cursor.fetchall():
+
+            matched_fname = (row[2], row[3]) if row[2] is not None else None
+            matched_full = (row[4], row[5]) if row[4] is not None else None
+
+            match_cache[(row[0], row[1])] = (matched_fname, matched_full)
+
+    cursor.close()
+
+    return match_cache
+
+
+
+def save_author_match_cache(roster_hash, new_matches, database):
+    '''
+    This adds the match decisions in new_matches (a dict like the one returned
+    by load_author_match_cache) to the cache for roster_hash, and throws out
+    any decisions cached for other rosters.
+
+    '''
+
+    cursor = database.cursor()
+
+    try:
+
+        cursor.execute('delete from author_match_cache where roster_hash != ?',
+                       (roster_hash,))
+
+        cursor.executemany(
+            'insert or replace into author_match_cache '
+            '(roster_hash, paper_author, paper_fname, matched_fname, '
+            'fname_score, matched_author, fullname_score) '
+            'values (?,?,?,?,?,?,?)',
+            [(roster_hash, key[0], key[1],
+              val[0][0] if val[0] else None,
+              val[0][1] if val[0] else None,
+              val[1][0] if val[1] else None,
+              val[1][1] if val[1] else None)
+             for key, val in new_matches.iteritems()]
+        )
+
+        database.commit()
+
+    except Exception as e:
+
+        print('could not update the author match cache, error was %s' % e)
+        database.rollback()
+
+    cursor.close()
+
+
+
 def force_localauthor_tag(arxivid,
                           local_author_indices,
                           specaffils=None,
@@ -133,25 +413,39 @@ def force_localauthor_tag(arxivid,
         cursor = database.cursor()
         closedb = False
 
+    local_author_indices = ','.join(['%s' % x for x in local_author_indices])
+
+    cursor.execute('select authors from arxiv where arxiv_id = ?', (arxivid,))
+    row = cursor.fetchone()
+    if row:
+        author_html = render_author_html(row[0], local_author_indices)
+    else:
+        author_html = None
+
     if specaffils is not None:
 
         query = ("update arxiv set local_authors = 1, "
                  "local_author_indices = ?, "
-                 "local_author_specaffils = ? "
+                 "local_author_specaffils = ?, "
+                 "author_html = ? "
                  "where arxiv_id = ?")
-        params = (','.join(['%s' % x for x in local_author_indices]),
+        params = (local_author_indices,
                   '/'.join(['%s' % x for x in specaffils]),
+                  author_html,
                   arxivid)
 
     else:
 
-        query = ("update arxiv set local_authors = 1, local_author_indices = ? "
-                 "where arxiv_id = ?")
-        params = (','.join(['%s' % x for x in local_author_indices]), arxivid)
+        query = ("update arxiv set local_authors = 1, "
+                 "local_author_indices = ?, "
+                 "author_html = ? where arxiv_id = ?")
+        params = (local_author_indices, author_html, arxivid)
 
     cursor.execute(query, params)
 
     database.commit()
+    bump_article_listing_versions(arxivid, cursor)
+    patch_day_snapshots(arxivid, cursor)
 
     # at the end, close the cursor and DB connection
     if closedb:
@@ -176,12 +470,15 @@ def force_localauthor_untag(arxivid, database=None):
 
     query = ("update arxiv set local_authors = 0, "
              "local_author_indices = '', "
-             "local_author_specaffils = '' "
+             "local_author_specaffils = '', "
+             "author_html = null "
              "where arxiv_id = ?")
     params = (arxivid, )
     cursor.execute(query, params)
 
     database.commit()
+    bump_article_listing_versions(arxivid, cursor)
+    patch_day_snapshots(arxivid, cursor)
 
     # at the end, close the cursor and DB connection
     if closedb:
@@ -219,17 +516,229 @@ def strip_affils(authorstr, subchar=','):
 
 
 
+def normalize_paper_authors(authorstr):
+    '''
+    This turns the authors column of a paper into its list of authors without
+    affiliations, and the normalized full names and first-initial-lastname
+    pairs that are matched against the local authors.
+
+    '''
+
+    # get rid of the affiliations for matching to local authors
+    paper_authors = strip_affils(authorstr)
+
+    # we'll save this initial cleaned version back to the database for local
+    # matched papers so all the author indices line up correctly
+    cleaned_paper_authors = paper_authors[::]
+
+    # normalize these names so we can compare them more robustly to the local
+    # authors
+    paper_authors = [x.lower().strip() for x in paper_authors]
+    paper_authors = [x.strip() for x in paper_authors if len(x) > 1]
+    paper_authors = [x.replace('.',' ') for x in paper_authors]
+    paper_authors = [squeeze(x) for x in paper_authors]
+
+    paper_author_fnames = [x.split() for x in paper_authors]
+    paper_author_fnames = [''.join([x[0][0],x[-1]]) for x
+                           in paper_author_fnames]
+    paper_authors = [x.replace(' ','') for x in paper_authors]
+
+    return cleaned_paper_authors, paper_authors, paper_author_fnames
+
+
+
+def render_author_html(authors, local_author_indices):
+    '''
+    This renders the author list of a paper with local authors for the listing
+    pages. The names are escaped and joined with ', ', and the ones at the
+    positions in local_author_indices (the comma-separated string stored in the
+    arxiv table) are wrapped in <strong> tags.
+
+    '''
+
+    author_list = [xhtml_escape(x) for x in authors.split(': ')[-1].split(',')]
+
+    if local_author_indices:
+
+        for li in local_author_indices.split(','):
+
+            li = int(li)
+            if 0 <= li < len(author_list):
+                author_list[li] = '<strong>%s</strong>' % author_list[li]
+
+    return ', '.join(author_list)
+
+
+
+def ensure_author_html_column(database):
+    '''
+    This adds the author_html column to the arxiv table of databases created
+    before it existed, and fills it in for the papers with local authors.
+
+    '''
+
+    cursor = database.cursor()
+    cursor.execute('pragma table_info(arxiv)')
+    columns = [x[1] for x in cursor.fetchall()]
+
+    if 'author_html' not in columns:
+        cursor.execute('alter table arxiv add column author_html text')
+
+    cursor.execute('select utcdate, arxiv_id, authors, local_author_indices '
+                   'from arxiv where local_authors = 1 and author_html is null')
+    rows = cursor.fetchall()
+
+    cursor.executemany(
+        'update arxiv set author_html = ? where utcdate = ? and arxiv_id = ?',
+        [(render_author_html(x[2], x[3]), x[0], x[1]) for x in rows]
+    )
+
+    database.commit()
+    cursor.close()
+
+
+
+def get_local_author_tags(arxivid,
+                          paper_authors,
+                          paper_author_fnames,
+                          local_authors,
+                          local_emails,
+                          local_author_index,
+                          local_author_fname_index,
+                          match_cache,
+                          new_matches,
+                          firstname_match_threshold=93,
+                          fullname_match_threshold=72):
+    '''
+    This matches the normalized authors of a paper to the local authors and
+    returns the indices of the local authors in the paper's author list and
+    their special affiliations.
+
+    match_cache holds the match decisions made so far (see
+    load_author_match_cache) and new decisions are added to it and to
+    new_matches.
+
+    '''
+
+    local_matched_author_inds = []
+    local_matched_author_affils = []
+
+    # match to the flastname first, then if that works, try another match with
+    # fullname. if both work, then we accept this as a local author match
+    for paper_author, paper_fname, paper_author_ind in zip(
+            paper_authors,
+            paper_author_fnames,
+            range(len(paper_authors))
+    ):
+
+        match_key = (paper_author, paper_fname)
+
+        if match_key not in match_cache:
+            match_cache[match_key] = (
+                match_local_author(local_author_fname_index,
+                                   paper_fname,
+                                   firstname_match_threshold),
+                match_local_author(local_author_index,
+                                   paper_author,
+                                   fullname_match_threshold)
+            )
+            new_matches[match_key] = match_cache[match_key]
+
+        matched_author_fname, matched_author_full = match_cache[match_key]
+
+        if matched_author_fname and matched_author_full:
+
+            print(
+                '%s: %s, matched paper author: %s '
+                'to local author: %s. '
+                'first name score: %s, full name score: %s' % (
+                    arxivid,
+                    paper_authors,
+                    paper_author,
+                    matched_author_full[0],
+                    matched_author_fname[1],
+                    matched_author_full[1],
+                )
+            )
+
+            # update the paper author index column so we can highlight them in
+            # the frontend
+            local_matched_author_inds.append(paper_author_ind)
+
+            # also update the affilation tag for this author
+            local_authind = local_authors.index(matched_author_full[0])
+
+            # get the corresponding email
+            local_matched_email = local_emails[local_authind]
+
+            # split to get the affil tag
+            local_matched_affil = local_matched_email.split('@')[-1]
+
+            if local_matched_affil in AFFIL_DICT:
+
+                local_matched_author_affils.append(
+                    AFFIL_DICT[local_matched_affil]
+                )
+
+            # now that we have all the special affils, compress them into only
+            # the unique ones
+            local_matched_author_affils = list(set(
+                local_matched_author_affils
+            ))
+
+    return local_matched_author_inds, local_matched_author_affils
+
+
+
+def store_paper_authors(arxiv_date, normalized, database):
+    '''
+    This replaces the stored normalized author lists for arxiv_date with the
+    ones in normalized, a list of (arxivid, paper_authors, paper_author_fnames)
+    tuples. These are used by retag_local_authors to find the papers affected by
+    a change in the local author roster without re-normalizing the archive.
+
+    '''
+
+    cursor = database.cursor()
+
+    cursor.execute('delete from paper_authors where utcdate = date(?)',
+                   (arxiv_date,))
+    cursor.executemany(
+        'insert into paper_authors '
+        '(utcdate, arxiv_id, author_index, paper_author, paper_fname) '
+        'values (date(?),?,?,?,?)',
+        [(arxiv_date, arxivid, ind, paper_author, paper_fname)
+         for arxivid, paper_authors, paper_author_fnames in normalized
+         for ind, (paper_author, paper_fname) in enumerate(
+                 zip(paper_authors, paper_author_fnames)
+         )]
+    )
+
+    cursor.close()
+
+
+
 def tag_local_authors(arxiv_date,
                       database=None,
                       firstname_match_threshold=93,
                       fullname_match_threshold=72,
                       update_db=False,
+                      use_match_cache=True,
                       verbose=False):
 
     '''
     This finds all local authors for all papers on the date arxiv_date and tags
     the rows for them in the DB.
 
+    If use_match_cache is True, the match decision for each paper author is
+    looked up in the author_match_cache table first, and new decisions are
+    saved there for the next run. The cache is keyed by a hash of the local
+    author roster and the thresholds, so it's invalidated automatically if
+    either changes.
+
+    If update_db is True, the normalized author lists of the papers are also
+    stored in the paper_authors table for retag_local_authors.
+
     '''
 
     # open the database if needed and get a cursor
@@ -247,6 +756,10 @@ def tag_local_authors(arxiv_date,
 
     if len(local_authors) > 0:
 
+        # build the blocking indices once for this run
+        local_author_index = build_author_block_index(local_authors)
+        local_author_fname_index = build_author_block_index(local_author_fnames)
+
         # get all the authors for this date
         query = 'select arxiv_id, authors from arxiv where utcdate = date(?)'
         query_params = (arxiv_date,)
@@ -256,111 +769,65 @@ def tag_local_authors(arxiv_date,
         if rows and len(rows) > 0:
 
             local_author_articles = []
+            normalized = []
 
+            # normalize all the author lists first so only the cached match
+            # decisions for these names need to be loaded
+            cleaned = []
             for row in rows:
-
-                paper_authors = row[1]
-
-                # get rid of the affiliations for matching to local authors
-                paper_authors = strip_affils(paper_authors)
-
-                # we'll save this initial cleaned version back to the database
-                # for local matched papers so all the author indices line up
-                # correctly
-                cleaned_paper_authors = paper_authors[::]
+                cleaned_paper_authors, paper_authors, paper_author_fnames = (
+                    normalize_paper_authors(row[1])
+                )
+                cleaned.append(cleaned_paper_authors)
+                normalized.append((row[0], paper_authors, paper_author_fnames))
+
+            # the same authors show up across many papers and days, so we keep
+            # the match decisions for each normalized name around
+            if use_match_cache:
+                ensure_author_match_cache_table(database)
+                roster_hash = get_roster_hash(local_authors,
+                                              local_author_fnames,
+                                              firstname_match_threshold,
+                                              fullname_match_threshold)
+                match_cache = load_author_match_cache(
+                    roster_hash,
+                    [x for y in normalized for x in y[1]],
+                    database
+                )
+            else:
+                match_cache = {}
+
+            new_matches = {}
+
+            for row, cleaned_paper_authors, normalized_authors in zip(
+                    rows,
+                    cleaned,
+                    normalized
+            ):
+
+                paper_authors, paper_author_fnames = normalized_authors[1:]
 
                 if verbose:
                     print('%s authors: %s' % (row[0],
                                               repr(cleaned_paper_authors)))
-
-                # normalize these names so we can compare them more robustly to
-                # the local authors
-                paper_authors = [x.lower().strip() for x in paper_authors]
-                paper_authors = [x.strip() for x in paper_authors if len(x) > 1]
-                paper_authors = [x.replace('.',' ') for x in paper_authors]
-                paper_authors = [squeeze(x) for x in paper_authors]
-
-                paper_author_fnames = [x.split() for x in paper_authors]
-                paper_author_fnames = [''.join([x[0][0],x[-1]]) for x
-                                      in paper_author_fnames]
-                paper_authors = [x.replace(' ','') for x in paper_authors]
-
-                if verbose:
                     print("%s normalized authors: %s" % (row[0],
                                                          repr(paper_authors)))
 
-
-                local_matched_author_inds = []
-                local_matched_author_affils = []
-
-                # match to the flastname first, then if that works, try another
-                # match with fullname. if both work, then we accept this as a
-                # local author match
-                for paper_author, paper_fname, paper_author_ind in zip(
+                local_matched_author_inds, local_matched_author_affils = (
+                    get_local_author_tags(
+                        row[0],
                         paper_authors,
                         paper_author_fnames,
-                        range(len(paper_authors))
-                ):
-
-                    matched_author_fname = process.extractOne(
-                        paper_fname,
-                        local_author_fnames,
-                        score_cutoff=firstname_match_threshold
-                    )
-
-                    matched_author_full = process.extractOne(
-                        paper_author,
                         local_authors,
-                        score_cutoff=fullname_match_threshold
+                        local_emails,
+                        local_author_index,
+                        local_author_fname_index,
+                        match_cache,
+                        new_matches,
+                        firstname_match_threshold=firstname_match_threshold,
+                        fullname_match_threshold=fullname_match_threshold
                     )
-
-
-                    if matched_author_fname and matched_author_full:
-
-                        print(
-                            '%s: %s, matched paper author: %s '
-                            'to local author: %s. '
-                            'first name score: %s, full name score: %s' % (
-                                row[0],
-                                paper_authors,
-                                paper_author,
-                                matched_author_full[0],
-                                matched_author_fname[1],
-                                matched_author_full[1],
-                            )
-                        )
-
-                        # update the paper author index column so we can
-                        # highlight them in the frontend
-                        local_matched_author_inds.append(paper_author_ind)
-
-                        # also update the affilation tag for this author
-                        local_authind = local_authors.index(
-                            matched_author_full[0]
-                        )
-
-                        # get the corresponding email
-                        local_matched_email = local_emails[local_authind]
-
-                        # split to get the affil tag
-                        local_matched_affil = (
-                            local_matched_email.split('@')[-1]
-                        )
-
-                        if local_matched_affil in AFFIL_DICT:
-
-                            local_matched_author_affils.append(
-                                AFFIL_DICT[local_matched_affil]
-                            )
-
-                        # now that we have all the special affils, compress
-                        # them into only the unique ones
-                        local_matched_author_affils = list(set(
-                            local_matched_author_affils
-                        ))
-                #
-                # done with all authors for this paper
-                #
+                )
 
                 # now update the info for this paper
                 if len(local_matched_author_inds) > 0 and update_db:
@@ -377,19 +844,37 @@ def tag_local_authors(arxiv_date,
                         local_matched_author_affils
                     )
 
+                    # this is the author list shown on the listing pages
+                    author_html = render_author_html(
+                        ','.join(cleaned_paper_authors),
+                        local_author_indices
+                    )
+
                     cursor.execute(
                         'update arxiv set '
                         'authors = ?, '
                         'local_authors = ?, '
                         'local_author_indices = ?, '
-                        'local_author_specaffils = ? '
+                        'local_author_specaffils = ?, '
+                        'author_html = ? '
                         'where '
-                        'arxiv_id = ?',
+                        'arxiv_id = ? and not ('
+                        'authors is ? and '
+                        'local_authors is ? and '
+                        'local_author_indices is ? and '
+                        'local_author_specaffils is ? and '
+                        'author_html is ?)',
                         (','.join(cleaned_paper_authors),
                          True,
                          local_author_indices,
                          local_author_special_affils,
-                         row[0])
+                         author_html,
+                         row[0],
+                         ','.join(cleaned_paper_authors),
+                         True,
+                         local_author_indices,
+                         local_author_special_affils,
+                         author_html)
                     )
 
 
@@ -399,8 +884,14 @@ def tag_local_authors(arxiv_date,
 
             # commit the transaction at the end
             if update_db:
+                ensure_paper_authors_table(database)
+                store_paper_authors(arxiv_date, normalized, database)
                 database.commit()
 
+            # save the new match decisions for the next run
+            if use_match_cache and len(new_matches) > 0:
+                save_author_match_cache(roster_hash, new_matches, database)
+
             return local_author_articles
 
         else:
@@ -420,17 +911,89 @@ def tag_local_authors(arxiv_date,
 
 
 
-## INSERTING ARTICLES
+## RETAGGING THE ARCHIVE
 
-def insert_articles(arxiv,
-                    database=None,
-                    tag_locals=True,
-                    fullname_match_threshold=72,
-                    firstname_match_threshold=93,
-                    verbose=False):
+def ensure_paper_authors_table(database):
     '''
-    This inserts all articles in an arxivdict created by
-    arxivutils.grab_arxiv_update into the astroph-coffee server database.
+    This creates the paper_authors table and its indices in databases created
+    before it existed.
+
+    '''
+
+    cursor = database.cursor()
+    cursor.execute(
+        'create table if not exists paper_authors ('
+        'utcdate date, '
+        'arxiv_id text, '
+        'author_index integer, '
+        'paper_author text, '
+        'paper_fname text, '
+        'primary key (utcdate, arxiv_id, author_index))'
+    )
+    cursor.execute('create index if not exists paper_authors_author_idx '
+                   'on paper_authors(paper_author)')
+    cursor.execute('create index if not exists paper_authors_fname_idx '
+                   'on paper_authors(paper_fname)')
+    database.commit()
+    cursor.close()
+
+
+
+def store_missing_paper_authors(database):
+    '''
+    This normalizes and stores the author lists for all dates in the arxiv
+    table that don't have them in the paper_authors table yet, e.g. for dates
+    that were inserted before the table existed. Returns the number of dates
+    that were processed.
+
+    '''
+
+    cursor = database.cursor()
+    cursor.execute('select distinct utcdate from arxiv where utcdate not in '
+                   '(select distinct utcdate from paper_authors)')
+    missing_dates = [x[0] for x in cursor.fetchall()]
+
+    for missing_date in missing_dates:
+
+        cursor.execute('select arxiv_id, authors from arxiv '
+                       'where utcdate = date(?)', (missing_date,))
+        normalized = []
+
+        for arxivid, authors in cursor.fetchall():
+            _, paper_authors, paper_author_fnames = normalize_paper_authors(
+                authors
+            )
+            normalized.append((arxivid, paper_authors, paper_author_fnames))
+
+        store_paper_authors(missing_date, normalized, database)
+
+    database.commit()
+    cursor.close()
+
+    return len(missing_dates)
+
+
+
+def retag_local_authors(changed_authors,
+                        database=None,
+                        firstname_match_threshold=93,
+                        fullname_match_threshold=72,
+                        batchsize=500,
+                        verbose=False):
+    '''
+    This re-tags the local authors across the whole archive after the local
+    author roster changes. changed_authors is the list of author names (as
+    they're written in the local_authors table) that were added to or removed
+    from the roster.
+
+    Only the papers with a normalized author that can match one of the changed
+    names at the given thresholds are re-scored against the current roster,
+    using the normalized author lists stored in the paper_authors table. The
+    updates are written batchsize papers per transaction. Papers that no longer
+    have any local authors are untagged, so this also undoes any
+    force_localauthor_tag for them.
+
+    Returns a dict with the number of papers re-scored, tagged, and untagged.
 
     '''
 
@@ -442,104 +1005,1294 @@ def insert_articles(arxiv,
         cursor = database.cursor()
         closedb = False
 
-    # make sure we know that the dt is in UTC
-    arxiv_dt = arxiv['utc']
-    if not arxiv_dt.tzinfo:
-        arxiv_dt = arxiv_dt.replace(tzinfo=utc)
+    results = {'nrescored':0, 'ntagged':0, 'nuntagged':0}
 
+    try:
 
-    papers = arxiv['papers']
-    crosslists = arxiv['crosslists']
+        ensure_paper_authors_table(database)
+        ensure_author_match_cache_table(database)
 
-    query = ("insert or replace into arxiv (utctime, utcdate, "
-             "day_serial, title, article_type,"
-             "arxiv_id, authors, comments, abstract, link, pdf, "
-             "nvotes, voters, presenters, local_authors, reserved) values "
-             "(?,?, ?,?,?, ?,?,?,?,?,?, ?,?,?,?, 0)")
+        nmissing = store_missing_paper_authors(database)
+        if nmissing > 0:
+            print('stored normalized author lists for %s dates' % nmissing)
 
-    try:
+        changed_authors, changed_fnames = normalize_local_author_names(
+            changed_authors
+        )
+
+        # find all the distinct normalized names in the archive that can
+        # match one of the changed roster names
+        cursor.execute('select distinct paper_author from paper_authors')
+        archive_authors = [x[0] for x in cursor.fetchall()]
+        cursor.execute('select distinct paper_fname from paper_authors')
+        archive_fnames = [x[0] for x in cursor.fetchall()]
+
+        affected_authors, affected_fnames = set(), set()
+
+        for names, changed_names, threshold, affected in (
+                (archive_authors, changed_authors,
+                 fullname_match_threshold, affected_authors),
+                (archive_fnames, changed_fnames,
+                 firstname_match_threshold, affected_fnames),
+        ):
+
+            archive_index = build_author_block_index(names)
+
+            for changed_name in changed_names:
+                for ind in get_author_block_candidates(archive_index,
+                                                       changed_name,
+                                                       threshold):
+                    # score these the same way tag_local_authors does
+                    if process.extractOne(names[ind],
+                                          [changed_name],
+                                          score_cutoff=threshold):
+                        affected.add(names[ind])
+
+        if verbose:
+            print('changed names can match %s full names and %s '
+                  'first-initial-lastnames in the archive' %
+                  (len(affected_authors), len(affected_fnames)))
+
+        # get the normalized author lists of all the affected papers
+        cursor.execute('create temp table if not exists retag_names '
+                       '(name text, nametype text)')
+        cursor.execute('delete from retag_names')
+        cursor.executemany('insert into retag_names values (?, ?)',
+                           [(x, 'author') for x in affected_authors] +
+                           [(x, 'fname') for x in affected_fnames])
+        cursor.execute(
+            'select p.utcdate, p.arxiv_id, p.author_index, '
+            'p.paper_author, p.paper_fname '
+            'from paper_authors p join ('
+            'select distinct utcdate, arxiv_id from paper_authors '
+            'where paper_author in '
+            "(select name from retag_names where nametype = 'author') or "
+            'paper_fname in '
+            "(select name from retag_names where nametype = 'fname')"
+            ') a on p.utcdate = a.utcdate and p.arxiv_id = a.arxiv_id '
+            'order by p.utcdate, p.arxiv_id, p.author_index'
+        )
 
-        for key in papers:
-
-            if verbose:
-                print('inserting astronomy article %s: %s' %
-                      (key, papers[key]['title']))
-
-            u_title = unicode(papers[key]['title'])
-            u_authors = unicode(','.join(papers[key]['authors']))
-            u_comments = unicode(papers[key]['comments'])
-            u_abstract = unicode(papers[key]['abstract'])
-
-            # get rid of the initial 'Authors: ' bit
-            u_authors = u_authors.replace('Authors:','',1)
-            u_authors = u_authors.strip()
-
-            params = (arxiv_dt,
-                      arxiv_dt.date(),
-                      key,
-                      u_title,
-                      'astronomy',
-                      papers[key]['arxiv'],
-                      u_authors,
-                      u_comments,
-                      u_abstract,
-                      'http://arxiv.org%s' % papers[key]['link'],
-                      'http://arxiv.org%s' % papers[key]['pdf'],
-                      0,
-                      '',
-                      '',
-                      False)
-            cursor.execute(query, params)
-
-        for key in crosslists:
-
-            if verbose:
-                print('inserting cross-list article %s: %s' %
-                      (key, crosslists[key]['title']))
-
-            params = (arxiv_dt,
-                      arxiv_dt.date(),
-                      key,
-                      unicode(crosslists[key]['title']),
-                      'crosslists',
-                      crosslists[key]['arxiv'],
-                      unicode(','.join(crosslists[key]['authors'])),
-                      unicode(crosslists[key]['comments']),
-                      unicode(crosslists[key]['abstract']),
-                      'http://arxiv.org%s' % crosslists[key]['link'],
-                      'http://arxiv.org%s' % crosslists[key]['pdf'],
-                      0,
-                      '',
-                      '',
-                      False)
-            cursor.execute(query, params)
+        affected_papers = {}
+        for utcdate, arxivid, _, paper_author, paper_fname in cursor.fetchall():
+            paper = affected_papers.setdefault((utcdate, arxivid), ([], []))
+            paper[0].append(paper_author)
+            paper[1].append(paper_fname)
 
-        database.commit()
+        # now re-score these papers against the current roster
+        local_authors, local_author_fnames, local_emails = (
+            get_local_authors_from_db(database=database)
+        )
+        local_author_index = build_author_block_index(local_authors)
+        local_author_fname_index = build_author_block_index(local_author_fnames)
+
+        roster_hash = get_roster_hash(local_authors,
+                                      local_author_fnames,
+                                      firstname_match_threshold,
+                                      fullname_match_threshold)
+        match_cache = load_author_match_cache(
+            roster_hash,
+            [x for y in affected_papers.values() for x in y[0]],
+            database
+        )
+        new_matches = {}
+
+        updates = []
+
+        for (utcdate, arxivid), (paper_authors, paper_author_fnames) in sorted(
+                affected_papers.items()
+        ):
+
+            local_matched_author_inds, local_matched_author_affils = (
+                get_local_author_tags(
+                    arxivid,
+                    paper_authors,
+                    paper_author_fnames,
+                    local_authors,
+                    local_emails,
+                    local_author_index,
+                    local_author_fname_index,
+                    match_cache,
+                    new_matches,
+                    firstname_match_threshold=firstname_match_threshold,
+                    fullname_match_threshold=fullname_match_threshold
+                )
+            )
+
+            if len(local_matched_author_inds) > 0:
+
+                updates.append((
+                    True,
+                    ','.join(['%s' % x for x in local_matched_author_inds]),
+                    ','.join(local_matched_author_affils),
+                    utcdate,
+                    arxivid
+                ))
+                results['ntagged'] += 1
+
+            else:
+
+                updates.append((False, None, None, utcdate, arxivid))
+                results['nuntagged'] += 1
+
+        results['nrescored'] = len(updates)
+
+        # the author indices point into the author list without affiliations,
+        # so the authors column gets cleaned up for newly tagged papers like
+        # tag_local_authors does
+        cursor.execute('create temp table if not exists retag_papers '
+                       '(utcdate date, arxiv_id text)')
+        cursor.execute('delete from retag_papers')
+        cursor.executemany('insert into retag_papers values (?, ?)',
+                           [(x[3], x[4]) for x in updates if x[0]])
+        cursor.execute('select a.utcdate, a.arxiv_id, a.authors from arxiv a '
+                       'join retag_papers r on a.utcdate = r.utcdate and '
+                       'a.arxiv_id = r.arxiv_id')
+        cleaned_authors = {
+            (x[0], x[1]):','.join(normalize_paper_authors(x[2])[0])
+            for x in cursor.fetchall()
+        }
+
+        for batchind in range(0, len(updates), batchsize):
+
+            batch = updates[batchind:batchind+batchsize]
+
+            cursor.executemany(
+                'update arxiv set '
+                'authors = (case when ? then ? else authors end), '
+                'local_authors = ?, '
+                'local_author_indices = ?, '
+                'local_author_specaffils = ?, '
+                'author_html = ? '
+                'where utcdate = date(?) and arxiv_id = ?',
+                [(x[0], cleaned_authors.get((x[3], x[4])),
+                  x[0], x[1], x[2],
+                  (render_author_html(cleaned_authors[(x[3], x[4])], x[1])
+                   if x[0] and (x[3], x[4]) in cleaned_authors else None),
+                  x[3], x[4]) for x in batch]
+            )
+            database.commit()
+
+        if len(new_matches) > 0:
+            save_author_match_cache(roster_hash, new_matches, database)
+
+    except Exception as e:
+
+        print('could not re-tag local authors, error was %s' % e)
+        database.rollback()
+        results = None
+
+    # at the end, close the cursor and DB connection
+    if closedb:
+        cursor.close()
+        database.close()
+
+    if results:
+        print('re-scored %s papers: %s tagged, %s untagged' %
+              (results['nrescored'], results['ntagged'],
+               results['nuntagged']))
+
+    return results
+
+
+
+## INSERTING ARTICLES
+
+ARTICLE_INSERT_QUERY = (
+    "insert or replace into arxiv (utctime, utcdate, "
+    "day_serial, title, article_type,"
+    "arxiv_id, authors, comments, abstract, link, pdf, "
+    "nvotes, voters, presenters, local_authors, content_hash, reserved) values "
+    "(?,?, ?,?,?, ?,?,?,?,?,?, ?,?,?,?,?, 0)"
+)
+
+# the upsert is done as an update of the rows whose content changed followed by
+# an insert of the rows that aren't there yet. this leaves the votes,
+# reservations, and presenters columns of existing rows alone and doesn't touch
+# unchanged rows at all, so their FTS triggers don't fire either.
+ARTICLE_UPSERT_UPDATE_QUERY = (
+    "update arxiv set utctime = ?, title = ?, authors = ?, comments = ?, "
+    "abstract = ?, link = ?, pdf = ?, content_hash = ?, "
+    "local_authors = 0, local_author_indices = null, "
+    "local_author_specaffils = null, author_html = null "
+    "where utcdate = ? and day_serial = ? and article_type = ? and "
+    "arxiv_id = ? and (content_hash is null or content_hash != ?)"
+)
+ARTICLE_UPSERT_INSERT_QUERY = ARTICLE_INSERT_QUERY.replace('insert or replace',
+                                                           'insert or ignore',
+                                                           1)
+
+
+def article_content_hash(title, authors, abstract, comments):
+    '''
+    This returns a hash of the parts of an article that can change between
+    listings. It's used to skip rows that haven't changed when re-inserting a
+    day's articles.
+
+    '''
+
+    content = u'\x1f'.join([title, authors, abstract, comments])
+    return sha1(content.encode('utf-8')).hexdigest()
+
+
+
+def ensure_content_hash_column(database):
+    '''
+    This adds the content_hash column to the arxiv table of databases created
+    before it existed.
+
+    '''
+
+    cursor = database.cursor()
+    cursor.execute('pragma table_info(arxiv)')
+    columns = [x[1] for x in cursor.fetchall()]
+
+    if 'content_hash' not in columns:
+        cursor.execute('alter table arxiv add column content_hash text')
+        database.commit()
+
+    cursor.close()
+
+
+
+def get_article_rows(arxiv, verbose=False):
+    '''
+    This turns an arxivdict created by arxivutils.arxiv_update into a list of
+    parameter tuples for ARTICLE_INSERT_QUERY. The last item in each tuple is
+    the article's content hash.
+
+    '''
+
+    # make sure we know that the dt is in UTC
+    arxiv_dt = arxiv['utc']
+    if not arxiv_dt.tzinfo:
+        arxiv_dt = arxiv_dt.replace(tzinfo=utc)
+
+    papers = arxiv['papers']
+    crosslists = arxiv['crosslists']
+
+    rows = []
+
+    for key in papers:
+
+        if verbose:
+            print('inserting astronomy article %s: %s' %
+                  (key, papers[key]['title']))
+
+        u_title = unicode(papers[key]['title'])
+        u_authors = unicode(','.join(papers[key]['authors']))
+        u_comments = unicode(papers[key]['comments'])
+        u_abstract = unicode(papers[key]['abstract'])
+
+        # get rid of the initial 'Authors: ' bit
+        u_authors = u_authors.replace('Authors:','',1)
+        u_authors = u_authors.strip()
+
+        rows.append((arxiv_dt,
+                     arxiv_dt.date(),
+                     key,
+                     u_title,
+                     'astronomy',
+                     papers[key]['arxiv'],
+                     u_authors,
+                     u_comments,
+                     u_abstract,
+                     'http://arxiv.org%s' % papers[key]['link'],
+                     'http://arxiv.org%s' % papers[key]['pdf'],
+                     0,
+                     '',
+                     '',
+                     False,
+                     article_content_hash(u_title, u_authors,
+                                          u_abstract, u_comments)))
+
+    for key in crosslists:
+
+        if verbose:
+            print('inserting cross-list article %s: %s' %
+                  (key, crosslists[key]['title']))
+
+        u_title = unicode(crosslists[key]['title'])
+        u_authors = unicode(','.join(crosslists[key]['authors']))
+        u_comments = unicode(crosslists[key]['comments'])
+        u_abstract = unicode(crosslists[key]['abstract'])
+
+        rows.append((arxiv_dt,
+                     arxiv_dt.date(),
+                     key,
+                     u_title,
+                     'crosslists',
+                     crosslists[key]['arxiv'],
+                     u_authors,
+                     u_comments,
+                     u_abstract,
+                     'http://arxiv.org%s' % crosslists[key]['link'],
+                     'http://arxiv.org%s' % crosslists[key]['pdf'],
+                     0,
+                     '',
+                     '',
+                     False,
+                     article_content_hash(u_title, u_authors,
+                                          u_abstract, u_comments)))
+
+    return rows
+
+
+
+def upsert_article_rows(rows, cursor):
+    '''
+    This writes the rows from get_article_rows to the arxiv table, updating
+    only existing rows whose content hash changed and inserting new ones. The
+    caller commits. Returns the number of rows inserted and updated.
+
+    '''
+
+    cursor.executemany(
+        ARTICLE_UPSERT_UPDATE_QUERY,
+        [(x[0], x[3], x[6], x[7], x[8], x[9], x[10], x[15],
+          x[1], x[2], x[4], x[5], x[15]) for x in rows]
+    )
+    nupdated = cursor.rowcount
+
+    cursor.executemany(ARTICLE_UPSERT_INSERT_QUERY, rows)
+    ninserted = cursor.rowcount
+
+    return ninserted, nupdated
+
+
+
+def insert_articles(arxiv,
+                    database=None,
+                    tag_locals=True,
+                    fullname_match_threshold=72,
+                    firstname_match_threshold=93,
+                    upsert=True,
+                    verbose=False):
+    '''
+    This inserts all articles in an arxivdict created by
+    arxivutils.grab_arxiv_update into the astroph-coffee server database.
+
+    If upsert is True, all the articles are written in a single transaction
+    with executemany. Articles that are already in the DB are only updated if
+    their content hash (title, authors, abstract, comments) changed, and their
+    votes, reservations, and presenters are kept, so re-inserting the same day
+    is safe and cheap. If upsert is False, the articles are written with insert
+    or replace, which resets all the columns of existing rows.
+
+    '''
+
+    # open the database if needed and get a cursor
+    if not database:
+        database, cursor = opendb()
+        closedb = True
+    else:
+        cursor = database.cursor()
+        closedb = False
+
+    # make sure we know that the dt is in UTC
+    arxiv_dt = arxiv['utc']
+    if not arxiv_dt.tzinfo:
+        arxiv_dt = arxiv_dt.replace(tzinfo=utc)
+
+    try:
+
+        ensure_content_hash_column(database)
+        rows = get_article_rows(arxiv, verbose=verbose)
+
+        if upsert:
+
+            ninserted, nupdated = upsert_article_rows(rows, cursor)
+
+            print('%s articles inserted, %s updated, %s unchanged' %
+                  (ninserted, nupdated, len(rows) - ninserted - nupdated))
+
+        else:
+
+            # insert or replace resets the votes and reservations of existing
+            # rows too. the votes go first, so their triggers don't touch the
+            # new rows.
+            cursor.executemany(
+                'delete from votes where utcdate = ? and arxiv_id = ?',
+                [(x[1], x[5]) for x in rows]
+            )
+            cursor.executemany(
+                'delete from reservations where utcdate = ? and arxiv_id = ?',
+                [(x[1], x[5]) for x in rows]
+            )
+
+            for params in rows:
+                cursor.execute(ARTICLE_INSERT_QUERY, params)
+
+        database.commit()
+        bump_listing_versions([arxiv_dt.date()])
+
+        # insert or replace doesn't fire the delete trigger for the rows it
+        # replaces, so recount the days written here
+        if not upsert:
+            rebuild_daily_summary(utcdates=sorted(set(x[1] for x in rows)),
+                                  database=database)
 
     except Exception as e:
 
         print('could not insert articles into the DB, error was %s' % e)
         database.rollback()
 
-    # once we're done with the inserting articles bit, tag all local authors if
-    # directed to do so
-    if tag_locals:
-        tag_local_authors(arxiv_dt.date(),
-                          database=database,
-                          firstname_match_threshold=firstname_match_threshold,
-                          fullname_match_threshold=fullname_match_threshold,
-                          update_db=True,
-                          verbose=verbose)
+    # once we're done with the inserting articles bit, tag all local authors if
+    # directed to do so
+    if tag_locals:
+        tag_local_authors(arxiv_dt.date(),
+                          database=database,
+                          firstname_match_threshold=firstname_match_threshold,
+                          fullname_match_threshold=fullname_match_threshold,
+                          update_db=True,
+                          verbose=verbose)
+
+    # the day snapshots don't know about the new papers
+    drop_day_snapshots()
+
+
+    # at the end, close the cursor and DB connection
+    if closedb:
+        cursor.close()
+        database.close()
+
+
+
+## BACKFILLING ARCHIVES
+
+# the backfill never overwrites a row that's already in the DB so it doesn't
+# clobber the votes, reservations, and presenters of days that were already
+# inserted by the nightly update
+BACKFILL_INSERT_QUERY = ARTICLE_UPSERT_INSERT_QUERY
+
+
+def get_database_file(database):
+    '''
+    This returns the absolute path to the file of the main database the
+    connection has open, from PRAGMA database_list. This is '' for an in-memory
+    database.
+
+    '''
+
+    cursor = database.cursor()
+    cursor.execute('pragma database_list')
+    rows = cursor.fetchall()
+    cursor.close()
+
+    for row in rows:
+        if row[1] == 'main':
+            return os.path.abspath(row[2]) if row[2] else ''
+
+    return ''
+
+
+
+def load_backfill_checkpoint(database, checkpoint=BACKFILL_CHECKPOINT):
+    '''
+    This loads the set of listing dates that have already been backfilled into
+    the database the connection in database has open.
+
+    '''
+
+    if not os.path.exists(checkpoint):
+        return set()
+
+    # an in-memory database doesn't outlive the backfill that filled it
+    dbfile = get_database_file(database)
+    if not dbfile:
+        return set()
+
+    try:
+
+        with open(checkpoint,'rb') as fd:
+            state = json.load(fd)
+
+        # a checkpoint for some other database doesn't count
+        if state.get('database') != dbfile:
+            return set()
+
+        return set(state.get('done', []))
+
+    except Exception as e:
+
+        print('could not read backfill checkpoint %s, error was %s' %
+              (checkpoint, e))
+        return set()
+
+
+
+def save_backfill_checkpoint(done, database, checkpoint=BACKFILL_CHECKPOINT):
+    '''
+    This writes the set of backfilled listing dates for the database the
+    connection in database has open to the checkpoint file. The file is
+    replaced atomically so an interrupted backfill always leaves a usable
+    checkpoint behind.
+
+    '''
+
+    state = {'database':get_database_file(database),
+             'done':sorted(done)}
+
+    tmpfile = '%s.tmp' % checkpoint
+    with open(tmpfile,'wb') as fd:
+        json.dump(state, fd)
+    os.rename(tmpfile, checkpoint)
+
+
+
+def _backfill_parse_worker(task):
+    '''
+    This is the process pool worker for backfill_articles. It loads a saved
+    listing and turns it into DB rows so only plain tuples are sent back to the
+    parent process.
+
+    '''
+
+    import arxivutils
+
+    listingfile, backend, papers_only = task
+
+    try:
+        arxiv = arxivutils.load_saved_listing(listingfile,
+                                              backend=backend,
+                                              papers_only=papers_only)
+        return listingfile, get_article_rows(arxiv)
+
+    except Exception as e:
+
+        print('could not parse saved listing %s, error was %s' %
+              (listingfile, e))
+        return listingfile, None
+
+
+
+def backfill_articles(listingdir,
+                      database=None,
+                      nworkers=None,
+                      batchdays=50,
+                      tag_locals=True,
+                      fullname_match_threshold=72,
+                      firstname_match_threshold=93,
+                      papers_only=False,
+                      backend=None,
+                      resume=True,
+                      checkpoint=BACKFILL_CHECKPOINT,
+                      listing_url=None):
+    '''
+    This rebuilds or extends the arxiv table from a directory of saved listings:
+    the data/*-UT-arxiv.pkl pickles written by arxiv_update(pickledict=True),
+    saved /new page HTML files with a YYYY-MM-DD date in their names, or the
+    raw *.html.gz snapshots in the listing cache. Only the cache snapshots of
+    listing_url (default: the main listing in arxivutils.LISTING_URLS) are
+    used, and partial ones are skipped (see arxivutils.find_saved_listings).
+
+    The listings are parsed in a pool of nworkers processes (default: one per
+    CPU) and written to the DB in date order, batchdays days per
+    transaction. Rows that are already in the DB are left alone. Local authors
+    are tagged for each day after its batch is committed if tag_locals is True.
+
+    Completed dates are recorded in the checkpoint file after each batch, so a
+    backfill that's interrupted can just be run again to pick up where it left
+    off. Use resume=False to redo all the dates in listingdir.
+
+    Use papers_only=True if the saved HTML listings are /pastweek pages.
+
+    Returns a dict with the number of days and articles inserted and the list of
+    listings that couldn't be parsed.
+
+    '''
+
+    import arxivutils
+
+    if backend is None:
+        backend = arxivutils.PARSER_BACKEND
+
+    # open the database if needed and get a cursor
+    if not database:
+        database, cursor = opendb()
+        closedb = True
+    else:
+        cursor = database.cursor()
+        closedb = False
+
+    ensure_content_hash_column(database)
+    done = load_backfill_checkpoint(database, checkpoint) if resume else set()
+
+    listings = arxivutils.find_saved_listings(listingdir, url=listing_url)
+    pending = [(x, y) for (x, y) in listings if x.isoformat() not in done]
+
+    print('backfilling %s of %s saved listings from %s' %
+          (len(pending), len(listings), listingdir))
+
+    results = {'ndays':0,
+               'narticles':0,
+               'failed':[]}
+
+    pool = Pool(nworkers)
+
+    try:
+
+        # imap hands the parsed listings back in date order while the workers
+        # keep parsing ahead of the writer
+        parsed = pool.imap(
+            _backfill_parse_worker,
+            [(y, backend, papers_only) for (x, y) in pending]
+        )
+
+        batchdates = []
+
+        for (listing_date, listingfile), (_, rows) in zip(pending, parsed):
+
+            if rows is None:
+                results['failed'].append(listingfile)
+                continue
+
+            # the date of the listing file wins over the one in a pickle,
+            # since that's the date the checkpoint goes by
+            cursor.executemany(
+                BACKFILL_INSERT_QUERY,
+                [x[:1] + (listing_date,) + x[2:] for x in rows]
+            )
+
+            batchdates.append(listing_date)
+            results['narticles'] += len(rows)
+
+            if len(batchdates) == batchdays:
+                _commit_backfill_batch(batchdates, done, database, checkpoint,
+                                       tag_locals,
+                                       fullname_match_threshold,
+                                       firstname_match_threshold)
+                results['ndays'] += len(batchdates)
+                batchdates = []
+
+        if len(batchdates) > 0:
+            _commit_backfill_batch(batchdates, done, database, checkpoint,
+                                   tag_locals,
+                                   fullname_match_threshold,
+                                   firstname_match_threshold)
+            results['ndays'] += len(batchdates)
+
+        pool.close()
+
+    except:
+
+        print('backfill interrupted, rolling back the current batch. '
+              'run again to resume from the last checkpoint')
+        database.rollback()
+        pool.terminate()
+        raise
+
+    finally:
+
+        pool.join()
+
+        # at the end, close the cursor and DB connection
+        if closedb:
+            cursor.close()
+            database.close()
+
+    print('backfilled %s days with %s articles, %s listings failed' %
+          (results['ndays'], results['narticles'], len(results['failed'])))
+
+    return results
+
+
+
+def _commit_backfill_batch(batchdates,
+                           done,
+                           database,
+                           checkpoint,
+                           tag_locals,
+                           fullname_match_threshold,
+                           firstname_match_threshold):
+    '''
+    This commits a batch of backfilled days, tags their local authors, and
+    then records them in the checkpoint.
+
+    '''
+
+    database.commit()
+
+    if tag_locals:
+        for batchdate in batchdates:
+            tag_local_authors(batchdate,
+                              database=database,
+                              firstname_match_threshold=firstname_match_threshold,
+                              fullname_match_threshold=fullname_match_threshold,
+                              update_db=True)
+
+    done.update(x.isoformat() for x in batchdates)
+    save_backfill_checkpoint(done, database, checkpoint=checkpoint)
+
+    print('backfilled listings for %s to %s' % (batchdates[0], batchdates[-1]))
+
+
+
+## LISTING VERSIONS
+
+# these are per-day version counters for the listing pages. they're bumped
+# whenever this process changes something shown on a day's listing, so
+# coffeehandlers knows when its cached pages for the day are out of date.
+# changes committed by other processes (e.g. the nightly ingest) are caught with
+# PRAGMA data_version instead.
+LISTING_VERSIONS = {}
+
+
+def bump_listing_versions(utcdates):
+    '''
+    This bumps the listing versions for the given list of utcdates
+    (datetime.dates or YYYY-MM-DD strings).
+
+    '''
+
+    for utcdate in utcdates:
+
+        if not isinstance(utcdate, basestring):
+            utcdate = utcdate.strftime('%Y-%m-%d')
+
+        LISTING_VERSIONS[utcdate] = LISTING_VERSIONS.get(utcdate, 0) + 1
+
+
+
+def bump_article_listing_versions(arxivid, cursor):
+    '''
+    This bumps the listing versions for the days that show arxivid: its own
+    listing date(s), and the RESERVE_INTERVAL_DAYS after them, whose listings
+    include it if it's reserved.
+
+    '''
+
+    cursor.execute('select distinct utcdate from arxiv where arxiv_id = ?',
+                   (arxivid,))
+    rows = cursor.fetchall()
+
+    utcdates = []
+    for row in rows:
+        for x in range(RESERVE_INTERVAL_DAYS + 1):
+            utcdates.append(row[0] + timedelta(days=x))
+
+    bump_listing_versions(utcdates)
+
+
+
+def get_data_version(database):
+    '''
+    This returns the PRAGMA data_version of the database connection.
+
+    '''
+
+    cursor = database.cursor()
+    cursor.execute('pragma data_version')
+    data_version = cursor.fetchone()[0]
+    cursor.close()
+
+    return data_version
+
+
+
+def get_listing_version(utcdate, database):
+    '''
+    This returns the current version of the listing for utcdate (a YYYY-MM-DD
+    string) as seen by this database connection. Returns a tuple of the day's
+    listing version and the connection's PRAGMA data_version, which changes if
+    another connection commits anything.
+
+    '''
+
+    return LISTING_VERSIONS.get(utcdate, 0), get_data_version(database)
+
+
+
+def get_archive_version(database):
+    '''
+    This returns the current version of the archive index as seen by this
+    database connection. The listing versions only ever go up, so their sum
+    changes whenever any day's listing does.
+
+    '''
+
+    return sum(LISTING_VERSIONS.values()), get_data_version(database)
+
+
+
+## DAY SNAPSHOTS
+
+# these are the columns of the arxiv table kept for each paper in a day
+# snapshot, in the same order as the rows of LISTING_QUERY
+SNAPSHOT_COLUMNS = (
+    'arxiv_id', 'day_serial', 'title', 'article_type',
+    'authors', 'comments', 'abstract', 'link', 'pdf', 'nvotes', 'voters',
+    'presenters', 'local_authors', 'reserved', 'reservers', 'utcdate',
+    'local_author_indices', 'local_author_specaffils', 'author_html'
+)
+
+SNAPSHOT_QUERY = (
+    "select %s from arxiv where utcdate between date(?) and date(?) "
+    "order by utcdate asc, day_serial asc, article_type asc, arxiv_id asc" %
+    ', '.join(SNAPSHOT_COLUMNS)
+)
+
+SNAPSHOT_ARTICLE_QUERY = (
+    "select %s from arxiv where arxiv_id = ?" % ', '.join(SNAPSHOT_COLUMNS)
+)
+
+SNAPSHOT_VOTES_QUERY = (
+    "select utcdate, arxiv_id, user_id from votes "
+    "where utcdate between date(?) and date(?)"
+)
+
+
+class SnapshotArticle(object):
+    '''
+    This holds one row of the arxiv table in a DaySnapshot, and the set of
+    users who voted for it.
+
+    '''
+
+    __slots__ = SNAPSHOT_COLUMNS + ('voter_ids',)
+
+    def __init__(self, row, voter_ids=()):
+        self.update(row)
+        self.voter_ids = frozenset(voter_ids)
+
+
+    def update(self, row):
+        '''
+        This sets all columns from a row of SNAPSHOT_ARTICLE_QUERY.
+
+        '''
+
+        for column, value in zip(SNAPSHOT_COLUMNS, row):
+            setattr(self, column, value)
+
+
+
+class DaySnapshot(object):
+    '''
+    This holds all papers shown on the listing for utcdate: the papers of
+    utcdate itself and of the RESERVE_INTERVAL_DAYS before it. The snapshot is
+    valid as long as the connection it was loaded with sees the same PRAGMA
+    data_version, i.e. until another connection commits something. Changes made
+    through this process's write paths are patched in place by
+    patch_day_snapshots.
+
+    '''
+
+    __slots__ = ('utcdate', 'data_version', 'articles', 'by_arxivid')
+
+    def __init__(self, utcdate, data_version, rows, votes):
+
+        voter_ids = {}
+        for vote_utcdate, arxivid, user_id in votes:
+            voter_ids.setdefault((vote_utcdate, arxivid), set()).add(user_id)
+
+        self.utcdate = utcdate
+        self.data_version = data_version
+        self.articles = [SnapshotArticle(x, voter_ids.get((x[15], x[0]), ()))
+                         for x in rows]
+
+        self.by_arxivid = {}
+        for article in self.articles:
+            self.by_arxivid.setdefault(article.arxiv_id, []).append(article)
+
+
+    def listing_rows(self, astronomyonly=False):
+        '''
+        This returns the rows LISTING_QUERY would return for this snapshot's
+        utcdate.
+
+        '''
+
+        listing_dt = datetime.strptime(self.utcdate, '%Y-%m-%d').date()
+        rows = []
+
+        for x in self.articles:
+
+            listing_day = x.utcdate == listing_dt
+
+            if not listing_day and x.reserved != 1:
+                continue
+            if astronomyonly and x.article_type != 'astronomy':
+                continue
+
+            if x.local_authors == 1 or x.nvotes > 0 or x.reserved == 1:
+                abstract = x.abstract
+            else:
+                abstract = None
+
+            rows.append((x.arxiv_id, x.day_serial, x.title, x.article_type,
+                         x.authors, x.comments, abstract, x.link, x.pdf,
+                         x.nvotes, x.voters, x.presenters, x.local_authors,
+                         x.reserved, x.reservers, x.utcdate,
+                         x.local_author_indices, x.local_author_specaffils,
+                         1 if listing_day else 0, x.author_html))
+
+        return rows
+
+
+    def user_votes(self, username):
+        '''
+        This returns the arxivids of the papers on utcdate that username voted
+        for.
+
+        '''
+
+        listing_dt = datetime.strptime(self.utcdate, '%Y-%m-%d').date()
+
+        return [x.arxiv_id for x in self.articles
+                if (x.utcdate == listing_dt and
+                    username in x.voter_ids)]
+
+
+    def user_reservations(self, username):
+        '''
+        This returns the arxivids of the papers in the snapshot reserved by
+        username.
+
+        '''
+
+        return [x.arxiv_id for x in self.articles
+                if (x.reserved == 1 and
+                    x.reservers == username)]
+
+
+
+# these are the snapshots for the days whose listings can still change, keyed
+# by utcdate. they're only kept for long-lived connections passed in by the
+# caller (i.e. the server's), since PRAGMA data_version is per connection.
+DAY_SNAPSHOTS = {}
+
+# these are called with no args before a day snapshot is loaded from the
+# database. the write-behind journal in votejournal.py adds its flush here, so
+# the votes and reservations it has queued are in the database before a
+# snapshot is loaded again and can't be lost from it.
+SNAPSHOT_RELOAD_HOOKS = []
+
+
+def get_day_snapshot(utcdate, database):
+    '''
+    This returns the DaySnapshot for utcdate (a YYYY-MM-DD string), loading it
+    if there isn't a current one yet. Returns None for days outside the
+    reservation window, whose listings are frozen and aren't worth keeping
+    around.
+
+    '''
+
+    listing_dt = datetime.strptime(utcdate, '%Y-%m-%d').date()
+    today = datetime.now(tz=utc).date()
+
+    # drop the snapshots for the days that have left the window
+    for snapdate in list(DAY_SNAPSHOTS.keys()):
+        if ((today - datetime.strptime(snapdate, '%Y-%m-%d').date()).days >
+            RESERVE_INTERVAL_DAYS):
+            del DAY_SNAPSHOTS[snapdate]
+
+    if not 0 <= (today - listing_dt).days <= RESERVE_INTERVAL_DAYS:
+        return None
+
+    data_version = get_data_version(database)
+    snapshot = DAY_SNAPSHOTS.get(utcdate)
+
+    if snapshot is None or snapshot.data_version != data_version:
+
+        for hook in SNAPSHOT_RELOAD_HOOKS:
+            hook()
+
+        earliest_dt = listing_dt - timedelta(days=RESERVE_INTERVAL_DAYS)
+
+        query_params = (earliest_dt.strftime('%Y-%m-%d'), utcdate)
+
+        cursor = database.cursor()
+        cursor.execute(SNAPSHOT_QUERY, query_params)
+        rows = cursor.fetchall()
+        cursor.execute(SNAPSHOT_VOTES_QUERY, query_params)
+        votes = cursor.fetchall()
+        cursor.close()
+
+        snapshot = DaySnapshot(utcdate, data_version, rows, votes)
+
+        DAY_SNAPSHOTS[utcdate] = snapshot
+
+    return snapshot
+
+
+
+def patch_day_snapshots(arxivid, cursor):
+    '''
+    This updates the papers for arxivid in the day snapshots from the arxiv
+    table. The write paths call this after they commit a change to a paper.
+
+    '''
+
+    snapshots = [x for x in DAY_SNAPSHOTS.values() if arxivid in x.by_arxivid]
+    if not snapshots:
+        return
 
+    cursor.execute(SNAPSHOT_ARTICLE_QUERY, (arxivid,))
+    rows = {(x[15], x[3], x[1]):x for x in cursor.fetchall()}
+
+    cursor.execute('select utcdate, user_id from votes where arxiv_id = ?',
+                   (arxivid,))
+    voter_ids = {}
+    for vote_utcdate, user_id in cursor.fetchall():
+        voter_ids.setdefault(vote_utcdate, set()).add(user_id)
+
+    for snapshot in snapshots:
+        for article in snapshot.by_arxivid[arxivid]:
+            row = rows.get((article.utcdate,
+                            article.article_type,
+                            article.day_serial))
+            if row:
+                article.update(row)
+                article.voter_ids = frozenset(
+                    voter_ids.get(article.utcdate, ())
+                )
+
+
+
+def drop_day_snapshots():
+    '''
+    This drops all day snapshots, so they're loaded again when next needed.
+
+    '''
+
+    DAY_SNAPSHOTS.clear()
+
+
+
+def snapshot_vote(arxivid, username, vote, utcdate, max_votes, database):
+    '''
+    This decides a vote the way cast_vote would, using the day snapshot for
+    utcdate (a YYYY-MM-DD string) instead of the database. If the vote goes
+    through, the papers for arxivid are updated in all day snapshots and the
+    listing versions for its days are bumped, but nothing is written to the
+    arxiv or votes tables.
+
+    Returns (status, nvotes) like cast_vote, or None if arxivid isn't in the
+    snapshot for utcdate. This is used by the write-behind journal in
+    votejournal.py, which writes the vote to the database later.
+
+    '''
+
+    snapshot = get_day_snapshot(utcdate, database)
+    if snapshot is None or arxivid not in snapshot.by_arxivid:
+        return None
+
+    articles = [x for y in DAY_SNAPSHOTS.values()
+                for x in y.by_arxivid.get(arxivid, ())]
+    voter = frozenset([username])
+
+    if vote == 'up':
+
+        voted = any(username in x.voter_ids
+                    for x in snapshot.by_arxivid[arxivid])
+
+        if (not voted and
+            max_votes is not None and
+            len(snapshot.user_votes(username)) >= max_votes):
+            return 'quota', snapshot.by_arxivid[arxivid][0].nvotes
+
+        for x in articles:
+            if username not in x.voter_ids:
+                x.voter_ids = x.voter_ids | voter
+                x.nvotes = x.nvotes + 1
+
+    elif vote == 'down':
+
+        for x in articles:
+            if username in x.voter_ids:
+                x.voter_ids = x.voter_ids - voter
+                x.nvotes = x.nvotes - 1
+
+    else:
+        return 'invalid', None
+
+    cursor = database.cursor()
+    bump_article_listing_versions(arxivid, cursor)
+    cursor.close()
+
+    return 'ok', snapshot.by_arxivid[arxivid][0].nvotes
+
+
+
+def snapshot_reservation(arxivid, username, reservation, utcdate,
+                         max_reservations, database):
+    '''
+    This decides a reservation the way cast_reservation would, using the day
+    snapshot for utcdate (a YYYY-MM-DD string) instead of the database. If the
+    reservation goes through, the papers for arxivid are updated in all day
+    snapshots and the listing versions for its days are bumped, but nothing is
+    written to the arxiv or reservations tables.
+
+    Returns (status, row) like cast_reservation, or None if arxivid isn't in
+    the snapshot for utcdate.
+
+    '''
+
+    snapshot = get_day_snapshot(utcdate, database)
+    if snapshot is None or arxivid not in snapshot.by_arxivid:
+        return None
+
+    articles = [x for y in DAY_SNAPSHOTS.values()
+                for x in y.by_arxivid.get(arxivid, ())]
+    first = snapshot.by_arxivid[arxivid][0]
+
+    if reservation == 'reserve':
+
+        unreserved = [x for x in articles if x.reservers is None]
+
+        if (unreserved and
+            max_reservations is not None and
+            len(snapshot.user_reservations(username)) >= max_reservations):
+            return 'quota', (first.reserved, first.reservers)
+
+        for x in unreserved:
+            x.reserved = 1
+            x.reservers = username
+
+    elif reservation == 'release':
+
+        for x in articles:
+            if x.reservers == username:
+                x.reserved = 0
+                x.reservers = None
+
+    else:
+        return 'invalid', None
+
+    cursor = database.cursor()
+    bump_article_listing_versions(arxivid, cursor)
+    cursor.close()
+
+    return 'ok', (first.reserved, first.reservers)
 
-    # at the end, close the cursor and DB connection
-    if closedb:
-        cursor.close()
-        database.close()
 
 
 ## RETRIEVING ARTICLES
 
+# this fetches all of the rows needed for a listing page in a single pass: the
+# rows for the listing date itself and the reserved rows in the reservation
+# window before it. the astronomyonly filter is a parameter so this is always
+# the same statement and can stay in the connection's statement cache. the
+# abstracts of the papers that end up in the other articles bucket aren't shown
+# until they're expanded, so they're left out here and fetched by the listing
+# pages with get_article_abstracts instead.
+LISTING_QUERY = (
+    "select arxiv_id, day_serial, title, article_type, "
+    "authors, comments, "
+    "(case when local_authors = 1 or nvotes > 0 or reserved = 1 "
+    "then abstract else null end) as abstract, "
+    "link, pdf, nvotes, voters, "
+    "presenters, local_authors, reserved, reservers, utcdate, "
+    "local_author_indices, local_author_specaffils, "
+    "(utcdate = date(?)) as listing_day, author_html "
+    "from arxiv where "
+    "(utcdate between date(?) and date(?)) and "
+    "(utcdate = date(?) or reserved = 1) and "
+    "(? = 0 or article_type = 'astronomy') "
+    "order by utcdate asc, day_serial asc, article_type asc"
+)
+
+
+def get_listing_buckets(cursor, utcdate, astronomyonly=False, database=None):
+    '''
+    This gets the rows of LISTING_QUERY for the given utcdate and sorts them
+    into the local, voted, other, and reserved buckets in one pass. If the
+    server's database connection is given, the rows come from the day snapshot
+    for utcdate if there is one.
+
+    Each bucket keeps the ordering of the separate per-bucket queries this
+    replaces: local and voted articles by nvotes desc, other articles by
+    article_type asc, day_serial asc, and reserved articles by arxiv_id desc.
+    Local articles are excluded from voted, and local, voted, and reserved
+    articles are all excluded from other. The listing day rows don't include
+    the utcdate column; the reserved rows do (at index 15). The authors column
+    (at index 4) of the local articles is their author_html, with the local
+    authors highlighted. The abstract column (at index 6) of the other articles
+    is None.
+
+    Returns (local_articles, voted_articles, other_articles,
+    reserved_articles).
+
+    '''
+
+    if database is not None:
+        snapshot = get_day_snapshot(utcdate, database)
+    else:
+        snapshot = None
+
+    if snapshot is not None:
+
+        rows = snapshot.listing_rows(astronomyonly=astronomyonly)
+
+    else:
+
+        given_dt = datetime.strptime(utcdate,'%Y-%m-%d')
+        earliest_dt = given_dt - timedelta(days=RESERVE_INTERVAL_DAYS)
+        earliest_utcdate = earliest_dt.strftime('%Y-%m-%d')
+
+        query_params = (utcdate, earliest_utcdate, utcdate, utcdate,
+                        1 if astronomyonly else 0)
+        cursor.execute(LISTING_QUERY, query_params)
+        rows = cursor.fetchall()
+
+    local_articles, voted_articles, other_articles = [], [], []
+    reserved_articles = []
+
+    local_ids, excluded_from_other = set(), set()
+    remaining_rows = []
+
+    for row in rows:
+
+        listing_row = row[:18]
+
+        if row[13] == 1:
+            reserved_articles.append(listing_row)
+            excluded_from_other.add(row[0])
+
+        if not row[18]:
+            continue
+
+        # drop the utcdate column for the listing day rows
+        day_row = listing_row[:15] + listing_row[16:]
+
+        if row[12] == 1:
+
+            # local articles show the pre-rendered author list with the local
+            # authors highlighted
+            day_row = list(day_row)
+            day_row[4] = row[19] or render_author_html(row[4], row[16])
+
+            local_articles.append(day_row)
+            local_ids.add(row[0])
+            excluded_from_other.add(row[0])
+        else:
+            remaining_rows.append(day_row)
+
+    for row in remaining_rows:
+
+        if row[0] in local_ids:
+            continue
+
+        if row[9] > 0:
+            voted_articles.append(row)
+            excluded_from_other.add(row[0])
+        else:
+            other_articles.append(row)
+
+    other_articles = [x for x in other_articles
+                      if x[0] not in excluded_from_other]
+
+    # these sorts are stable, so ties stay in day_serial order
+    local_articles.sort(key=lambda x: x[9], reverse=True)
+    voted_articles.sort(key=lambda x: x[9], reverse=True)
+    other_articles.sort(key=lambda x: x[3])
+    reserved_articles.sort(key=lambda x: x[0], reverse=True)
+
+    return local_articles, voted_articles, other_articles, reserved_articles
+
+
+
 def get_articles_for_listing(utcdate=None,
                              database=None,
                              astronomyonly=False):
@@ -572,215 +2325,331 @@ def get_articles_for_listing(utcdate=None,
         row = cursor.fetchone()
         utcdate = row[0].strftime('%Y-%m-%d')
 
+    (local_articles, voted_articles,
+     other_articles, reserved_articles) = get_listing_buckets(
+         cursor,
+         utcdate,
+         astronomyonly=astronomyonly,
+         database=None if closedb else database
+     )
+
+    # at the end, close the cursor and DB connection
+    if closedb:
+        cursor.close()
+        database.close()
+
+    return [utcdate,
+            local_articles,
+            voted_articles,
+            other_articles,
+            reserved_articles]
 
-    local_articles, voted_articles, other_articles = [], [], []
-    reserved_articles = []
 
-    articles_excluded_from_voted = []
-    articles_excluded_from_other = []
-
-    # deal with the local articles first
-    if astronomyonly:
-        query = ("select arxiv_id, day_serial, title, article_type, "
-                 "authors, comments, abstract, link, pdf, nvotes, voters, "
-                 "presenters, local_authors, reserved, reservers, "
-                 "local_author_indices, local_author_specaffils from arxiv "
-                 "where "
-                 "utcdate = date(?) and local_authors = 1 "
-                 "and article_type = 'astronomy' "
-                 "order by nvotes desc")
+
+def get_articles_for_voting(database=None,
+                            astronomyonly=False):
+    '''
+    This grabs all articles from the database for today's date to show for
+    voting. The articles are sorted in arxiv_id order with papers and
+    cross_lists returned separately.
+
+    '''
+
+    # open the database if needed and get a cursor
+    if not database:
+        database, cursor = opendb()
+        closedb = True
     else:
-        query = ("select arxiv_id, day_serial, title, article_type, "
-                 "authors, comments, abstract, link, pdf, nvotes, voters, "
-                 "presenters, local_authors, reserved, reservers, "
-                 "local_author_indices, local_author_specaffils from arxiv "
-                 "where "
-                 "utcdate = date(?) and local_authors = 1 "
-                 "order by nvotes desc")
-
-    query_params = (utcdate,)
-    cursor.execute(query, query_params)
-    rows = cursor.fetchall()
+        cursor = database.cursor()
+        closedb = False
+
+    # this is today's date
+    utcdate = datetime.now(tz=utc).strftime('%Y-%m-%d')
+
+    (local_articles, voted_articles,
+     other_articles, reserved_articles) = get_listing_buckets(
+         cursor,
+         utcdate,
+         astronomyonly=astronomyonly,
+         database=None if closedb else database
+     )
+
+    # at the end, close the cursor and DB connection
+    if closedb:
+        cursor.close()
+        database.close()
+
+    return [local_articles,
+            voted_articles,
+            other_articles,
+            reserved_articles]
 
-    if len(rows) > 0:
-        for row in rows:
-            local_articles.append(list(row))
-            articles_excluded_from_other.append(row[0])
-            articles_excluded_from_voted.append(row[0])
-
-    # deal with articles that have votes next
-    # finally deal with the other articles
-    if len(articles_excluded_from_voted) > 0:
-
-        if astronomyonly:
-            query = ("select arxiv_id, day_serial, title, article_type, "
-                     "authors, comments, abstract, link, pdf, nvotes, voters, "
-                     "presenters, local_authors, reserved, reservers, "
-                     "local_author_indices, local_author_specaffils from arxiv "
-                     "where "
-                     "utcdate = date(?) and "
-                     "arxiv_id not in ({exclude_list}) "
-                     "and nvotes > 0 "
-                     "and article_type = 'astronomy' "
-                     "order by nvotes desc")
-        else:
-            query = ("select arxiv_id, day_serial, title, article_type, "
-                     "authors, comments, abstract, link, pdf, nvotes, voters, "
-                     "presenters, local_authors, reserved, reservers, "
-                     "local_author_indices, local_author_specaffils from arxiv "
-                     "where "
-                     "utcdate = date(?) and "
-                     "arxiv_id not in ({exclude_list}) "
-                     "and nvotes > 0 "
-                     "order by nvotes desc")
-
-        placeholders = ', '.join('?' for x in articles_excluded_from_voted)
-        query = query.format(exclude_list=placeholders)
-        query_params = tuple([utcdate] + articles_excluded_from_voted)
 
+
+def get_article_abstracts(arxivids, database=None):
+    '''
+    This returns a dict of the abstracts for the given list of arxivids, for
+    the listing pages to load the abstracts of the other articles on demand.
+    Unknown arxivids are left out.
+
+    '''
+
+    # open the database if needed and get a cursor
+    if not database:
+        database, cursor = opendb()
+        closedb = True
     else:
+        cursor = database.cursor()
+        closedb = False
 
-        if astronomyonly:
-            query = ("select arxiv_id, day_serial, title, article_type, "
-                     "authors, comments, abstract, link, pdf, nvotes, voters, "
-                     "presenters, local_authors, reserved, reservers, "
-                     "local_author_indices, local_author_specaffils from arxiv "
-                     "where "
-                     "utcdate = date(?) "
-                     "and nvotes > 0 "
-                     "and article_type = 'astronomy' "
-                     "order by nvotes desc")
-        else:
-            query = ("select arxiv_id, day_serial, title, article_type, "
-                     "authors, comments, abstract, link, pdf, nvotes, voters, "
-                     "presenters, local_authors, reserved, reservers, "
-                     "local_author_indices, local_author_specaffils from arxiv "
-                     "where "
-                     "utcdate = date(?) "
-                     "and nvotes > 0 "
-                     "order by nvotes desc")
+    abstracts = {}
 
-        query_params = (utcdate,)
+    if len(arxivids) > 0:
 
-    cursor.execute(query, query_params)
-    rows = cursor.fetchall()
+        # if a paper was listed on more than one day, the latest abstract wins
+        query = ('select arxiv_id, abstract from arxiv '
+                 'where arxiv_id in (%s) order by utcdate asc' %
+                 ','.join(['?' for x in arxivids]))
+        cursor.execute(query, tuple(arxivids))
 
-    if len(rows) > 0:
-        for row in rows:
-            voted_articles.append(row)
-            articles_excluded_from_other.append(row[0])
-
-    # get the historical reserved articles list
-    if astronomyonly:
-        query = ("select arxiv_id, day_serial, title, article_type, "
-                 "authors, comments, abstract, link, pdf, nvotes, voters, "
-                 "presenters, local_authors, reserved, reservers, utcdate, "
-                 "local_author_indices, local_author_specaffils "
-                 "from arxiv where "
-                 "(utcdate between date(?) and date(?)) and reserved = 1 "
-                 "and article_type = 'astronomy' "
-                 "order by arxiv_id desc")
+        for row in cursor.fetchall():
+            abstracts[row[0]] = row[1]
+
+    # at the end, close the cursor and DB connection
+    if closedb:
+        cursor.close()
+        database.close()
+
+    return abstracts
+
+
+
+## ARTICLE ARCHIVES
+
+# these keep the daily_summary table in step with the arxiv table. updates
+# only touch the summary if one of the columns it counts changes.
+DAILY_SUMMARY_TRIGGERS = (
+    "create trigger if not exists summary_after_insert "
+    "after insert on arxiv begin "
+    "insert or ignore into daily_summary (utcdate, npapers, nlocal, nvoted) "
+    "values (new.utcdate, 0, 0, 0); "
+    "update daily_summary set npapers = npapers + 1, "
+    "nlocal = nlocal + (case when new.local_authors = 1 then 1 else 0 end), "
+    "nvoted = nvoted + (case when new.nvotes > 0 then 1 else 0 end) "
+    "where utcdate = new.utcdate; "
+    "end",
+    "create trigger if not exists summary_after_delete "
+    "after delete on arxiv begin "
+    "update daily_summary set npapers = npapers - 1, "
+    "nlocal = nlocal - (case when old.local_authors = 1 then 1 else 0 end), "
+    "nvoted = nvoted - (case when old.nvotes > 0 then 1 else 0 end) "
+    "where utcdate = old.utcdate; "
+    "delete from daily_summary where utcdate = old.utcdate and npapers <= 0; "
+    "end",
+    "create trigger if not exists summary_after_update "
+    "after update of utcdate, local_authors, nvotes on arxiv begin "
+    "update daily_summary set npapers = npapers - 1, "
+    "nlocal = nlocal - (case when old.local_authors = 1 then 1 else 0 end), "
+    "nvoted = nvoted - (case when old.nvotes > 0 then 1 else 0 end) "
+    "where utcdate = old.utcdate; "
+    "insert or ignore into daily_summary (utcdate, npapers, nlocal, nvoted) "
+    "values (new.utcdate, 0, 0, 0); "
+    "update daily_summary set npapers = npapers + 1, "
+    "nlocal = nlocal + (case when new.local_authors = 1 then 1 else 0 end), "
+    "nvoted = nvoted + (case when new.nvotes > 0 then 1 else 0 end) "
+    "where utcdate = new.utcdate; "
+    "delete from daily_summary where utcdate = old.utcdate and npapers <= 0; "
+    "end",
+)
+
+DAILY_SUMMARY_QUERY = (
+    "select utcdate, count(*), "
+    "sum(case when local_authors = 1 then 1 else 0 end), "
+    "sum(case when nvotes > 0 then 1 else 0 end) from arxiv "
+)
+
+
+def ensure_daily_summary_table(database):
+    '''
+    This creates the daily_summary table and the triggers that keep it current
+    in databases created before it existed. Use rebuild_daily_summary to fill
+    it in after this.
+
+    '''
+
+    cursor = database.cursor()
+    cursor.execute(
+        'create table if not exists daily_summary ('
+        'utcdate date, '
+        'npapers integer, '
+        'nlocal integer, '
+        'nvoted integer, '
+        'primary key (utcdate))'
+    )
+    for trigger in DAILY_SUMMARY_TRIGGERS:
+        cursor.execute(trigger)
+    database.commit()
+    cursor.close()
+
+
+
+def rebuild_daily_summary(utcdates=None, database=None):
+    '''
+    This recomputes the daily_summary rows for the given list of utcdates from
+    the arxiv table, or the whole table if utcdates is None. Returns the number
+    of days summarized.
+
+    '''
+
+    # open the database if needed and get a cursor
+    if not database:
+        database, cursor = opendb()
+        closedb = True
     else:
-        query = ("select arxiv_id, day_serial, title, article_type, "
-                 "authors, comments, abstract, link, pdf, nvotes, voters, "
-                 "presenters, local_authors, reserved, reservers, utcdate, "
-                 "local_author_indices, local_author_specaffils "
-                 "from arxiv where "
-                 "(utcdate between date(?) and date(?)) and reserved = 1 "
-                 "order by arxiv_id desc")
-
-    # fetch all reserved articles up to RESERVE_INTERVAL_DAYS older than the
-    # given utcdate
-    given_dt = datetime.strptime(utcdate,'%Y-%m-%d')
-    earliest_dt = given_dt - timedelta(days=RESERVE_INTERVAL_DAYS)
-    earliest_utcdate = earliest_dt.strftime('%Y-%m-%d')
+        cursor = database.cursor()
+        closedb = False
 
-    query_params = (earliest_utcdate, utcdate)
-    cursor.execute(query, query_params)
-    rows = cursor.fetchall()
+    ensure_daily_summary_table(database)
 
-    if len(rows) > 0:
-        for row in rows:
-            reserved_articles.append(row)
-            articles_excluded_from_other.append(row[0])
-
-
-    # finally deal with the other articles
-    if len(articles_excluded_from_other) > 0:
-
-        if astronomyonly:
-            query = ("select arxiv_id, day_serial, title, article_type, "
-                     "authors, comments, abstract, link, pdf, nvotes, voters, "
-                     "presenters, local_authors, reserved, reservers, "
-                     "local_author_indices, local_author_specaffils from arxiv "
-                     "where "
-                     "utcdate = date(?) and "
-                     "arxiv_id not in ({exclude_list}) "
-                     "and article_type = 'astronomy' "
-                     "order by day_serial asc")
-        else:
-            query = ("select arxiv_id, day_serial, title, article_type, "
-                     "authors, comments, abstract, link, pdf, nvotes, voters, "
-                     "presenters, local_authors, reserved, reservers, "
-                     "local_author_indices, local_author_specaffils from arxiv "
-                     "where "
-                     "utcdate = date(?) and "
-                     "arxiv_id not in ({exclude_list}) "
-                     "order by article_type asc, day_serial asc")
-
-        placeholders = ', '.join('?' for x in articles_excluded_from_other)
-        query = query.format(exclude_list=placeholders)
-        query_params = tuple([utcdate] + articles_excluded_from_other)
+    if utcdates is None:
+
+        cursor.execute('delete from daily_summary')
+        cursor.execute(
+            'insert into daily_summary (utcdate, npapers, nlocal, nvoted) ' +
+            DAILY_SUMMARY_QUERY + 'group by utcdate'
+        )
+        ndays = cursor.rowcount
 
     else:
 
-        if astronomyonly:
-            query = ("select arxiv_id, day_serial, title, article_type, "
-                     "authors, comments, abstract, link, pdf, nvotes, voters, "
-                     "presenters, local_authors, reserved, reservers, "
-                     "local_author_indices, local_author_specaffils from arxiv "
-                     "where "
-                     "utcdate = date(?) "
-                     "and article_type = 'astronomy' "
-                     "order by day_serial asc")
-        else:
-            query = ("select arxiv_id, day_serial, title, article_type, "
-                     "authors, comments, abstract, link, pdf, nvotes, voters, "
-                     "presenters, local_authors, reserved, reservers, "
-                     "local_author_indices, local_author_specaffils from arxiv "
-                     "where "
-                     "utcdate = date(?) "
-                     "order by article_type asc, day_serial asc")
+        ndays = 0
 
-        query_params = (utcdate,)
+        for utcdate in utcdates:
 
-    cursor.execute(query, query_params)
-    rows = cursor.fetchall()
+            cursor.execute('delete from daily_summary where utcdate = ?',
+                           (utcdate,))
+            cursor.execute(
+                'insert into daily_summary (utcdate, npapers, nlocal, '
+                'nvoted) ' + DAILY_SUMMARY_QUERY +
+                'where utcdate = ? group by utcdate',
+                (utcdate,)
+            )
+            ndays = ndays + cursor.rowcount
 
-    if len(rows) > 0:
-        for row in rows:
-            other_articles.append(row)
+    database.commit()
+
+    # at the end, close the cursor and DB connection
+    if closedb:
+        cursor.close()
+        database.close()
+
+    return ndays
+
+
+
+def get_archive_index(start_date=None,
+                      end_date=None,
+                      database=None):
+    '''
+    This returns all article archives in reverse date order. The counts come
+    from the daily_summary table, which is kept current by triggers on the
+    arxiv table.
+
+    '''
+    # open the database if needed and get a cursor
+    if not database:
+        database, cursor = opendb()
+        closedb = True
+    else:
+        cursor = database.cursor()
+        closedb = False
 
+    query = ("select utcdate, npapers, nlocal, nvoted from daily_summary "
+             "order by utcdate desc")
+    cursor.execute(query)
+    rows = cursor.fetchall()
+
+    if rows and len(rows) > 0:
+        arxivdates, arxivpapers, arxivlocals, arxivvoted = zip(*rows)
+    else:
+        arxivdates, arxivpapers, arxivlocals, arxivvoted = [], [], [], []
 
     # at the end, close the cursor and DB connection
     if closedb:
         cursor.close()
         database.close()
 
-    return [utcdate,
-            list(local_articles),
-            voted_articles,
-            other_articles,
-            reserved_articles]
+    return (arxivdates, arxivpapers, arxivlocals, arxivvoted)
 
 
+## VOTERS AND PRESENTERS
 
-def get_articles_for_voting(database=None,
-                            astronomyonly=False):
+# these keep the nvotes column of the arxiv table equal to the number of votes
+# for each paper in the votes table. a repeated vote is ignored by the insert,
+# so it doesn't fire these.
+VOTES_TRIGGERS = (
+    "create trigger if not exists votes_after_insert "
+    "after insert on votes begin "
+    "update arxiv set nvotes = nvotes + 1 "
+    "where utcdate = new.utcdate and arxiv_id = new.arxiv_id; "
+    "end",
+    "create trigger if not exists votes_after_delete "
+    "after delete on votes begin "
+    "update arxiv set nvotes = nvotes - 1 "
+    "where utcdate = old.utcdate and arxiv_id = old.arxiv_id; "
+    "end",
+)
+
+
+def ensure_votes_table(database):
     '''
-    This grabs all articles from the database for today's date to show for
-    voting. The articles are sorted in arxiv_id order with papers and
-    cross_lists returned separately.
+    This creates the votes table, its index, and the triggers that keep the
+    nvotes column of the arxiv table current in databases created before it
+    existed.
+
+    If the votes table is empty, the votes are imported from the old
+    comma-separated voters column of the arxiv table first. Use
+    rebuild_vote_counts to bring nvotes in line with the table after this.
+
+    '''
+
+    cursor = database.cursor()
+    cursor.execute(
+        'create table if not exists votes ('
+        'arxiv_id text, '
+        'utcdate date, '
+        'user_id text, '
+        'primary key (arxiv_id, utcdate, user_id))'
+    )
+    cursor.execute('create index if not exists votes_user_idx '
+                   'on votes(utcdate, user_id)')
+
+    cursor.execute('select count(*) from votes')
+    if cursor.fetchone()[0] == 0:
+
+        cursor.execute("select arxiv_id, utcdate, voters from arxiv "
+                       "where voters is not null and voters != ''")
+        votes = []
+        for arxivid, utcdate, voters in cursor.fetchall():
+            votes.extend([(arxivid, utcdate, x.strip())
+                          for x in voters.split(',') if x.strip()])
+
+        cursor.executemany('insert or ignore into votes '
+                           '(arxiv_id, utcdate, user_id) values (?,?,?)',
+                           votes)
+
+    for trigger in VOTES_TRIGGERS:
+        cursor.execute(trigger)
+    database.commit()
+    cursor.close()
+
+
+
+def rebuild_vote_counts(database=None):
+    '''
+    This sets the nvotes column of the arxiv table to the number of votes for
+    each paper in the votes table. Only the rows whose count is off are
+    updated. Returns the number of rows updated.
 
     '''
 
@@ -792,216 +2661,94 @@ def get_articles_for_voting(database=None,
         cursor = database.cursor()
         closedb = False
 
-    # this is today's date
-    utcdate = datetime.now(tz=utc).strftime('%Y-%m-%d')
+    vote_count = ('(select count(*) from votes v '
+                  'where v.arxiv_id = arxiv.arxiv_id and '
+                  'v.utcdate = arxiv.utcdate)')
 
+    try:
 
-    local_articles, voted_articles, other_articles = [], [], []
-    reserved_articles = []
+        cursor.execute('update arxiv set nvotes = %s '
+                       'where nvotes is not %s' % (vote_count, vote_count))
+        nupdated = cursor.rowcount
+        database.commit()
 
-    articles_excluded_from_voted = []
-    articles_excluded_from_other = []
-
-    # deal with the local articles first
-    if astronomyonly:
-        query = ("select arxiv_id, day_serial, title, article_type, "
-                 "authors, comments, abstract, link, pdf, nvotes, voters, "
-                 "presenters, local_authors, reserved, reservers, "
-                 "local_author_indices, local_author_specaffils from arxiv "
-                 "where "
-                 "utcdate = date(?) and local_authors = 1 "
-                 "and article_type = 'astronomy' "
-                 "order by nvotes desc")
-    else:
-        query = ("select arxiv_id, day_serial, title, article_type, "
-                 "authors, comments, abstract, link, pdf, nvotes, voters, "
-                 "presenters, local_authors, reserved, reservers, "
-                 "local_author_indices, local_author_specaffils from arxiv "
-                 "where "
-                 "utcdate = date(?) and local_authors = 1 "
-                 "order by nvotes desc")
-
-    query_params = (utcdate,)
-    cursor.execute(query, query_params)
-    rows = cursor.fetchall()
+    except Exception as e:
 
-    if len(rows) > 0:
-        for row in rows:
-            local_articles.append(list(row))
-            articles_excluded_from_other.append(row[0])
-            articles_excluded_from_voted.append(row[0])
-
-    # deal with articles that have votes next
-    # finally deal with the other articles
-    if len(articles_excluded_from_voted) > 0:
-
-        if astronomyonly:
-            query = ("select arxiv_id, day_serial, title, article_type, "
-                     "authors, comments, abstract, link, pdf, nvotes, voters, "
-                     "presenters, local_authors, reserved, reservers, "
-                     "local_author_indices, local_author_specaffils from arxiv "
-                     "where "
-                     "utcdate = date(?) and "
-                     "arxiv_id not in ({exclude_list}) "
-                     "and nvotes > 0 "
-                     "and article_type = 'astronomy' "
-                     "order by nvotes desc")
-        else:
-            query = ("select arxiv_id, day_serial, title, article_type, "
-                     "authors, comments, abstract, link, pdf, nvotes, voters, "
-                     "presenters, local_authors, reserved, reservers, "
-                     "local_author_indices, local_author_specaffils from arxiv "
-                     "where "
-                     "utcdate = date(?) and "
-                     "arxiv_id not in ({exclude_list}) "
-                     "and nvotes > 0 "
-                     "order by nvotes desc")
-
-        placeholders = ', '.join('?' for x in articles_excluded_from_voted)
-        query = query.format(exclude_list=placeholders)
-        query_params = tuple([utcdate] + articles_excluded_from_voted)
+        print('could not rebuild the vote counts, error was %s' % e)
+        database.rollback()
+        nupdated = 0
 
-    else:
+    # at the end, close the cursor and DB connection
+    if closedb:
+        cursor.close()
+        database.close()
 
-        if astronomyonly:
-            query = ("select arxiv_id, day_serial, title, article_type, "
-                     "authors, comments, abstract, link, pdf, nvotes, voters, "
-                     "presenters, local_authors, reserved, reservers, "
-                     "local_author_indices, local_author_specaffils from arxiv "
-                     "where "
-                     "utcdate = date(?) "
-                     "and nvotes > 0 "
-                     "and article_type = 'astronomy' "
-                     "order by nvotes desc")
-        else:
-            query = ("select arxiv_id, day_serial, title, article_type, "
-                     "authors, comments, abstract, link, pdf, nvotes, voters, "
-                     "presenters, local_authors, reserved, reservers, "
-                     "local_author_indices, local_author_specaffils from arxiv "
-                     "where "
-                     "utcdate = date(?) "
-                     "and nvotes > 0 "
-                     "order by nvotes desc")
+    return nupdated
 
-        query_params = (utcdate,)
 
-    cursor.execute(query, query_params)
-    rows = cursor.fetchall()
 
-    if len(rows) > 0:
-        for row in rows:
-            voted_articles.append(row)
-            articles_excluded_from_other.append(row[0])
-
-    # get the historical reserved articles list
-    if astronomyonly:
-        query = ("select arxiv_id, day_serial, title, article_type, "
-                 "authors, comments, abstract, link, pdf, nvotes, voters, "
-                 "presenters, local_authors, reserved, reservers, utcdate, "
-                 "local_author_indices, local_author_specaffils "
-                 "from arxiv where "
-                 "(utcdate between date(?) and date(?)) and reserved = 1 "
-                 "and article_type = 'astronomy' "
-                 "order by arxiv_id desc")
-    else:
-        query = ("select arxiv_id, day_serial, title, article_type, "
-                 "authors, comments, abstract, link, pdf, nvotes, voters, "
-                 "presenters, local_authors, reserved, reservers, utcdate, "
-                 "local_author_indices, local_author_specaffils "
-                 "from arxiv where "
-                 "(utcdate between date(?) and date(?)) and reserved = 1 "
-                 "order by arxiv_id desc")
-
-    # fetch all reserved articles up to 3 days older than the given utcdate
-    given_dt = datetime.strptime(utcdate,'%Y-%m-%d')
-    earliest_dt = given_dt - timedelta(days=RESERVE_INTERVAL_DAYS)
-    earliest_utcdate = earliest_dt.strftime('%Y-%m-%d')
+def _vote_queries(arxivid, username, vote, utcdate=None, max_votes=None):
+    '''
+    This returns the list of (query, params) that record a vote, or None if
+    vote isn't 'up' or 'down'. See cast_vote for the args.
 
-    query_params = (earliest_utcdate, utcdate)
-    cursor.execute(query, query_params)
-    rows = cursor.fetchall()
+    '''
 
-    if len(rows) > 0:
-        for row in rows:
-            reserved_articles.append(row)
-            articles_excluded_from_other.append(row[0])
-
-
-    # finally deal with the other articles
-    if len(articles_excluded_from_other) > 0:
-
-        if astronomyonly:
-            query = ("select arxiv_id, day_serial, title, article_type, "
-                     "authors, comments, abstract, link, pdf, nvotes, voters, "
-                     "presenters, local_authors, reserved, reservers, "
-                     "local_author_indices, local_author_specaffils from arxiv "
-                     "where "
-                     "utcdate = date(?) and "
-                     "arxiv_id not in ({exclude_list}) "
-                     "and article_type = 'astronomy' "
-                     "order by day_serial asc")
-        else:
-            query = ("select arxiv_id, day_serial, title, article_type, "
-                     "authors, comments, abstract, link, pdf, nvotes, voters, "
-                     "presenters, local_authors, reserved, reservers, "
-                     "local_author_indices, local_author_specaffils from arxiv "
-                     "where "
-                     "utcdate = date(?) and "
-                     "arxiv_id not in ({exclude_list}) "
-                     "order by article_type asc, day_serial asc")
-
-        placeholders = ', '.join('?' for x in articles_excluded_from_other)
-        query = query.format(exclude_list=placeholders)
-        query_params = tuple([utcdate] + articles_excluded_from_other)
+    if vote == 'up':
+        # votes only count ONCE per article, the primary key of the votes table
+        # makes a repeated vote a no-op
+        query = ("insert or ignore into votes (arxiv_id, utcdate, user_id) "
+                 "select arxiv_id, utcdate, ? from arxiv "
+                 "where arxiv_id = ?")
+        query_params = (username, arxivid)
 
-    else:
+        if max_votes is not None:
 
-        if astronomyonly:
-            query = ("select arxiv_id, day_serial, title, article_type, "
-                     "authors, comments, abstract, link, pdf, nvotes, voters, "
-                     "presenters, local_authors, reserved, reservers, "
-                     "local_author_indices, local_author_specaffils from arxiv "
-                     "where "
-                     "utcdate = date(?) "
-                     "and article_type = 'astronomy' "
-                     "order by day_serial asc")
-        else:
-            query = ("select arxiv_id, day_serial, title, article_type, "
-                     "authors, comments, abstract, link, pdf, nvotes, voters, "
-                     "presenters, local_authors, reserved, reservers, "
-                     "local_author_indices, local_author_specaffils from arxiv "
-                     "where "
-                     "utcdate = date(?) "
-                     "order by article_type asc, day_serial asc")
+            if utcdate is None:
+                utcdate = datetime.now(tz=utc).strftime('%Y-%m-%d')
 
-        query_params = (utcdate,)
+            query = query + (" and (select count(*) from votes v "
+                             "where v.utcdate = ? and v.user_id = ?) < ?")
+            query_params = query_params + (utcdate, username, max_votes)
 
-    cursor.execute(query, query_params)
-    rows = cursor.fetchall()
+    elif vote == 'down':
+        query = ("delete from votes where arxiv_id = ? and user_id = ?")
+        query_params = (arxivid, username)
 
-    if len(rows) > 0:
-        for row in rows:
-            other_articles.append(row)
+    else:
+        return None
 
-    # at the end, close the cursor and DB connection
-    if closedb:
-        cursor.close()
-        database.close()
+    return [(query, query_params)]
 
-    return [list(local_articles),
-            voted_articles,
-            other_articles,
-            reserved_articles]
 
 
-## ARTICLE ARCHIVES
-def get_archive_index(start_date=None,
-                      end_date=None,
-                      database=None):
-    '''
-    This returns all article archives in reverse date order.
+def cast_vote(arxivid, username, vote,
+              utcdate=None,
+              max_votes=None,
+              database=None):
+    '''This records a vote for a paper in the DB in a single BEGIN IMMEDIATE
+    transaction. vote is 'up' or 'down'.
+
+    If max_votes is given, an up vote is only recorded if the user has fewer
+    than max_votes votes for utcdate (a YYYY-MM-DD string, today by default).
+    The check is part of the insert, and the transaction holds the write lock
+    from its start, so two votes from the same user at once can't both get in
+    under the limit.
+
+    Returns (status, nvotes). status is 'ok' if the vote was recorded or the
+    user had already voted for this paper, 'quota' if the user is out of votes,
+    'missing' if the arxivid doesn't exist, and 'invalid' if vote isn't 'up' or
+    'down'. nvotes is the vote total for the arxivid after the vote, or None if
+    it doesn't exist.
 
     '''
+
+    queries = _vote_queries(arxivid, username, vote,
+                            utcdate=utcdate,
+                            max_votes=max_votes)
+    if queries is None:
+        return 'invalid', None
+
     # open the database if needed and get a cursor
     if not database:
         database, cursor = opendb()
@@ -1010,32 +2757,108 @@ def get_archive_index(start_date=None,
         cursor = database.cursor()
         closedb = False
 
-    query = ("select utcdate, count(*), sum(local_authors), "
-             "sum(case when nvotes > 0 then 1 else 0 end) from arxiv "
-             "group by utcdate order by utcdate desc")
-    cursor.execute(query)
-    rows = cursor.fetchall()
+    try:
 
-    if rows and len(rows) > 0:
-        arxivdates, arxivpapers, arxivlocals, arxivvoted = zip(*rows)
+        cursor.execute('begin immediate')
+
+        nchanged = 0
+        for query, query_params in queries:
+            cursor.execute(query, query_params)
+            nchanged = nchanged + cursor.rowcount
+
+        cursor.execute("select nvotes, exists(select 1 from votes v "
+                       "where v.arxiv_id = ? and v.user_id = ?) "
+                       "from arxiv where arxiv_id = ?",
+                       (arxivid, username, arxivid))
+        row = cursor.fetchone()
+        database.commit()
+
+    except Exception as e:
+        database.rollback()
+        raise
+
+    if nchanged > 0:
+        bump_article_listing_versions(arxivid, cursor)
+        patch_day_snapshots(arxivid, cursor)
+
+    if not row:
+        returnval = ('missing', None)
+    elif vote == 'up' and nchanged == 0 and not row[1]:
+        returnval = ('quota', row[0])
     else:
-        arxivdates, arxivpapers, arxivlocals, arxivvoted = [], [], [], []
+        returnval = ('ok', row[0])
 
     # at the end, close the cursor and DB connection
     if closedb:
         cursor.close()
         database.close()
 
-    return (arxivdates, arxivpapers, arxivlocals, arxivvoted)
+    return returnval
 
 
-## VOTERS AND PRESENTERS
 
 def record_vote(arxivid, username, vote, database=None):
     '''This records votes for a paper in the DB. vote is 'up' or 'down'. If the
     arxivid doesn't exist, then returns False. If the vote is successfully
     processed, returns the nvotes for the arxivid.
 
+    Each vote is a row in the votes table. The triggers on it keep the nvotes
+    column of the arxiv table current. Use cast_vote to check the user's vote
+    quota in the same transaction.
+
+    '''
+
+    status, nvotes = cast_vote(arxivid, username, vote, database=database)
+
+    if status == 'ok':
+        return nvotes
+    else:
+        return False
+
+
+
+def ensure_reservations_table(database):
+    '''
+    This creates the reservations table and its index in databases created
+    before it existed. If the table is empty, the current reservations are
+    imported from the reserved and reservers columns of the arxiv table. Their
+    reserved_utc is unknown, so it's left null.
+
+    '''
+
+    cursor = database.cursor()
+    cursor.execute(
+        'create table if not exists reservations ('
+        'arxiv_id text, '
+        'utcdate date, '
+        'user_id text, '
+        'reserved_utc double precision, '
+        'primary key (arxiv_id, utcdate))'
+    )
+    cursor.execute('create index if not exists reservations_user_idx '
+                   'on reservations(user_id, utcdate)')
+
+    cursor.execute('select count(*) from reservations')
+    if cursor.fetchone()[0] == 0:
+        cursor.execute("insert or ignore into reservations "
+                       "(arxiv_id, utcdate, user_id, reserved_utc) "
+                       "select arxiv_id, utcdate, reservers, null from arxiv "
+                       "where reserved = 1 and reservers is not null")
+
+    database.commit()
+    cursor.close()
+
+
+
+def purge_expired_reservations(utcdate=None, database=None):
+    '''
+    This deletes the reservations for papers listed more than
+    RESERVE_INTERVAL_DAYS before utcdate (a YYYY-MM-DD string, today by
+    default) from the reservations table. These can't be released or counted
+    against a user's reservations any more. The arxiv table still records who
+    reserved them, so the archive listings don't change. Returns the number of
+    reservations deleted.
+
     '''
 
     # open the database if needed and get a cursor
@@ -1046,122 +2869,172 @@ def record_vote(arxivid, username, vote, database=None):
         cursor = database.cursor()
         closedb = False
 
-    returnval = False
-
-    if vote == 'up':
-        voteval = 1
-    elif vote =='down':
-        voteval = -1
-    else:
-        voteval = 0
-
-    if voteval > 0:
-        # votes only count ONCE per article
-        query = ("update arxiv set nvotes = (nvotes + ?), "
-                 "voters = (voters || ? || ',') "
-                 "where arxiv_id = ? and "
-                 "voters not like ?")
-        query_params = (voteval,
-                        username,
-                        arxivid,
-                        '%{0}%'.format(username))
-
-    elif voteval < 0:
-        # votes only count ONCE per article
-        query = ("update arxiv set nvotes = (nvotes + ?), "
-                 "voters = replace(voters, (? || ','), '') "
-                 "where arxiv_id = ? and "
-                 "voters like ?")
-        query_params = (voteval,
-                        username,
-                        arxivid,
-                        '%{0}%'.format(username))
-
+    if utcdate is None:
+        given_dt = datetime.now(tz=utc).date()
     else:
-        return False
-
+        given_dt = datetime.strptime(utcdate,'%Y-%m-%d').date()
+    earliest_dt = given_dt - timedelta(days=RESERVE_INTERVAL_DAYS)
 
     try:
 
-        cursor.execute(query, query_params)
+        cursor.execute('delete from reservations where utcdate < ?',
+                       (earliest_dt.strftime('%Y-%m-%d'),))
+        npurged = cursor.rowcount
         database.commit()
 
-        cursor.execute("select nvotes from arxiv where arxiv_id = ?",
-                       (arxivid,))
-        rows = cursor.fetchone()
-
-        if rows and len(rows) > 0:
-            returnval = rows[0]
-
     except Exception as e:
-        raise
-        returnval = False
+
+        print('could not purge the expired reservations, error was %s' % e)
+        database.rollback()
+        npurged = 0
 
     # at the end, close the cursor and DB connection
     if closedb:
         cursor.close()
         database.close()
 
-    return returnval
+    return npurged
 
 
-def record_reservation(arxivid, username, reservation, database=None):
-    '''This records votes for a paper in the DB. reservation is 'reserve' or
-    'release'. If the arxivid doesn't exist, then returns False. If the
-    reservation is successfully processed, returns the reserved flag for the
-    arxivid.
 
+def _reservation_queries(arxivid, username, reservation,
+                         utcdate=None,
+                         max_reservations=None,
+                         reserved_utc=None):
     '''
+    This returns the list of (query, params) that record a reservation, or None
+    if reservation isn't 'reserve' or 'release'. reserved_utc is the UNIX time
+    of the reservation, now by default. See cast_reservation for the other
+    args.
 
-    # open the database if needed and get a cursor
-    if not database:
-        database, cursor = opendb()
-        closedb = True
-    else:
-        cursor = database.cursor()
-        closedb = False
+    '''
 
-    returnval = False
+    if reserved_utc is None:
+        reserved_utc = time.time()
 
     if reservation == 'reserve':
 
-        # reservations only count ONCE per article
-        query = ("update arxiv set reserved = 1, "
-                 "reservers = ? "
-                 "where arxiv_id = ? and "
-                 "reservers is null")
-        query_params = (username,
-                        arxivid)
+        # reservations only count ONCE per article, the primary key of the
+        # reservations table makes them exclusive. the reserved and reservers
+        # columns of the arxiv table are then set for the listings.
+        insert_query = ("insert or ignore into reservations "
+                        "(arxiv_id, utcdate, user_id, reserved_utc) "
+                        "select arxiv_id, utcdate, ?, ? from arxiv "
+                        "where arxiv_id = ? and reservers is null")
+        insert_params = (username, reserved_utc, arxivid)
+
+        if max_reservations is not None:
+
+            if utcdate is None:
+                utcdate = datetime.now(tz=utc).strftime('%Y-%m-%d')
+
+            given_dt = datetime.strptime(utcdate,'%Y-%m-%d')
+            earliest_dt = given_dt - timedelta(days=RESERVE_INTERVAL_DAYS)
+
+            insert_query = insert_query + (
+                " and (select count(*) from reservations r "
+                "where r.user_id = ? and "
+                "(r.utcdate between ? and ?)) < ?"
+            )
+            insert_params = insert_params + (username,
+                                             earliest_dt.strftime('%Y-%m-%d'),
+                                             utcdate,
+                                             max_reservations)
+
+        queries = (
+            (insert_query, insert_params),
+            ("update arxiv set reserved = 1, "
+             "reservers = ? "
+             "where arxiv_id = ? and "
+             "reservers is null and "
+             "utcdate in (select utcdate from reservations "
+             "where arxiv_id = ? and user_id = ?)",
+             (username, arxivid, arxivid, username)),
+        )
 
     elif reservation == 'release':
-        # reservations only count ONCE per article
-        query = ("update arxiv set reserved = 0, "
-                 "reservers = null "
-                 "where arxiv_id = ? and "
-                 "reservers like ?")
-        query_params = (arxivid, '%{0}%'.format(username))
+
+        queries = (
+            ("delete from reservations where arxiv_id = ? and user_id = ?",
+             (arxivid, username)),
+            ("update arxiv set reserved = 0, "
+             "reservers = null "
+             "where arxiv_id = ? and "
+             "reservers = ?",
+             (arxivid, username)),
+        )
 
     else:
-        return False
+        return None
+
+    return list(queries)
+
+
+
+def cast_reservation(arxivid, username, reservation,
+                     utcdate=None,
+                     max_reservations=None,
+                     database=None):
+    '''This records a reservation for a paper in the DB in a single BEGIN
+    IMMEDIATE transaction. reservation is 'reserve' or 'release'.
 
+    If max_reservations is given, a paper is only reserved if the user has
+    fewer than max_reservations reservations in the RESERVE_INTERVAL_DAYS up
+    to utcdate (a YYYY-MM-DD string, today by default). As in cast_vote, the
+    check is part of the insert, so it can't race another reservation.
+
+    Returns (status, row). status is 'ok' if the reservation was processed,
+    'quota' if the user is out of reservations, 'missing' if the arxivid
+    doesn't exist, and 'invalid' if reservation isn't 'reserve' or 'release'.
+    row is (reserved, reservers) for the arxivid after the reservation, or None
+    if it doesn't exist. If someone else already reserved the paper, status is
+    'ok' and reservers is their name.
+
+    '''
+
+    queries = _reservation_queries(arxivid, username, reservation,
+                                   utcdate=utcdate,
+                                   max_reservations=max_reservations)
+    if queries is None:
+        return 'invalid', None
+
+    # open the database if needed and get a cursor
+    if not database:
+        database, cursor = opendb()
+        closedb = True
+    else:
+        cursor = database.cursor()
+        closedb = False
 
     try:
 
-        cursor.execute(query, query_params)
-        database.commit()
+        cursor.execute('begin immediate')
+
+        nchanged = 0
+        for query, query_params in queries:
+            cursor.execute(query, query_params)
+            nchanged = nchanged + cursor.rowcount
 
         cursor.execute("select reserved, reservers from arxiv "
                        "where arxiv_id = ?",
                        (arxivid,))
-        rows = cursor.fetchone()
-
-        if rows and len(rows) > 0:
-            returnval = rows
+        row = cursor.fetchone()
+        database.commit()
 
     except Exception as e:
         database.rollback()
         raise
-        returnval = False
+
+    if nchanged > 0:
+        bump_article_listing_versions(arxivid, cursor)
+        patch_day_snapshots(arxivid, cursor)
+
+    if not row:
+        returnval = ('missing', None)
+    elif reservation == 'reserve' and nchanged == 0 and row[1] is None:
+        returnval = ('quota', row)
+    else:
+        returnval = ('ok', row)
 
     # at the end, close the cursor and DB connection
     if closedb:
@@ -1172,6 +3045,27 @@ def record_reservation(arxivid, username, reservation, database=None):
 
 
 
+def record_reservation(arxivid, username, reservation, database=None):
+    '''This records votes for a paper in the DB. reservation is 'reserve' or
+    'release'. If the arxivid doesn't exist, then returns False. If the
+    reservation is successfully processed, returns the reserved flag for the
+    arxivid.
+
+    Use cast_reservation to check the user's reservation quota in the same
+    transaction.
+
+    '''
+
+    status, row = cast_reservation(arxivid, username, reservation,
+                                   database=database)
+
+    if status == 'ok':
+        return row
+    else:
+        return False
+
+
+
 def record_edit(arxivid, username, edittype, database=None):
     '''This records edits for a paper in the DB. The edittype is 'islocal' or
     'isnotlocal' for now. If the arxivid doesn't exist, then returns False.
@@ -1210,6 +3104,8 @@ def record_edit(arxivid, username, edittype, database=None):
 
         cursor.execute(query, query_params)
         database.commit()
+        bump_article_listing_versions(arxivid, cursor)
+        patch_day_snapshots(arxivid, cursor)
 
         cursor.execute("select arxiv_id, local_authors from arxiv "
                        "where arxiv_id = ? "
@@ -1251,6 +3147,12 @@ def get_user_reservations(utcdate, username,
 
     '''
 
+    # use the day snapshot if we have one
+    if database:
+        snapshot = get_day_snapshot(utcdate, database)
+        if snapshot is not None:
+            return snapshot.user_reservations(username)
+
     # open the database if needed and get a cursor
     if not database:
         database, cursor = opendb()
@@ -1261,33 +3163,18 @@ def get_user_reservations(utcdate, username,
 
     # get all the reserved papers by this user for this utcdate -
     # RESERVE_INTERVAL_DAYS
-    query = ("select arxiv_id, reservers from arxiv where "
-             "(utcdate between ? and ?) and "
-             "(reserved = 1)")
+    query = ("select arxiv_id from reservations where "
+             "user_id = ? and "
+             "(utcdate between ? and ?)")
 
     # figure out the oldest date
     given_dt = datetime.strptime(utcdate,'%Y-%m-%d')
     earliest_dt = given_dt - timedelta(days=RESERVE_INTERVAL_DAYS)
     earliest_utcdate = earliest_dt.strftime('%Y-%m-%d')
 
-    params = (earliest_utcdate, utcdate)
+    params = (username, earliest_utcdate, utcdate)
     cursor.execute(query, params)
-    rows = cursor.fetchall()
-
-    if rows and len(rows) > 0:
-
-        reserved_arxivids = []
-
-        for row in rows:
-            paper, reservers = row
-            reservers = reservers.split(',')
-            if username in reservers:
-                reserved_arxivids.append(paper)
-
-    else:
-
-        reserved_arxivids = []
-
+    reserved_arxivids = [x[0] for x in cursor.fetchall()]
 
     # at the end, close the cursor and DB connection
     if closedb:
@@ -1307,6 +3194,12 @@ def get_user_votes(utcdate, username, database=None):
 
     '''
 
+    # use the day snapshot if we have one
+    if database:
+        snapshot = get_day_snapshot(utcdate, database)
+        if snapshot is not None:
+            return snapshot.user_votes(username)
+
     # open the database if needed and get a cursor
     if not database:
         database, cursor = opendb()
@@ -1316,28 +3209,43 @@ def get_user_votes(utcdate, username, database=None):
         closedb = False
 
 
-    # get all the voters for this date
-    # FIXME: this would be WAY better handled using FTS
-    query = ("select arxiv_id, voters from arxiv "
-             "where utcdate = ? and nvotes > 0 ")
-    query_params = (utcdate,)
+    # get this user's votes for this date
+    query = ("select arxiv_id from votes "
+             "where utcdate = ? and user_id = ?")
+    query_params = (utcdate, username)
 
     cursor.execute(query, query_params)
-    rows = cursor.fetchall()
+    voted_arxivids = [x[0] for x in cursor.fetchall()]
 
-    if rows and len(rows) > 0:
 
-        voted_arxivids = []
+    # at the end, close the cursor and DB connection
+    if closedb:
+        cursor.close()
+        database.close()
+
+    return voted_arxivids
+
+
+
+def modify_presenters(arxivid, presenter, action, database=None):
+    '''
+    This adds/removes presenters for a paper.
+
+    action = 'add' -> adds person named presenter
+    action = 'remove' -> removes person named presenter
 
-        for row in rows:
-            paper, voters = row
-            voters = voters.split(',')
-            if username in voters:
-                voted_arxivids.append(paper)
+    '''
 
+    # open the database if needed and get a cursor
+    if not database:
+        database, cursor = opendb()
+        closedb = True
     else:
+        cursor = database.cursor()
+        closedb = False
+
+
 
-        voted_arxivids = []
 
 
     # at the end, close the cursor and DB connection
@@ -1345,16 +3253,71 @@ def get_user_votes(utcdate, username, database=None):
         cursor.close()
         database.close()
 
-    return voted_arxivids
 
 
+## VOTE JOURNAL
 
-def modify_presenters(arxivid, presenter, action, database=None):
+def ensure_vote_journal_table(database):
     '''
-    This adds/removes presenters for a paper.
+    This creates the vote_journal table in databases created before it existed.
+    It holds the sequence number of the last operation from each write-behind
+    journal file (see votejournal.py) that was written to the database.
+
+    '''
+
+    cursor = database.cursor()
+    cursor.execute(
+        'create table if not exists vote_journal ('
+        'journal_path text, '
+        'last_seq integer, '
+        'primary key (journal_path))'
+    )
+    database.commit()
+    cursor.close()
+
 
-    action = 'add' -> adds person named presenter
-    action = 'remove' -> removes person named presenter
+
+def get_vote_journal_seq(journal_path, database=None):
+    '''
+    This returns the sequence number of the last operation from journal_path
+    written to the database, or 0 if there weren't any.
+
+    '''
+
+    # open the database if needed and get a cursor
+    if not database:
+        database, cursor = opendb()
+        closedb = True
+    else:
+        cursor = database.cursor()
+        closedb = False
+
+    cursor.execute('select last_seq from vote_journal where journal_path = ?',
+                   (journal_path,))
+    row = cursor.fetchone()
+
+    # at the end, close the cursor and DB connection
+    if closedb:
+        cursor.close()
+        database.close()
+
+    return row[0] if row else 0
+
+
+
+def apply_vote_journal(ops, journal_path, database=None):
+    '''
+    This writes a batch of journaled votes and reservations to the database in
+    one BEGIN IMMEDIATE transaction, along with the sequence number of the last
+    one for journal_path.
+
+    Each op is a dict with the keys seq, kind ('vote' or 'reservation'),
+    arxivid, username, action (the vote or reservation arg of cast_vote or
+    cast_reservation), utcdate, limit (max_votes or max_reservations), and utc
+    (the UNIX time it was made). The vote and reservation limits are checked
+    again as each op is written. Ops whose seq isn't above the last one
+    recorded for journal_path were written already and are skipped, so a
+    journal can be replayed safely. Returns the number of ops written.
 
     '''
 
@@ -1366,11 +3329,66 @@ def modify_presenters(arxivid, presenter, action, database=None):
         cursor = database.cursor()
         closedb = False
 
+    try:
+
+        cursor.execute('begin immediate')
+
+        cursor.execute('select last_seq from vote_journal '
+                       'where journal_path = ?',
+                       (journal_path,))
+        row = cursor.fetchone()
+        last_seq = row[0] if row else 0
+
+        ops = [x for x in ops if x['seq'] > last_seq]
+
+        for op in ops:
+
+            if op['kind'] == 'vote':
+                queries = _vote_queries(op['arxivid'],
+                                        op['username'],
+                                        op['action'],
+                                        utcdate=op['utcdate'],
+                                        max_votes=op['limit'])
+            elif op['kind'] == 'reservation':
+                queries = _reservation_queries(op['arxivid'],
+                                               op['username'],
+                                               op['action'],
+                                               utcdate=op['utcdate'],
+                                               max_reservations=op['limit'],
+                                               reserved_utc=op['utc'])
+            else:
+                queries = None
+
+            if queries is None:
+                print('skipping journaled operation %s with unknown '
+                      'kind or action' % op['seq'])
+                continue
+
+            for query, query_params in queries:
+                cursor.execute(query, query_params)
+
+        if ops:
+            cursor.execute('insert or replace into vote_journal '
+                           '(journal_path, last_seq) values (?,?)',
+                           (journal_path, max(x['seq'] for x in ops)))
 
+        database.commit()
 
+    except Exception as e:
+        database.rollback()
+        raise
 
+    # the snapshots already have the ops in them, but the database may have
+    # turned some of them down (e.g. if the vote limit was checked against a
+    # snapshot that was out of date), so all the papers in the batch are
+    # patched from what was actually written
+    for arxivid in sorted(set(x['arxivid'] for x in ops)):
+        bump_article_listing_versions(arxivid, cursor)
+        patch_day_snapshots(arxivid, cursor)
 
     # at the end, close the cursor and DB connection
     if closedb:
         cursor.close()
         database.close()
+
+    return len(ops)
@@ -0,0 +1,709 @@
+#!/usr/bin/env python
+
+'''
+arxivingest - Waqas Bhatti (wbhatti@astro.princeton.edu) - Nov 2017
+
+Contains the staged ingestion pipeline for the nightly arxiv update of the
+astroph-coffee server. The stages are:
+
+fetch -> parse -> normalize -> insert -> tag -> postprocess
+
+These are chained together as generators. If streaming is on (the default),
+the parse stage downloads each listing with arxivutils.stream_arxiv_articles
+and passes its entries on one at a time as they arrive, so the whole page is
+never held in memory. With a single listing URL, the normalize stage turns the
+entries into rows as they come in. With several, it has to wait for all of them
+so it can merge them. The insert stage always collects all the rows so they go
+in as a single transaction. The chaining also lets the wall time and row count
+for each stage of each run be recorded in the ingest_runs table, along with the
+saved output of each completed stage, so a failed run can be resumed from the
+last stage that completed.
+
+'''
+
+import os
+import os.path
+import time
+import ConfigParser
+import cPickle as pickle
+from itertools import groupby
+from multiprocessing.pool import ThreadPool
+from datetime import datetime
+
+from pytz import utc
+
+CONF = ConfigParser.ConfigParser()
+CONF.read('conf/astroph.conf')
+
+# the outputs of the completed stages of each run are saved here
+CACHEDIR = CONF.get('paths','cache')
+
+# local imports
+import arxivutils
+import arxivdb
+import staticarchive
+
+
+## RECORDING RUNS
+
+def ensure_ingest_runs_table(database):
+    '''
+    This creates the ingest_runs table in databases created before it existed.
+
+    '''
+
+    cursor = database.cursor()
+    cursor.execute(
+        'create table if not exists ingest_runs ('
+        'run_id integer, '
+        'stage text, '
+        'started_utc double precision, '
+        'wall_time double precision, '
+        'nrows integer, '
+        'status text, '
+        'error text, '
+        'artifact text, '
+        'primary key (run_id, stage))'
+    )
+    database.commit()
+    cursor.close()
+
+
+
+def record_ingest_stage(runid,
+                        stage,
+                        status,
+                        database,
+                        started_utc=None,
+                        wall_time=None,
+                        nrows=None,
+                        error=None,
+                        artifact=None):
+    '''
+    This records the status of a stage of an ingest run.
+
+    '''
+
+    cursor = database.cursor()
+    cursor.execute(
+        'insert or replace into ingest_runs '
+        '(run_id, stage, started_utc, wall_time, nrows, status, error, '
+        'artifact) values (?,?,?,?,?,?,?,?)',
+        (runid, stage, started_utc, wall_time, nrows, status, error, artifact)
+    )
+    database.commit()
+    cursor.close()
+
+
+
+def get_ingest_run(runid=None, database=None):
+    '''
+    This returns the stage records for the ingest run runid (or the latest run
+    if runid is None) as a list of dicts in stage order.
+
+    '''
+
+    # open the database if needed and get a cursor
+    if not database:
+        database, cursor = arxivdb.opendb()
+        closedb = True
+    else:
+        cursor = database.cursor()
+        closedb = False
+
+    ensure_ingest_runs_table(database)
+
+    if runid is None:
+        cursor.execute('select max(run_id) from ingest_runs')
+        runid = cursor.fetchone()[0]
+
+    cursor.execute(
+        'select run_id, stage, started_utc, wall_time, nrows, status, error, '
+        'artifact from ingest_runs where run_id = ?',
+        (runid,)
+    )
+    rows = cursor.fetchall()
+
+    columns = ('run_id', 'stage', 'started_utc', 'wall_time', 'nrows',
+               'status', 'error', 'artifact')
+    records = [dict(zip(columns, x)) for x in rows]
+    records = sorted(records, key=lambda x: STAGES.index(x['stage']))
+
+    # at the end, close the cursor and DB connection
+    if closedb:
+        cursor.close()
+        database.close()
+
+    return records
+
+
+
+## STAGES
+
+def stage_fetch(urls, stat, context):
+    '''
+    This fetches the listing pages at urls into the raw listing cache and
+    yields a dict for each one with the path to its snapshot. If a /new page
+    doesn't load correctly, its /pastweek page is fetched instead.
+
+    If streaming is on, nothing is downloaded here. The dicts are yielded
+    without a snapshot and the parse stage streams the pages itself.
+
+    '''
+
+    if context['streaming']:
+
+        for url in urls:
+            stat['nrows'] += 1
+            yield {'url':url,
+                   'fetched_url':None,
+                   'papers_only':False,
+                   'snapshot':None}
+
+        return
+
+    def fetch_listing(url):
+
+        try:
+
+            html = arxivutils.get_page_html(url, usecache=True)
+
+            # a listing without any entries means the page didn't load
+            if not html or not arxivutils.ENTRY_TAG_REGEX.search(html):
+                raise ValueError('no listing entries found at %s' % url)
+
+            return {'url':url, 'fetched_url':url, 'papers_only':False}
+
+        except Exception as e:
+
+            alturl = arxivutils.pastweek_url(url)
+            print('could not get /new page %s, trying alternative '
+                  '/pastweek page: %s' % (url, alturl))
+
+            html = arxivutils.get_page_html(alturl, usecache=True)
+            if not html:
+                raise ValueError('could not get %s or %s' % (url, alturl))
+
+            return {'url':url, 'fetched_url':alturl, 'papers_only':True}
+
+    pool = ThreadPool(min(context['nworkers'], len(urls)))
+
+    try:
+
+        for listing in pool.imap(fetch_listing, urls):
+
+            state = arxivutils.load_fetch_state()
+            listing['snapshot'] = state[listing['fetched_url']]['snapshot']
+
+            stat['nrows'] += 1
+            yield listing
+
+    finally:
+        pool.terminate()
+
+
+
+def stream_listing(listing, context):
+    '''
+    This streams the entries of a listing from the arxiv server with
+    arxivutils.stream_arxiv_articles and yields (listtype, serial, articledict)
+    tuples as they arrive. If the /new page doesn't have any entries, its
+    /pastweek page is streamed instead.
+
+    '''
+
+    url = listing['url']
+    nentries = 0
+
+    try:
+
+        for entry in arxivutils.stream_arxiv_articles(
+                url,
+                backend=context['backend'],
+                usecache=True
+        ):
+            nentries += 1
+            yield entry
+
+    except Exception as e:
+
+        # the entries we already passed on can't be taken back, so falling
+        # back to the /pastweek page now would mix the two listings
+        if nentries > 0:
+            raise
+
+        print('could not stream /new page %s, error was %r' % (url, e))
+
+    if nentries > 0:
+        return
+
+    alturl = arxivutils.pastweek_url(url)
+    print('no entries found on /new page %s, trying alternative '
+          '/pastweek page: %s' % (url, alturl))
+
+    # the first dl is for the most recent date, so we stop there
+    for entry in arxivutils.stream_arxiv_articles(alturl,
+                                                  papers_only=True,
+                                                  backend=context['backend'],
+                                                  usecache=True):
+        nentries += 1
+        yield entry
+
+    if nentries == 0:
+        raise ValueError('could not get %s or %s' % (url, alturl))
+
+
+
+def stage_parse(listings, stat, context):
+    '''
+    This parses the entries of each fetched listing into article dicts like the
+    ones in the arxiv dicts arxivutils.arxiv_update returns and yields (url,
+    listtype, serial, articledict) tuples for them, one at a time.
+
+    Listings that were fetched into a snapshot are parsed from it. Listings
+    without a snapshot are streamed from the arxiv server with stream_listing,
+    and their entries go downstream as they arrive.
+
+    '''
+
+    for listing in listings:
+
+        if listing['snapshot'] is None:
+
+            entries = stream_listing(listing, context)
+
+        else:
+
+            html = arxivutils.read_listing_snapshot(listing['snapshot'])
+            paperdict, crosslistdict = (
+                arxivutils.PARSER_BACKENDS[context['backend']][0](
+                    html,
+                    papers_only=listing['papers_only']
+                )
+            )
+
+            if len(paperdict) == 0:
+                raise ValueError('no papers found in %s' %
+                                 listing['snapshot'])
+
+            entries = (
+                [('papers', x, paperdict[x]) for x in sorted(paperdict)] +
+                [('crosslists', x, crosslistdict[x])
+                 for x in sorted(crosslistdict)]
+            )
+
+        for listtype, serial, article in entries:
+            stat['nrows'] += 1
+            yield listing['url'], listtype, serial, article
+
+
+
+def stage_normalize(parsed, stat, context):
+    '''
+    This turns the parsed entries into DB rows and yields them. With a single
+    listing, the rows are yielded as the entries arrive. With several, the
+    listings are merged once they've all been parsed.
+
+    '''
+
+    if context['nlistings'] == 1:
+
+        for url, listtype, serial, article in parsed:
+
+            arxiv = {'utc':context['utc'], 'papers':{}, 'crosslists':{}}
+            arxiv[listtype][serial] = article
+
+            for row in arxivdb.get_article_rows(arxiv):
+                stat['nrows'] += 1
+                yield row
+
+        return
+
+    listings = []
+
+    for url, entries in groupby(parsed, key=lambda x: x[0]):
+
+        paperdict, crosslistdict = arxivutils.collect_arxiv_stream(
+            x[1:] for x in entries
+        )
+        listings.append((url, {'utc':context['utc'],
+                               'npapers':len(paperdict),
+                               'papers':paperdict,
+                               'ncrosslists':len(crosslistdict),
+                               'crosslists':crosslistdict}))
+
+    arxiv = arxivutils.merge_arxiv_listings(listings, context['main_url'])
+
+    for row in arxivdb.get_article_rows(arxiv):
+        stat['nrows'] += 1
+        yield row
+
+
+
+def stage_insert(rows, stat, context):
+    '''
+    This upserts all the rows into the arxiv table in a single transaction and
+    then yields the dates that were inserted.
+
+    '''
+
+    database = context['database']
+
+    # all the rows are collected first so the other stages' records aren't
+    # committed in the middle of the insert transaction
+    rows = list(rows)
+
+    arxivdb.ensure_content_hash_column(database)
+    cursor = database.cursor()
+
+    try:
+
+        ninserted, nupdated = arxivdb.upsert_article_rows(rows, cursor)
+        database.commit()
+
+    except Exception as e:
+
+        database.rollback()
+        raise
+
+    finally:
+        cursor.close()
+
+    print('%s articles inserted, %s updated, %s unchanged' %
+          (ninserted, nupdated, len(rows) - ninserted - nupdated))
+    stat['nrows'] += ninserted + nupdated
+
+    for utcdate in sorted(set(x[1] for x in rows)):
+        yield utcdate
+
+
+
+def stage_tag(dates, stat, context):
+    '''
+    This tags the local authors for each inserted date.
+
+    '''
+
+    for utcdate in dates:
+
+        tagged = arxivdb.tag_local_authors(
+            utcdate,
+            database=context['database'],
+            firstname_match_threshold=context['firstname_match_threshold'],
+            fullname_match_threshold=context['fullname_match_threshold'],
+            update_db=True
+        )
+
+        if tagged:
+            stat['nrows'] += len(tagged)
+
+        yield utcdate
+
+
+
+def merge_fts_segments(utcdate, database):
+    '''
+    This does some incremental merging of the full-text search index segments
+    after the day's articles were added, so searches don't slow down as the
+    segments pile up.
+
+    '''
+
+    cursor = database.cursor()
+    cursor.execute("insert into arxiv_fts(arxiv_fts) values ('merge=300,8')")
+    database.commit()
+    cursor.close()
+
+    return 0
+
+
+
+def render_static_archive(utcdate, database):
+    '''
+    This pre-renders the archive pages for the days that have moved out of the
+    reservation window, and re-renders any that were changed (see
+    staticarchive.py).
+
+    '''
+
+    return staticarchive.generate_static_archive(database=database)
+
+
+
+def purge_expired_reservations(utcdate, database):
+    '''
+    This clears the reservations that have moved out of the reservation window
+    from the reservations table.
+
+    '''
+
+    return arxivdb.purge_expired_reservations(
+        utcdate=utcdate.strftime('%Y-%m-%d'),
+        database=database
+    )
+
+
+
+# these are run for each inserted date in the postprocess stage. each is called
+# as hook(utcdate, database) and returns the number of rows it wrote.
+POSTPROCESS_HOOKS = [merge_fts_segments,
+                     purge_expired_reservations,
+                     render_static_archive]
+
+
+def stage_postprocess(dates, stat, context):
+    '''
+    This runs the POSTPROCESS_HOOKS for each inserted date.
+
+    '''
+
+    for utcdate in dates:
+
+        for hook in POSTPROCESS_HOOKS:
+            nrows = hook(utcdate, context['database'])
+            if nrows:
+                stat['nrows'] += nrows
+
+        yield utcdate
+
+
+
+STAGES = ('fetch', 'parse', 'normalize', 'insert', 'tag', 'postprocess')
+STAGE_FUNCS = {'fetch':stage_fetch,
+               'parse':stage_parse,
+               'normalize':stage_normalize,
+               'insert':stage_insert,
+               'tag':stage_tag,
+               'postprocess':stage_postprocess}
+
+
+
+## RUNNING THE PIPELINE
+
+def _stage_artifact_path(runid, stage):
+    '''
+    This returns the path where the output of a completed stage is saved.
+
+    '''
+
+    return os.path.join(CACHEDIR, 'ingest-run-%s-%s.pkl' % (runid, stage))
+
+
+
+def run_stage(runid, stage, upstream, upstream_stage, stats, context):
+    '''
+    This wraps a stage's generator so that its wall time and row count are
+    recorded in ingest_runs once it's done, along with its saved output. The
+    wall time doesn't include the time spent waiting on the upstream stage.
+
+    '''
+
+    database = context['database']
+    stat = stats[stage] = {'nrows':0,
+                           'inclusive_time':0.0,
+                           'started_utc':time.time()}
+
+    record_ingest_stage(runid, stage, 'running', database,
+                        started_utc=stat['started_utc'])
+
+    stagegen = STAGE_FUNCS[stage](upstream, stat, context)
+    outputs = []
+
+    while True:
+
+        steptime = time.time()
+
+        try:
+
+            item = next(stagegen)
+            stat['inclusive_time'] += time.time() - steptime
+
+        except StopIteration:
+
+            stat['inclusive_time'] += time.time() - steptime
+            break
+
+        except Exception as e:
+
+            stat['inclusive_time'] += time.time() - steptime
+
+            # the first stage to see the exception is the one that failed, the
+            # downstream ones just didn't get to finish
+            if 'failed_stage' not in context:
+                context['failed_stage'] = stage
+                status, error = 'failed', '%r' % e
+            else:
+                status, error = 'incomplete', None
+
+            record_ingest_stage(runid, stage, status, database,
+                                started_utc=stat['started_utc'],
+                                nrows=stat['nrows'],
+                                error=error)
+            raise
+
+        outputs.append(item)
+        yield item
+
+    stat['wall_time'] = stat['inclusive_time']
+    if upstream_stage in stats:
+        stat['wall_time'] -= stats[upstream_stage]['inclusive_time']
+
+    if not os.path.exists(CACHEDIR):
+        os.makedirs(CACHEDIR)
+
+    artifact = _stage_artifact_path(runid, stage)
+    with open(artifact,'wb') as fd:
+        pickle.dump(outputs, fd, pickle.HIGHEST_PROTOCOL)
+
+    record_ingest_stage(runid, stage, 'done', database,
+                        started_utc=stat['started_utc'],
+                        wall_time=stat['wall_time'],
+                        nrows=stat['nrows'],
+                        artifact=artifact)
+
+
+
+def ingest_arxiv(urls=None,
+                 database=None,
+                 firstname_match_threshold=93,
+                 fullname_match_threshold=72,
+                 backend=arxivutils.PARSER_BACKEND,
+                 nworkers=4,
+                 streaming=True,
+                 resume=False):
+    '''
+    This runs the nightly arxiv ingest: it fetches the listings at urls
+    (default: arxivutils.LISTING_URLS), parses and merges them, inserts the
+    articles into the DB, tags the local authors, and runs the postprocessing
+    hooks.
+
+    If streaming is True, the listings are streamed from the arxiv server one
+    after the other and parsed entry-by-entry while they download. Otherwise,
+    they're fetched concurrently into the raw listing cache using nworkers
+    threads and then parsed from there.
+
+    If resume is True, the latest ingest run is picked up again from the last
+    stage that completed instead of starting a new run. This is meant for
+    rerunning a failed run by hand; the nightly update should always start a
+    new run so it doesn't redo an old night's listing.
+
+    Returns the run ID and a dict of the stats for the stages that ran. If a
+    stage fails, its exception is raised again after the run is recorded, so
+    the nightly update exits with an error.
+
+    '''
+
+    if urls is None:
+        urls = arxivutils.LISTING_URLS
+
+    # open the database if needed and get a cursor
+    if not database:
+        database, cursor = arxivdb.opendb()
+        closedb = True
+    else:
+        cursor = database.cursor()
+        closedb = False
+
+    ensure_ingest_runs_table(database)
+
+    cursor.execute('select max(run_id) from ingest_runs')
+    lastrunid = cursor.fetchone()[0]
+
+    startind, upstream = 0, urls
+
+    if resume and lastrunid is not None:
+
+        runid = lastrunid
+        records = {x['stage']:x for x in get_ingest_run(runid,
+                                                        database=database)}
+
+        # skip over the stages that are done and have their output saved
+        while (startind < len(STAGES) and
+               STAGES[startind] in records and
+               records[STAGES[startind]]['status'] == 'done' and
+               records[STAGES[startind]]['artifact'] and
+               os.path.exists(records[STAGES[startind]]['artifact'])):
+            startind += 1
+
+        if all(x in records and records[x]['status'] == 'done'
+               for x in STAGES):
+            print('ingest run %s already completed, nothing to resume' % runid)
+            if closedb:
+                cursor.close()
+                database.close()
+            return runid, {}
+
+        if startind > 0:
+            with open(records[STAGES[startind-1]]['artifact'],'rb') as fd:
+                upstream = pickle.load(fd)
+
+        # the articles keep the time of the original run
+        runutc = datetime.fromtimestamp(
+            min(x['started_utc'] for x in records.values()), tz=utc
+        )
+
+        print('resuming ingest run %s from the %s stage' %
+              (runid, STAGES[startind]))
+
+    else:
+
+        runid = (lastrunid or 0) + 1
+        runutc = datetime.now(tz=utc)
+
+    context = {'database':database,
+               'main_url':urls[0],
+               'nlistings':len(urls),
+               'streaming':streaming,
+               'utc':runutc,
+               'backend':backend,
+               'nworkers':nworkers,
+               'firstname_match_threshold':firstname_match_threshold,
+               'fullname_match_threshold':fullname_match_threshold}
+    stats = {}
+
+    # chain the stages together
+    pipeline, upstream_stage = upstream, None
+    for stage in STAGES[startind:]:
+        pipeline = run_stage(runid, stage, pipeline, upstream_stage,
+                             stats, context)
+        upstream_stage = stage
+
+    try:
+
+        for utcdate in pipeline:
+            print('ingested arxiv listings for %s' % utcdate)
+
+    except Exception as e:
+
+        print('ingest run %s failed in the %s stage, error was %r. '
+              'run ingest_arxiv(resume=True) to rerun it from there' %
+              (runid, context.get('failed_stage'), e))
+        raise
+
+    else:
+
+        # the saved stage outputs are only needed to resume failed runs
+        for stage in STAGES:
+
+            artifact = _stage_artifact_path(runid, stage)
+            if os.path.exists(artifact):
+                os.remove(artifact)
+
+        cursor.execute('update ingest_runs set artifact = null '
+                       'where run_id = ?', (runid,))
+        database.commit()
+
+    finally:
+
+        for stage in STAGES[startind:]:
+            if stage in stats and 'wall_time' in stats[stage]:
+                print('ingest run %s: %-12s %8.3f sec %8s rows' %
+                      (runid, stage,
+                       stats[stage]['wall_time'], stats[stage]['nrows']))
+
+        # at the end, close the cursor and DB connection
+        if closedb:
+            cursor.close()
+            database.close()
+
+    return runid, stats
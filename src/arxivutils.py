@@ -7,8 +7,18 @@ astroph-coffee server.
 
 '''
 
+import os
+import os.path
 import random
 import time
+import re
+import gzip
+import json
+import codecs
+import ConfigParser
+import threading
+from multiprocessing.pool import ThreadPool
+from urlparse import urlparse
 from datetime import date, datetime
 
 from selenium import webdriver
@@ -19,18 +29,280 @@ import requests, requests.exceptions
 
 from pytz import utc
 
+# the lxml parser backend is optional, but it's a lot faster than BeautifulSoup
+try:
+    from lxml import etree
+    from lxml import html as lxmlhtml
+    HAVE_LXML = True
+except Exception as e:
+    print("can't find lxml, falling back to the BeautifulSoup parser backend "
+          "for arxiv listings, this will be a lot slower")
+    HAVE_LXML = False
+
+# size of the chunks (in kilobytes) to read from the arxiv server when streaming
 CHUNKSIZE = 64
+
+# these are the tags we care about when splitting a streaming listing page
+ENTRY_TAG_REGEX = re.compile(r'<(h3|dl|/dl|dt)\b', re.IGNORECASE)
+
+# this gets the category out of a listing URL
+LISTING_CATEGORY_REGEX = re.compile(r'/list/([^/?]+)')
+
 REQUEST_HEADERS = {
     'User-Agent': ('Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:40.0)'
                    ' Gecko/20100101 Firefox/40.0')
     }
 
+CONF = ConfigParser.ConfigParser()
+CONF.read('conf/astroph.conf')
+
+# raw listing snapshots and the ETag/Last-Modified state go here
+CACHEDIR = CONF.get('paths','cache')
+FETCH_STATE_FILE = 'arxiv-fetch-state.json'
+
+# this is shared by all listing requests so they reuse connections to arxiv
+FETCH_SESSION = requests.Session()
+FETCH_SESSION.headers.update(REQUEST_HEADERS)
+FETCH_SESSION.mount('https://',
+                    requests.adapters.HTTPAdapter(pool_connections=4,
+                                                  pool_maxsize=8))
+FETCH_SESSION.mount('http://',
+                    requests.adapters.HTTPAdapter(pool_connections=4,
+                                                  pool_maxsize=8))
+
+# the listings to fetch on each update. the first one is the main listing, the
+# rest are merged into it by arxiv_update. e.g.:
+# listing_urls = https://arxiv.org/list/astro-ph/new,
+#                https://arxiv.org/list/gr-qc/new
+if CONF.has_option('arxiv','listing_urls'):
+    LISTING_URLS = [x.strip()
+                    for x in CONF.get('arxiv','listing_urls').split(',')
+                    if len(x.strip()) > 0]
+else:
+    LISTING_URLS = ['https://arxiv.org/list/astro-ph/new']
+
+# politeness limits for concurrent fetches: at most HOST_CONCURRENCY requests
+# in flight to any host, with HOST_DELAY seconds between starting them
+HOST_CONCURRENCY = 2
+HOST_DELAY = 1.0
+HOST_SEMAPHORES = {}
+HOST_LASTSTART = {}
+HOST_LOCK = threading.Lock()
+
+# this protects the fetch state file when fetching listings concurrently
+FETCH_STATE_LOCK = threading.Lock()
+
+
+## FETCH STATE AND LISTING CACHE
+
+def load_fetch_state(cachedir=CACHEDIR):
+    '''
+    This loads the ETag/Last-Modified state for all listing URLs fetched so
+    far. Returns a dict of the form:
+
+    {url: {'etag', 'last_modified', 'snapshot', 'partial', 'fetched_utc'}}
+
+    '''
+
+    statefile = os.path.join(cachedir, FETCH_STATE_FILE)
+
+    if not os.path.exists(statefile):
+        return {}
+
+    try:
+        with open(statefile,'rb') as fd:
+            return json.load(fd)
+    except Exception as e:
+        print("can't read fetch state from %s, ignoring it: %s" %
+              (statefile, e))
+        return {}
+
+
+
+def save_fetch_state(state, cachedir=CACHEDIR):
+    '''
+    This writes the fetch state dict back to the cache directory. The write is
+    atomic so a crashed cron run never leaves a half-written state file.
+
+    '''
+
+    if not os.path.exists(cachedir):
+        os.makedirs(cachedir)
+
+    statefile = os.path.join(cachedir, FETCH_STATE_FILE)
+    tempfile = '%s.tmp-%s' % (statefile, os.getpid())
+
+    with open(tempfile,'wb') as fd:
+        json.dump(state, fd, indent=2)
+
+    os.rename(tempfile, statefile)
+
+
+
+def listing_snapshot_path(url, fetch_dt, cachedir=CACHEDIR):
+    '''
+    This returns the path of the gzipped raw HTML snapshot for url fetched at
+    fetch_dt. Snapshots are never overwritten, so the cache directory doubles
+    as an archive of raw listings.
+
+    '''
+
+    return os.path.join(cachedir,
+                        '%s-%s.html.gz' % (listing_snapshot_slug(url),
+                                           fetch_dt.strftime('%Y%m%dT%H%M%SZ')))
+
+
+
+def listing_snapshot_slug(url):
+    '''
+    This returns the filename prefix of the raw HTML snapshots for url.
+
+    '''
+
+    return re.sub(r'[^a-zA-Z0-9]+', '-', url.split('://')[-1]).strip('-')
+
+
+
+def read_listing_snapshot(snapshot):
+    '''
+    This reads a gzipped raw HTML snapshot back as unicode.
+
+    '''
+
+    with gzip.open(snapshot,'rb') as fd:
+        return fd.read().decode('utf-8')
+
+
+
+def iter_listing_snapshot(snapshot):
+    '''
+    This yields a gzipped raw HTML snapshot as unicode chunks of CHUNKSIZE
+    kilobytes, the same way get_page_chunks does for a live page.
+
+    '''
+
+    decoder = codecs.getincrementaldecoder('utf-8')()
+
+    with gzip.open(snapshot,'rb') as fd:
+
+        while True:
+
+            chunk = fd.read(CHUNKSIZE*1024)
+            if not chunk:
+                break
+
+            yield decoder.decode(chunk)
+
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+
+def conditional_headers(url, state, allow_partial=False):
+    '''
+    This returns If-None-Match/If-Modified-Since headers for url if we have a
+    snapshot we can fall back on when arxiv says the page hasn't changed.
+
+    Snapshots written by streaming fetches that stopped early are partial. These
+    are only good enough for other streaming fetches, so they're only used if
+    allow_partial is True.
 
-def get_page_html(url, fakery=False):
+    '''
+
+    urlstate = state.get(url)
+
+    if (not urlstate or
+        not urlstate.get('snapshot') or
+        not os.path.exists(urlstate['snapshot']) or
+        (urlstate.get('partial') and not allow_partial)):
+        return {}
+
+    headers = {}
+
+    if urlstate.get('etag'):
+        headers['If-None-Match'] = urlstate['etag']
+    if urlstate.get('last_modified'):
+        headers['If-Modified-Since'] = urlstate['last_modified']
+
+    return headers
+
+
+
+def update_fetch_state(url, response, snapshot, partial=False,
+                       cachedir=CACHEDIR):
+    '''
+    This records the validators from a 200 response for url along with the
+    snapshot the page was saved to.
+
+    '''
+
+    with FETCH_STATE_LOCK:
+
+        state = load_fetch_state(cachedir=cachedir)
+
+        state[url] = {'etag':response.headers.get('ETag'),
+                      'last_modified':response.headers.get('Last-Modified'),
+                      'snapshot':snapshot,
+                      'partial':partial,
+                      'fetched_utc':datetime.now(tz=utc).isoformat()}
+
+        save_fetch_state(state, cachedir=cachedir)
+
+
+
+## FETCHING PAGES
+
+def polite_get(url, **kwargs):
+    '''
+    This does FETCH_SESSION.get(url, **kwargs) while respecting the per-host
+    politeness limits HOST_CONCURRENCY and HOST_DELAY. It's safe to call from
+    multiple threads.
+
+    For streaming requests, the host slot is released once the response headers
+    are in.
+
+    '''
+
+    host = urlparse(url).netloc
+
+    with HOST_LOCK:
+
+        if host not in HOST_SEMAPHORES:
+            HOST_SEMAPHORES[host] = threading.BoundedSemaphore(HOST_CONCURRENCY)
+        semaphore = HOST_SEMAPHORES[host]
+
+    semaphore.acquire()
+
+    try:
+
+        # reserve the next start time for this host and wait for it
+        with HOST_LOCK:
+            timenow = time.time()
+            starttime = max(timenow,
+                            HOST_LASTSTART.get(host, 0.0) + HOST_DELAY)
+            HOST_LASTSTART[host] = starttime
+
+        if starttime > timenow:
+            time.sleep(starttime - timenow)
+
+        return FETCH_SESSION.get(url, **kwargs)
+
+    finally:
+        semaphore.release()
+
+
+
+def get_page_html(url, fakery=False, usecache=True, cachedir=CACHEDIR):
     '''
     This connects to the arxiv server and downloads the HTML of the page, while
     faking some activity if requested via the Selenium browser driver.
 
+    If usecache is True, the request is made conditional on the ETag and
+    Last-Modified values from the last fetch of this URL. If arxiv replies with
+    304 Not Modified, the HTML comes from the raw listing snapshot in
+    cachedir. New pages are saved there as gzipped snapshots.
+
     '''
 
     if fakery:
@@ -52,11 +324,40 @@ def get_page_html(url, fakery=False):
 
     else:
 
-        pagerequest = requests.get(url,
-                                   headers=REQUEST_HEADERS)
+        if usecache:
+            state = load_fetch_state(cachedir=cachedir)
+            headers = conditional_headers(url, state)
+        else:
+            headers = {}
+
+        pagerequest = polite_get(url, headers=headers)
+
+        if (headers and
+            pagerequest.status_code == requests.codes.not_modified):
+
+            print('%s has not changed since the last fetch, '
+                  'using cached snapshot: %s' %
+                  (url, state[url]['snapshot']))
+            html = read_listing_snapshot(state[url]['snapshot'])
+
+        elif pagerequest.status_code == requests.codes.ok:
 
-        if pagerequest.status_code == requests.codes.ok:
             html = pagerequest.text
+
+            if usecache:
+
+                snapshot = listing_snapshot_path(url,
+                                                 datetime.now(tz=utc),
+                                                 cachedir=cachedir)
+                if not os.path.exists(cachedir):
+                    os.makedirs(cachedir)
+
+                with gzip.open(snapshot,'wb') as fd:
+                    fd.write(html.encode('utf-8'))
+
+                update_fetch_state(url, pagerequest, snapshot,
+                                   cachedir=cachedir)
+
         else:
             html = None
 
@@ -106,158 +407,936 @@ def get_arxiv_lists(soup):
 
 
 
+def get_arxiv_entry(link, data, crosslist=False):
+    '''
+    This parses a single listing entry into a dict.
+
+    link is the <dt> tag and data is the <div class="meta"> tag for the
+    entry. If crosslist is True, the title is annotated with the original arxiv
+    category of the paper.
+
+    '''
+
+    try:
+        entry_abstract = squeeze(data.p.text.replace('\n',' ').strip())
+    except:
+        entry_abstract = ''
+
+    entry_title = squeeze(
+        data.find_all(
+            'div',class_='list-title'
+        )[0].text.strip('\n').replace('Title:','',1)
+    )
+
+    entry_authors = (
+        data.find_all(
+            'div',class_='list-authors'
+        )[0].text.strip('\n').replace('Authors:','',1)
+        )
+    entry_authors = [squeeze(x.lstrip('\n').rstrip('\n'))
+                     for x in entry_authors.split(', ')]
+
+    entry_links = link.find_all('a')[1:3]
+    entry_link, arxiv_id = entry_links[0]['href'], entry_links[0].text
+    entry_pdf = entry_links[1]['href']
+
+    if crosslist:
+
+        # figure out which original arxiv this came from
+        try:
+            cltext = link.text
+            cltext_xlind_start = cltext.index('cross-list')
+            cltext_xlind_end = cltext.index('[pdf') - 2
+
+            # annotate the title with the original arxiv category
+            cltext = cltext[cltext_xlind_start:cltext_xlind_end]
+            entry_title = u'[%s] %s' % (cltext, entry_title)
+
+        # if the cross-list doesn't say where it came from, just add a
+        # [cross-list] annotation
+        except:
+            entry_title = u'[cross-list] %s' % entry_title
+
+    try:
+        comment_contents = data.find(
+            'div',class_='list-comments'
+        ).contents[2:]
+        entry_comments = squeeze(' '.join(
+            [str(x).lstrip('\n').rstrip('\n') for x in comment_contents]
+            ).strip())
+
+        # handle internal arxiv links correctly
+        if '<a href="/abs' in entry_comments:
+            entry_comments = entry_comments.replace(
+                '/abs','https://arxiv.org/abs'
+                )
+
+    except AttributeError:
+        entry_comments = ''
+
+    return {'authors':entry_authors,
+            'title':entry_title,
+            'abstract':entry_abstract,
+            'comments':entry_comments,
+            'arxiv':arxiv_id,
+            'link':entry_link,
+            'pdf':entry_pdf}
+
+
+
 def get_arxiv_articles(paperlinks, paperdata, crosslinks, crossdata):
 
     paperdict = {}
     crossdict = {}
 
     for ind, link, data in zip(range(len(paperlinks)), paperlinks, paperdata):
+        paperdict[ind+1] = get_arxiv_entry(link, data)
 
-        try:
-            paper_abstract = squeeze(data.p.text.replace('\n',' ').strip())
-        except:
-            paper_abstract = ''
+    for ind, link, data in zip(range(len(crosslinks)), crosslinks, crossdata):
+        crossdict[ind+1] = get_arxiv_entry(link, data, crosslist=True)
 
-        paper_title = squeeze(
-            data.find_all(
-                'div',class_='list-title'
-            )[0].text.strip('\n').replace('Title:','',1)
-        )
+    return paperdict, crossdict
 
-        paper_authors = (
-            data.find_all(
-                'div',class_='list-authors'
-            )[0].text.strip('\n').replace('Authors:','',1)
-            )
-        paper_authors = [squeeze(x.lstrip('\n').rstrip('\n'))
-                         for x in paper_authors.split(', ')]
 
-        paper_links = link.find_all('a')[1:3]
-        paper_link, arxiv_id = paper_links[0]['href'], paper_links[0].text
-        paper_pdf = paper_links[1]['href']
 
-        try:
-            comment_contents = data.find(
-                'div',class_='list-comments'
-            ).contents[2:]
-            paper_comments = squeeze(' '.join(
-                [str(x).lstrip('\n').rstrip('\n') for x in comment_contents]
-                ).strip())
+## PARSER BACKENDS
+
+def parse_listing_bs4(htmldoc, papers_only=False):
+    '''
+    This parses a full listing page into paperdict, crossdict using
+    BeautifulSoup.
 
-            # handle internal arxiv links correctly
-            if '<a href="/abs' in paper_comments:
-                paper_comments = paper_comments.replace(
-                    '/abs','https://arxiv.org/abs'
-                    )
+    If papers_only is True, only the first <dl> on the page is parsed (this is
+    what we want for the /pastweek page).
 
-        except AttributeError:
-            paper_comments = ''
+    '''
 
+    soup = soupify(htmldoc)
 
-        paperdict[ind+1] = {'authors':paper_authors,
-                            'title':paper_title,
-                            'abstract':paper_abstract,
-                            'comments':paper_comments,
-                            'arxiv':arxiv_id,
-                            'link':paper_link,
-                            'pdf':paper_pdf}
+    if papers_only:
+        papers = soup.find_all('dl')[0]
+        paperlinks, paperdata = (papers.find_all('dt'),
+                                 papers.find_all('div', class_='meta'))
+        crosslinks, crossdata = [], []
+    else:
+        paperlinks, paperdata, crosslinks, crossdata = get_arxiv_lists(soup)
 
+    return get_arxiv_articles(paperlinks, paperdata, crosslinks, crossdata)
 
-    for ind, link, data in zip(range(len(crosslinks)), crosslinks, crossdata):
 
-        try:
-            cross_abstract = squeeze(data.p.text.replace('\n',' ').strip())
-        except:
-            cross_abstract = ''
 
-        cross_title = squeeze(
-            data.find_all(
-                'div',class_='list-title'
-            )[0].text.strip('\n').replace('Title:','',1)
+def _xpath_class(tag, cssclass):
+    '''
+    This returns an XPath expression matching descendant tags with the CSS class
+    cssclass, the same way BeautifulSoup's find_all(tag, class_=cssclass) does.
+
+    '''
+
+    return (".//%s[contains(concat(' ', normalize-space(@class), ' '), "
+            "' %s ')]" % (tag, cssclass))
+
+
+if HAVE_LXML:
+
+    # these are compiled once so we don't pay for XPath parsing on each entry
+    XPATH_DL = etree.XPath('//dl')
+    XPATH_DT = etree.XPath('.//dt')
+    XPATH_A = etree.XPath('.//a')
+    XPATH_P = etree.XPath('.//p[1]')
+    XPATH_META = etree.XPath(_xpath_class('div', 'meta'))
+    XPATH_TITLE = etree.XPath(_xpath_class('div', 'list-title'))
+    XPATH_AUTHORS = etree.XPath(_xpath_class('div', 'list-authors'))
+    XPATH_COMMENTS = etree.XPath(_xpath_class('div', 'list-comments'))
+
+
+
+def _lxml_contents(elem):
+    '''
+    This returns the child text and tags of elem as a list, like the .contents
+    attribute of a BeautifulSoup tag. Tags are serialized to HTML.
+
+    '''
+
+    contents = []
+
+    if elem.text:
+        contents.append(elem.text)
+
+    for child in elem:
+        contents.append(etree.tostring(child,
+                                       encoding='unicode',
+                                       method='html',
+                                       with_tail=False))
+        if child.tail:
+            contents.append(child.tail)
+
+    return contents
+
+
+
+def get_arxiv_entry_lxml(link, data, crosslist=False):
+    '''
+    This is the lxml version of get_arxiv_entry. link is the <dt> element and
+    data is the <div class="meta"> element for the entry.
+
+    '''
+
+    abstract = XPATH_P(data)
+    if abstract:
+        entry_abstract = squeeze(
+            abstract[0].text_content().replace('\n',' ').strip()
         )
+    else:
+        entry_abstract = ''
 
-        cross_authors = (
-            data.find_all(
-                'div',class_='list-authors'
-            )[0].text.strip('\n').replace('Authors:','',1)
-            )
-        cross_authors = [squeeze(x.lstrip('\n').rstrip('\n'))
-                         for x in cross_authors.split(', ')]
+    entry_title = squeeze(
+        XPATH_TITLE(data)[0].text_content().strip('\n').replace('Title:','',1)
+    )
+
+    entry_authors = (
+        XPATH_AUTHORS(data)[0].text_content().strip('\n').replace(
+            'Authors:','',1
+        )
+    )
+    entry_authors = [squeeze(x.lstrip('\n').rstrip('\n'))
+                     for x in entry_authors.split(', ')]
+
+    entry_links = XPATH_A(link)[1:3]
+    entry_link, arxiv_id = (entry_links[0].get('href'),
+                            entry_links[0].text_content())
+    entry_pdf = entry_links[1].get('href')
 
-        cross_links = link.find_all('a')[1:3]
-        cross_link, arxiv_id = cross_links[0]['href'], cross_links[0].text
-        cross_pdf = cross_links[1]['href']
+    if crosslist:
 
         # figure out which original arxiv this came from
         try:
-            cltext = link.text
+            cltext = link.text_content()
             cltext_xlind_start = cltext.index('cross-list')
             cltext_xlind_end = cltext.index('[pdf') - 2
 
             # annotate the title with the original arxiv category
             cltext = cltext[cltext_xlind_start:cltext_xlind_end]
-            cross_title = u'[%s] %s' % (cltext, cross_title)
+            entry_title = u'[%s] %s' % (cltext, entry_title)
 
         # if the cross-list doesn't say where it came from, just add a
         # [cross-list] annotation
         except:
-            cross_title = u'[cross-list] %s' % cross_title
+            entry_title = u'[cross-list] %s' % entry_title
 
-        try:
-            comment_contents = data.find(
-                'div',class_='list-comments'
-            ).contents[2:]
-            cross_comments = squeeze(
-                ' '.join(
-                    [str(x).lstrip('\n').rstrip('\n') for x in comment_contents]
-                ).strip()
+    comments = XPATH_COMMENTS(data)
+
+    if comments:
+
+        comment_contents = _lxml_contents(comments[0])[2:]
+        entry_comments = squeeze(u' '.join(
+            [x.lstrip('\n').rstrip('\n') for x in comment_contents]
+        ).strip())
+
+        # handle internal arxiv links correctly
+        if '<a href="/abs' in entry_comments:
+            entry_comments = entry_comments.replace(
+                '/abs','https://arxiv.org/abs'
             )
 
-            # handle internal arxiv links correctly
-            if '<a href="/abs' in paper_comments:
-                paper_comments = paper_comments.replace(
-                    '/abs','https://arxiv.org/abs'
-                    )
+    else:
+        entry_comments = ''
+
+    return {'authors':entry_authors,
+            'title':entry_title,
+            'abstract':entry_abstract,
+            'comments':entry_comments,
+            'arxiv':arxiv_id,
+            'link':entry_link,
+            'pdf':entry_pdf}
+
+
+
+def parse_listing_lxml(htmldoc, papers_only=False):
+    '''
+    This parses a full listing page into paperdict, crossdict using lxml and
+    compiled XPath expressions. The output is the same as parse_listing_bs4.
+
+    '''
+
+    doc = lxmlhtml.document_fromstring(htmldoc)
+    docparts = XPATH_DL(doc)
+
+    paperdict = {}
+    crossdict = {}
 
-        except AttributeError:
-            cross_comments = ''
+    # same rules as get_arxiv_lists: (new, crosslists, replacements) or just
+    # the new papers if the page doesn't look like that
+    if papers_only or len(docparts) < 3:
+        papers, crosslists = docparts[0], None
+    else:
+        papers, crosslists = docparts[0], docparts[1]
 
-        crossdict[ind+1] = {'authors':cross_authors,
-                            'title':cross_title,
-                            'abstract':cross_abstract,
-                            'comments':cross_comments,
-                            'arxiv':arxiv_id,
-                            'link':cross_link,
-                            'pdf':cross_pdf}
+    for ind, (link, data) in enumerate(zip(XPATH_DT(papers),
+                                           XPATH_META(papers))):
+        paperdict[ind+1] = get_arxiv_entry_lxml(link, data)
 
+    if crosslists is not None:
+        for ind, (link, data) in enumerate(zip(XPATH_DT(crosslists),
+                                               XPATH_META(crosslists))):
+            crossdict[ind+1] = get_arxiv_entry_lxml(link, data,
+                                                    crosslist=True)
 
     return paperdict, crossdict
 
 
 
+def parse_fragment_bs4(fragment, crosslist=False):
+    '''
+    This parses a single <dt>...<dd>...</dd> fragment using BeautifulSoup.
+
+    '''
+
+    soup = soupify(fragment)
+    link, data = soup.find('dt'), soup.find('div', class_='meta')
+
+    return get_arxiv_entry(link, data, crosslist=crosslist)
+
+
+
+def parse_fragment_lxml(fragment, crosslist=False):
+    '''
+    This parses a single <dt>...<dd>...</dd> fragment using lxml.
+
+    '''
+
+    dlist = lxmlhtml.fragment_fromstring(fragment, create_parent='dl')
+    link, data = XPATH_DT(dlist)[0], XPATH_META(dlist)[0]
+
+    return get_arxiv_entry_lxml(link, data, crosslist=crosslist)
+
+
+
+# these are the available parser backends:
+# name -> (full page parser function, streaming fragment parser function)
+PARSER_BACKENDS = {'bs4':(parse_listing_bs4, parse_fragment_bs4)}
+if HAVE_LXML:
+    PARSER_BACKENDS['lxml'] = (parse_listing_lxml, parse_fragment_lxml)
+
+# lxml wins benchmark_parser_backends by a wide margin, so use it if we can
+PARSER_BACKEND = 'lxml' if HAVE_LXML else 'bs4'
+
+
+
+def _normalize_entry(entry):
+    '''
+    This turns all strings in an entry dict into unicode for comparisons. The
+    BeautifulSoup backend returns UTF-8 byte strings for comments.
+
+    '''
+
+    normalized = {}
+
+    for key, val in entry.items():
+        if isinstance(val, list):
+            normalized[key] = [
+                x.decode('utf-8') if isinstance(x, bytes) else x for x in val
+            ]
+        elif isinstance(val, bytes):
+            normalized[key] = val.decode('utf-8')
+        else:
+            normalized[key] = val
+
+    return normalized
+
+
+
+def verify_parser_backends(htmlfiles,
+                           backends=('bs4','lxml'),
+                           papers_only=False):
+    '''
+    This runs the full page parsers for two backends on saved listing pages and
+    diffs their output.
+
+    htmlfiles is a list of paths to saved listing HTML files. Returns a list of
+    differences of the form:
+
+    (htmlfile, listtype, serial, key, first backend value, second backend value)
+
+    An empty list means the backends agree on all the pages.
+
+    '''
+
+    first, second = backends
+    differences = []
+
+    for htmlfile in htmlfiles:
+
+        with open(htmlfile,'rb') as fd:
+            htmldoc = fd.read().decode('utf-8')
+
+        first_results = PARSER_BACKENDS[first][0](htmldoc,
+                                                  papers_only=papers_only)
+        second_results = PARSER_BACKENDS[second][0](htmldoc,
+                                                    papers_only=papers_only)
+
+        for listtype, first_list, second_list in zip(('papers','crosslists'),
+                                                     first_results,
+                                                     second_results):
+
+            for serial in sorted(set(first_list.keys()) |
+                                 set(second_list.keys())):
+
+                if serial not in first_list or serial not in second_list:
+                    differences.append((htmlfile, listtype, serial, None,
+                                        first_list.get(serial),
+                                        second_list.get(serial)))
+                    continue
+
+                first_entry = _normalize_entry(first_list[serial])
+                second_entry = _normalize_entry(second_list[serial])
+
+                for key in sorted(set(first_entry.keys()) |
+                                  set(second_entry.keys())):
+                    if first_entry.get(key) != second_entry.get(key):
+                        differences.append((htmlfile, listtype, serial, key,
+                                            first_entry.get(key),
+                                            second_entry.get(key)))
+
+        print('%s: %s papers, %s cross-lists, %s differences' %
+              (htmlfile,
+               len(first_results[0]),
+               len(first_results[1]),
+               len([x for x in differences if x[0] == htmlfile])))
+
+    return differences
+
+
+
+def benchmark_parser_backends(htmlfiles, nruns=5, papers_only=False):
+    '''
+    This times the full page parsers for all available backends on saved
+    listing pages.
+
+    Returns a dict of the form {backend name: best time in seconds to parse all
+    of htmlfiles}.
+
+    '''
+
+    htmldocs = []
+
+    for htmlfile in htmlfiles:
+        with open(htmlfile,'rb') as fd:
+            htmldocs.append(fd.read().decode('utf-8'))
+
+    timings = {}
+
+    for backend in PARSER_BACKENDS:
+
+        runtimes = []
+
+        for run in range(nruns):
+
+            start = time.time()
+            for htmldoc in htmldocs:
+                PARSER_BACKENDS[backend][0](htmldoc, papers_only=papers_only)
+            runtimes.append(time.time() - start)
+
+        timings[backend] = min(runtimes)
+        print('%s: %.3f seconds' % (backend, timings[backend]))
+
+    return timings
+
+
+
+## STREAMING PARSER
+
+def get_page_chunks(url, fakery=False, usecache=True, cachedir=CACHEDIR):
+    '''
+    This is a generator version of get_page_html. It yields the HTML of the
+    page in chunks of CHUNKSIZE kilobytes as they arrive from the arxiv server.
+
+    If fakery is True, the Selenium driver can only give us the whole page at
+    once, so that's yielded as a single chunk.
+
+    If usecache is True, this does the same conditional request dance as
+    get_page_html. The chunks are written to a gzipped snapshot as they
+    arrive. If the caller stops iterating early, the snapshot is marked as
+    partial (it still has everything the caller looked at). If the download
+    fails halfway, the snapshot is thrown away and the fetch state from the
+    last good fetch is kept.
+
+    '''
+
+    if fakery:
+
+        html = get_page_html(url, fakery=True)
+        if html:
+            yield html
+
+    else:
+
+        if usecache:
+            state = load_fetch_state(cachedir=cachedir)
+            headers = conditional_headers(url, state, allow_partial=True)
+        else:
+            headers = {}
+
+        pagerequest = polite_get(url, headers=headers, stream=True)
+        snapshot_fd, snapshot, complete, stopped = None, None, False, False
+
+        try:
+
+            if (headers and
+                pagerequest.status_code == requests.codes.not_modified):
+
+                print('%s has not changed since the last fetch, '
+                      'using cached snapshot: %s' %
+                      (url, state[url]['snapshot']))
+
+                for chunk in iter_listing_snapshot(state[url]['snapshot']):
+                    yield chunk
+
+            elif pagerequest.status_code == requests.codes.ok:
+
+                # arxiv serves UTF-8, but make sure we get unicode chunks back
+                # even if the charset is missing from the response headers
+                if not pagerequest.encoding:
+                    pagerequest.encoding = 'utf-8'
+
+                if usecache:
+                    if not os.path.exists(cachedir):
+                        os.makedirs(cachedir)
+                    snapshot = listing_snapshot_path(url,
+                                                     datetime.now(tz=utc),
+                                                     cachedir=cachedir)
+                    snapshot_fd = gzip.open(snapshot,'wb')
+
+                for chunk in pagerequest.iter_content(
+                        chunk_size=CHUNKSIZE*1024,
+                        decode_unicode=True
+                ):
+                    if snapshot_fd:
+                        snapshot_fd.write(chunk.encode('utf-8'))
+                    yield chunk
+
+                complete = True
+
+        # the caller stopped iterating early
+        except GeneratorExit:
+            stopped = True
+            raise
+
+        # closing the response early (e.g. if the caller stops iterating)
+        # means we don't download stuff we don't need
+        finally:
+
+            pagerequest.close()
+
+            if snapshot_fd:
+
+                snapshot_fd.close()
+
+                if complete or stopped:
+                    update_fetch_state(url, pagerequest, snapshot,
+                                       partial=(not complete),
+                                       cachedir=cachedir)
+
+                # the download failed (e.g. the connection was reset), so the
+                # snapshot ends at some arbitrary point. it mustn't be
+                # recorded with this response's validators, or the next run
+                # would get a 304 and use it as the whole page.
+                else:
+                    print('download of %s failed, '
+                          'discarding its partial snapshot: %s' %
+                          (url, snapshot))
+                    os.remove(snapshot)
+
+
+
+def iter_arxiv_entries(chunks, papers_only=False):
+    '''
+    This incrementally splits the HTML chunks from get_page_chunks into listing
+    entries.
+
+    Yields tuples of the form:
+
+    (listtype, '<dt>...</dt> ... <dd>...</dd>' HTML fragment)
+
+    where listtype is 'papers' for entries in the first <dl> on the page and
+    'crosslists' for entries in the cross-lists <dl>. Iteration stops once we
+    hit the replacements <dl>, so the rest of the page is never downloaded. If
+    papers_only is True, iteration stops at the end of the first <dl> (this is
+    what we want for the /pastweek page, where the first <dl> is the most recent
+    date).
+
+    Only the unparsed tail of the page is kept around, so memory use stays flat
+    regardless of how long the page is.
+
+    '''
+
+    buf = u''
+    ndl = 0
+    heading = u''
+    listtype = None
+
+    for chunk in chunks:
+
+        buf = buf + chunk
+        pos = 0
+
+        while True:
+
+            tagmatch = ENTRY_TAG_REGEX.search(buf, pos)
+
+            if not tagmatch:
+                # keep a few characters in case a tag is split across chunks
+                pos = max(pos, len(buf) - 8)
+                break
+
+            tag = tagmatch.group(1).lower()
+
+            if tag == 'h3':
+
+                endind = buf.find('</h3>', tagmatch.end())
+                if endind == -1:
+                    pos = tagmatch.start()
+                    break
+
+                heading = buf[tagmatch.end():endind].lower()
+                pos = endind + 5
+
+            elif tag == 'dl':
+
+                ndl = ndl + 1
+
+                if ndl == 1:
+                    listtype = 'papers'
+                elif papers_only:
+                    return
+                elif 'cross' in heading or (not heading and ndl == 2):
+                    listtype = 'crosslists'
+                else:
+                    # replacements or anything else we don't care about
+                    return
+
+                pos = tagmatch.end()
+
+            elif tag == '/dl':
+
+                listtype = None
+                if papers_only:
+                    return
+
+                pos = tagmatch.end()
+
+            # this is a <dt>, we need to wait for the matching </dd>
+            else:
+
+                endind = buf.find('</dd>', tagmatch.end())
+                if endind == -1:
+                    pos = tagmatch.start()
+                    break
+
+                if listtype is not None:
+                    yield listtype, buf[tagmatch.start():endind + 5]
+
+                pos = endind + 5
+
+        buf = buf[pos:]
+
+
+
+def parse_arxiv_fragment(fragment, listtype, backend=PARSER_BACKEND):
+    '''
+    This parses an HTML fragment yielded by iter_arxiv_entries into an article
+    dict like the ones returned by get_arxiv_articles.
+
+    '''
+
+    return PARSER_BACKENDS[backend][1](fragment,
+                                       crosslist=(listtype == 'crosslists'))
+
+
+
+def stream_arxiv_articles(url,
+                          fakery=False,
+                          papers_only=False,
+                          backend=PARSER_BACKEND,
+                          usecache=True):
+    '''
+    This yields articles from the listing at url one at a time while the page
+    is still downloading.
+
+    Yields tuples of the form:
+
+    (listtype, serial, articledict)
+
+    listtype is 'papers' or 'crosslists', serial is the position of the article
+    in its list (starting at 1, like the keys of the dicts returned by
+    get_arxiv_articles), and articledict is the dict for the article.
+
+    '''
+
+    serials = {'papers':0, 'crosslists':0}
+    chunks = get_page_chunks(url, fakery=fakery, usecache=usecache)
+
+    try:
+
+        for listtype, fragment in iter_arxiv_entries(chunks,
+                                                     papers_only=papers_only):
+            serials[listtype] = serials[listtype] + 1
+            yield listtype, serials[listtype], parse_arxiv_fragment(
+                fragment,
+                listtype,
+                backend=backend
+            )
+
+    # this makes sure the connection is closed if we stop early
+    finally:
+        chunks.close()
+
+
+
+def collect_arxiv_stream(articles):
+    '''
+    This collects the output of stream_arxiv_articles into the paperdict,
+    crossdict form returned by get_arxiv_articles.
+
+    '''
+
+    collected = {'papers':{}, 'crosslists':{}}
+
+    for listtype, serial, article in articles:
+        collected[listtype][serial] = article
+
+    return collected['papers'], collected['crosslists']
+
+
+
+## MULTIPLE LISTINGS
+
+def listing_category(url):
+    '''
+    This returns the arxiv category of a listing URL, e.g. 'astro-ph.GA' for
+    https://arxiv.org/list/astro-ph.GA/new.
+
+    '''
+
+    match = LISTING_CATEGORY_REGEX.search(url)
+
+    if match:
+        return match.group(1)
+    else:
+        return None
+
+
+
+def pastweek_url(url):
+    '''
+    This turns a /new listing URL into the alternate /pastweek URL used by
+    arxiv_update if the /new page can't be loaded.
+
+    '''
+
+    return re.sub(r'/new/?$', '/pastweek?show=350', url)
+
+
+
+def merge_arxiv_listings(listings, main_url):
+    '''
+    This merges several arxiv dicts into a single one, deduplicating papers by
+    their arxiv ID.
+
+    listings is a list of (url, arxivdict) tuples. main_url is the URL of the
+    main listing (the first of the configured listing URLs), which must be one
+    of them. New papers from the main listing and from any listings in the same
+    archive (e.g. astro-ph.GA for astro-ph) go into 'papers'. New papers from
+    other archives (e.g. gr-qc) go into 'crosslists' with the category added to
+    their title, along with the cross-lists from all the listings.
+
+    If an arxiv ID shows up more than once, the first 'papers' entry wins,
+    followed by the first 'crosslists' entry. Serials are renumbered so they
+    stay contiguous.
+
+    '''
+
+    # if the main listing couldn't be fetched, another archive's papers would
+    # end up as the day's papers
+    if main_url not in [x[0] for x in listings]:
+        raise ValueError('the main listing %s is not in the listings '
+                         'to merge' % main_url)
+
+    main_archive = listing_category(main_url) or ''
+    main_archive = main_archive.split('.')[0]
+
+    papers, crosslists = {}, {}
+    seen = set()
+
+    # go through all the new papers in the main archive first
+    for url, arxiv in listings:
+
+        category = listing_category(url) or ''
+
+        if category.split('.')[0] != main_archive:
+            continue
+
+        for key in sorted(arxiv['papers'].keys()):
+            article = arxiv['papers'][key]
+            if article['arxiv'] not in seen:
+                seen.add(article['arxiv'])
+                papers[len(papers) + 1] = article
+
+    # then do everything else
+    for url, arxiv in listings:
+
+        category = listing_category(url) or ''
+
+        if category.split('.')[0] != main_archive:
+
+            for key in sorted(arxiv['papers'].keys()):
+                article = arxiv['papers'][key]
+                if article['arxiv'] not in seen:
+                    seen.add(article['arxiv'])
+                    article = article.copy()
+                    article['title'] = u'[%s] %s' % (category,
+                                                     article['title'])
+                    crosslists[len(crosslists) + 1] = article
+
+        for key in sorted(arxiv['crosslists'].keys()):
+            article = arxiv['crosslists'][key]
+            if article['arxiv'] not in seen:
+                seen.add(article['arxiv'])
+                crosslists[len(crosslists) + 1] = article
+
+    return {'utc':max(x[1]['utc'] for x in listings),
+            'npapers':len(papers),
+            'papers':papers,
+            'ncrosslists':len(crosslists),
+            'crosslists':crosslists}
+
+
+
+def arxiv_update_multi(urls,
+                       fakery=False,
+                       pickledict=False,
+                       streaming=False,
+                       backend=PARSER_BACKEND,
+                       usecache=True,
+                       nworkers=4):
+    '''
+    This fetches several listing URLs concurrently using a pool of nworkers
+    threads and merges them using merge_arxiv_listings. Requests to the same
+    host are throttled by polite_get. The alternate /pastweek URL for each
+    listing is figured out by pastweek_url.
+
+    Other listings that can't be fetched at all are skipped. Returns None if
+    the main listing (the first URL) can't be fetched.
+
+    '''
+
+    def fetch_listing(url):
+
+        try:
+            return arxiv_update(url=url,
+                                alturl=pastweek_url(url),
+                                fakery=fakery,
+                                pickledict=False,
+                                streaming=streaming,
+                                backend=backend,
+                                usecache=usecache)
+        except Exception as e:
+            print('could not get listing %s, skipping it: %s' % (url, e))
+            return None
+
+    pool = ThreadPool(max(1, min(nworkers, len(urls))))
+
+    try:
+        results = pool.map(fetch_listing, urls)
+    finally:
+        pool.close()
+        pool.join()
+
+    listings = [(url, arxiv) for url, arxiv in zip(urls, results)
+                if arxiv is not None]
+
+    if results[0] is None:
+        print('could not get the main listing %s, '
+              'not merging the other listings' % urls[0])
+        return None
+
+    arxiv = merge_arxiv_listings(listings, urls[0])
+
+    print('merged %s listings: %s papers, %s cross-lists' %
+          (len(listings), arxiv['npapers'], arxiv['ncrosslists']))
+
+    if pickledict:
+        import cPickle as pickle
+        pickle_fpath = 'data/%s-UT-arxiv.pkl' % arxiv['utc'].strftime(
+            '%Y-%m-%d'
+        )
+        with open(pickle_fpath,'wb') as fd:
+            pickle.dump(arxiv, fd, pickle.HIGHEST_PROTOCOL)
+
+    return arxiv
+
+
+
 def arxiv_update(url='https://arxiv.org/list/astro-ph/new',
                  alturl='https://arxiv.org/list/astro-ph/pastweek?show=350',
                  fakery=False,
-                 pickledict=False):
+                 pickledict=False,
+                 streaming=False,
+                 backend=PARSER_BACKEND,
+                 usecache=True,
+                 nworkers=4):
     '''
     This rolls up all the functions above.
 
+    url can also be a list of listing URLs (e.g. LISTING_URLS). These are
+    fetched concurrently and merged by arxiv_update_multi, using nworkers
+    threads. alturl is ignored in this case.
+
+    If streaming is True, the listing is parsed entry-by-entry while it
+    downloads using stream_arxiv_articles instead of being loaded all at once.
+
+    backend is the name of the HTML parser backend to use, one of the keys of
+    PARSER_BACKENDS.
+
+    If usecache is True, the listing pages are fetched conditionally and stored
+    in the raw listing cache (see get_page_html).
+
     '''
 
+    if isinstance(url, (list, tuple)):
+        return arxiv_update_multi(url,
+                                  fakery=fakery,
+                                  pickledict=pickledict,
+                                  streaming=streaming,
+                                  backend=backend,
+                                  usecache=usecache,
+                                  nworkers=nworkers)
+
     arxiv = None
 
     try:
 
         print('updating article DB from arxiv /new page: %s' % url)
 
-        html = get_page_html(url, fakery=fakery)
-        soup = soupify(html)
+        if streaming:
 
-        paperlinks, paperdata, crosslinks, crossdata = get_arxiv_lists(soup)
+            paperdict, crosslistdict = collect_arxiv_stream(
+                stream_arxiv_articles(url,
+                                      fakery=fakery,
+                                      backend=backend,
+                                      usecache=usecache)
+            )
+
+            # an empty listing means the page didn't load correctly
+            if len(paperdict) == 0:
+                raise ValueError('no papers found at %s' % url)
+
+        else:
+
+            html = get_page_html(url, fakery=fakery, usecache=usecache)
+
+            # process the papers and crosslists
+            paperdict, crosslistdict = PARSER_BACKENDS[backend][0](html)
 
-        # process the papers and crosslists
-        paperdict, crosslistdict = get_arxiv_articles(paperlinks, paperdata,
-                                                      crosslinks, crossdata)
         now = datetime.now(tz=utc)
 
         arxiv = {'utc':now,
@@ -279,24 +1358,26 @@ def arxiv_update(url='https://arxiv.org/list/astro-ph/new',
         print('could not get /new page, trying alternative '
               '/recent page: %s' % alturl)
 
-        resp = requests.get(alturl)
-        resphtml = resp.text
+        if streaming:
 
-        soup = BeautifulSoup(resphtml)
-        docparts = soup.find_all('dl')
-
-        # the first dl is for the most recent date
+            # the first dl is for the most recent date, so we stop there
+            paperdict, crosslistdict = collect_arxiv_stream(
+                stream_arxiv_articles(alturl,
+                                      papers_only=True,
+                                      backend=backend,
+                                      usecache=usecache)
+            )
 
-        # get the paper links
-        paperlinks = docparts[0].find_all('dt')
-        paperdata = docparts[0].find_all('div',class_='_meta')
+        else:
 
-        # ignore the cross links and treat them as part of the paper list
-        crosslinks, crossdata = [], []
+            resphtml = get_page_html(alturl, usecache=usecache)
 
-        paperdict, crosslistdict = get_arxiv_articles(
-            paperlinks, paperdata, crosslinks, crossdata
-        )
+            # the first dl is for the most recent date. ignore the cross links
+            # and treat them as part of the paper list
+            paperdict, crosslistdict = PARSER_BACKENDS[backend][0](
+                resphtml,
+                papers_only=True
+            )
 
         # the rest of the bits are the same
         now = datetime.now(tz=utc)
@@ -321,3 +1402,170 @@ def arxiv_update(url='https://arxiv.org/list/astro-ph/new',
         if arxiv is None:
             print('could not get arxiv update '
                   'from /new URL: %s or /recent URL: %s' % (url, alturl))
+
+
+
+## SAVED LISTINGS
+
+# these pull the listing date out of saved listing filenames: the pickles
+# written by arxiv_update(pickledict=True), the raw snapshots in the listing
+# cache, and anything else with a YYYY-MM-DD date in its name
+SAVED_PICKLE_REGEX = re.compile(r'(\d{4}-\d{2}-\d{2})-UT-arxiv\.pkl$')
+SAVED_SNAPSHOT_REGEX = re.compile(r'(\d{8}T\d{6}Z)\.html(\.gz)?$')
+SAVED_DATE_REGEX = re.compile(r'(\d{4}-\d{2}-\d{2})')
+
+
+def saved_listing_datetime(listingfile):
+    '''
+    This returns the UTC datetime that the saved listing in listingfile was
+    fetched at, using its filename if possible and its mtime otherwise.
+
+    '''
+
+    fname = os.path.basename(listingfile)
+
+    pickle_match = SAVED_PICKLE_REGEX.search(fname)
+    snapshot_match = SAVED_SNAPSHOT_REGEX.search(fname)
+    date_match = SAVED_DATE_REGEX.search(fname)
+
+    if pickle_match:
+        listing_dt = datetime.strptime(pickle_match.group(1), '%Y-%m-%d')
+    elif snapshot_match:
+        listing_dt = datetime.strptime(snapshot_match.group(1),
+                                       '%Y%m%dT%H%M%SZ')
+    elif date_match:
+        listing_dt = datetime.strptime(date_match.group(1), '%Y-%m-%d')
+    else:
+        listing_dt = datetime.utcfromtimestamp(os.path.getmtime(listingfile))
+
+    return listing_dt.replace(tzinfo=utc)
+
+
+
+def saved_snapshot_complete(snapshot, fetch_state):
+    '''
+    This checks if a raw HTML snapshot from the listing cache has the whole
+    page. Snapshots written by streaming fetches that stopped early are marked
+    partial in the fetch state, but only until the next fetch of their URL, so
+    the snapshot must also end with the closing </html> tag.
+
+    '''
+
+    for urlstate in fetch_state.values():
+        if (urlstate.get('partial') and
+            urlstate.get('snapshot') and
+            os.path.basename(urlstate['snapshot']) ==
+            os.path.basename(snapshot)):
+            return False
+
+    try:
+        if snapshot.endswith('.gz'):
+            html = read_listing_snapshot(snapshot)
+        else:
+            with open(snapshot,'rb') as fd:
+                html = fd.read().decode('utf-8')
+    except Exception as e:
+        return False
+
+    return html.rstrip().lower().endswith('</html>')
+
+
+
+def find_saved_listings(listingdir, url=None):
+    '''
+    This finds all saved listings (*-UT-arxiv.pkl, *.html, *.html.gz) in
+    listingdir and returns a list of (utcdate, listingfile) tuples sorted by
+    date. If there's more than one listing for a date, only the most recently
+    fetched one is kept.
+
+    The listing cache also has snapshots of other listings (the /pastweek
+    pages, other categories, etc.), so only the snapshots of url (default: the
+    main listing in LISTING_URLS) are used, and snapshots that don't have the
+    whole page are skipped.
+
+    '''
+
+    if url is None:
+        url = LISTING_URLS[0]
+
+    urlslug = listing_snapshot_slug(url)
+    fetch_state = load_fetch_state(cachedir=listingdir)
+
+    candidates = {}
+
+    for fname in os.listdir(listingdir):
+
+        if not (fname.endswith('-UT-arxiv.pkl') or
+                fname.endswith('.html') or
+                fname.endswith('.html.gz')):
+            continue
+
+        snapshot_match = SAVED_SNAPSHOT_REGEX.search(fname)
+
+        # a snapshot of some other listing
+        if (snapshot_match and
+            fname[:snapshot_match.start()] != '%s-' % urlslug):
+            continue
+
+        listingfile = os.path.join(listingdir, fname)
+        listing_dt = saved_listing_datetime(listingfile)
+
+        candidates.setdefault(listing_dt.date(), []).append(
+            (listing_dt, listingfile)
+        )
+
+    listings = []
+
+    for listing_date in sorted(candidates.keys()):
+
+        # use the most recent listing that's complete
+        for listing_dt, listingfile in sorted(candidates[listing_date],
+                                              reverse=True):
+
+            if (SAVED_SNAPSHOT_REGEX.search(listingfile) and
+                not saved_snapshot_complete(listingfile, fetch_state)):
+                print('skipping partial listing snapshot %s' % listingfile)
+                continue
+
+            listings.append((listing_date, listingfile))
+            break
+
+    return listings
+
+
+
+def load_saved_listing(listingfile,
+                       backend=PARSER_BACKEND,
+                       papers_only=False):
+    '''
+    This loads a saved listing into an arxiv dict like the one arxiv_update
+    returns. listingfile is either a pickle written by
+    arxiv_update(pickledict=True) or the raw HTML of a /new page (optionally
+    gzipped, like the snapshots in the listing cache).
+
+    Use papers_only=True for saved /pastweek pages.
+
+    '''
+
+    if listingfile.endswith('.pkl'):
+
+        import cPickle as pickle
+        with open(listingfile,'rb') as fd:
+            return pickle.load(fd)
+
+    if listingfile.endswith('.gz'):
+        html = read_listing_snapshot(listingfile)
+    else:
+        with open(listingfile,'rb') as fd:
+            html = fd.read().decode('utf-8')
+
+    paperdict, crosslistdict = PARSER_BACKENDS[backend][0](
+        html,
+        papers_only=papers_only
+    )
+
+    return {'utc':saved_listing_datetime(listingfile),
+            'npapers':len(paperdict.keys()),
+            'papers':paperdict,
+            'ncrosslists':len(crosslistdict.keys()),
+            'crosslists':crosslistdict}
@@ -7,21 +7,31 @@ This contains the URL handlers for the astroph-coffee web-server.
 '''
 
 import os.path
+import json
 import logging
 import base64
 import re
+import time
+import hashlib
+import email.utils
 
 LOGGER = logging.getLogger(__name__)
 
 from datetime import datetime, timedelta
 from pytz import utc, timezone
 
+import tornado.ioloop
 import tornado.web
+import tornado.websocket
 from tornado.escape import xhtml_escape, xhtml_unescape, url_unescape, squeeze
+from tornado.escape import utf8
+from tornado.util import ObjectDict
+from tornado.httputil import format_timestamp
 
 import arxivdb
 import webdb
 import fulltextsearch as fts
+import staticarchive
 
 import ipaddress
 
@@ -30,6 +40,10 @@ import ipaddress
 ######################
 
 ARCHIVEDATE_REGEX = re.compile(r'^(\d{4})(\d{2})(\d{2})$')
+ARXIVID_REGEX = re.compile(r'^[\w.:/-]+$')
+
+# the most abstracts AbstractHandler returns for a single request
+ABSTRACT_BATCH_LIMIT = 100
 MONTH_NAMES = {x:datetime(year=2014,month=x,day=12)
                for x in range(1,13)}
 
@@ -121,6 +135,159 @@ def group_arxiv_dates(dates, npapers, nlocal, nvoted):
 
 
 
+#######################
+## LISTING PAGE CACHE ##
+#######################
+
+# this caches the rendered /papers/today pages, keyed by (utcdate, mode,
+# astronomyonly). each page is rendered once per version of the listing it
+# shows (see arxivdb.get_listing_version). the per-request and per-user parts of
+# the page (the flash message, the time, the XSRF token, and the vote and
+# reserve buttons) are left in the cached page as markers, which are filled in
+# for each request by fill_listing_page.
+LISTING_PAGE_CACHE = {}
+
+PAGE_MARKER_REGEX = re.compile(r'@@coffee:(\w+)(?::([^@]*))?@@')
+
+USER_BUTTON_TEMPLATES = {'vote':'votebutton.html',
+                         'reserve':'reservebutton.html',
+                         'release':'releasebutton.html'}
+
+# the vote and reservation changes pushed to the voting pages by
+# LiveUpdatesHandler are collected for this many seconds and sent together
+LIVE_UPDATE_INTERVAL = 0.25
+
+
+def page_marker(name, arg=None):
+    '''
+    This returns the marker for a per-request part of a cached page.
+
+    '''
+
+    if arg is None:
+        return '@@coffee:%s@@' % name
+    else:
+        return '@@coffee:%s:%s@@' % (name, arg)
+
+
+
+def fill_listing_page(page,
+                      flash_message,
+                      local_today,
+                      xsrf_form_html,
+                      user_articles=None,
+                      user_reserved=None):
+    '''
+    This fills in the markers in a cached listing page for this request and
+    user, and returns the final HTML.
+
+    '''
+
+    user_articles = set(user_articles or [])
+    user_reserved = set(user_reserved or [])
+
+    def replace_marker(match):
+
+        name, arg = match.groups()
+
+        if name == 'flash_message':
+            return utf8(flash_message)
+        elif name == 'local_today':
+            return utf8(xhtml_escape(local_today))
+        elif name == 'xsrf':
+            return utf8(xsrf_form_html)
+        elif name == 'vote':
+            return page['buttons'][(name, arg)][arg in user_articles]
+        elif name in ('reserve', 'release'):
+            return page['buttons'][(name, arg)][arg in user_reserved]
+        else:
+            return match.group(0)
+
+    return PAGE_MARKER_REGEX.sub(replace_marker, page['html'])
+
+
+
+#####################
+## HTTP VALIDATORS ##
+#####################
+
+# this goes into every ETag. the listing versions in arxivdb start over in each
+# server process (which may also come with new templates), so the pages cached
+# by browsers before a restart must not match afterwards.
+ETAG_EPOCH = '%x' % int(time.time())
+
+
+def make_etag(*parts):
+    '''
+    This returns a strong ETag for a page that's fully determined by the given
+    parts (the data versions it shows, the user's votes, the flash message,
+    etc.).
+
+    '''
+
+    return '"%s"' % hashlib.sha1(repr((ETAG_EPOCH,) + parts)).hexdigest()
+
+
+
+def make_page_etag(handler, local_today, *parts):
+    '''
+    This returns the ETag for a page rendered by handler for this request.
+    Besides the given parts, these pages show the time (local_today, to the
+    minute) and have an XSRF token from the request's _xsrf cookie.
+
+    If there's no _xsrf cookie, handler.xsrf_token makes a new token and sets
+    the cookie to it, so the ETag can't match anything the browser has cached
+    and the page is rendered again with the new token. The browser sends the
+    same cookie back from then on, so its next revalidation matches.
+
+    '''
+
+    xsrf_cookie = handler.get_cookie('_xsrf')
+    if xsrf_cookie is None:
+        xsrf_cookie = handler.xsrf_token
+
+    return make_etag(xsrf_cookie, local_today, *parts)
+
+
+
+def check_not_modified(handler, etag, last_modified=None):
+    '''
+    This sets the ETag (and Last-Modified, if a UNIX time is given) headers for
+    the handler's response, and checks them against the request's
+    If-None-Match (or If-Modified-Since) header. If the client's copy of the
+    page is still current, this finishes the request with a 304 and returns
+    True, so the handler can skip rendering the page.
+
+    '''
+
+    handler.set_header('Etag', etag)
+    handler.set_header('Cache-Control', 'no-cache')
+    if last_modified is not None:
+        handler.set_header('Last-Modified', format_timestamp(last_modified))
+
+    # If-Modified-Since is ignored if there's an If-None-Match (RFC 7232)
+    if handler.request.headers.get('If-None-Match'):
+        not_modified = handler.check_etag_header()
+
+    elif (last_modified is not None and
+          handler.request.headers.get('If-Modified-Since')):
+        since = email.utils.parsedate_tz(
+            handler.request.headers['If-Modified-Since']
+        )
+        not_modified = (since is not None and
+                        email.utils.mktime_tz(since) >= int(last_modified))
+
+    else:
+        not_modified = False
+
+    if not_modified:
+        handler.set_status(304)
+        handler.finish()
+
+    return not_modified
+
+
+
 ##################
 ## URL HANDLERS ##
 ##################
@@ -531,206 +698,197 @@ class ArticleListHandler(tornado.web.RequestHandler):
 
         # if we are within the time limits, then show the voting page
         if (self.voting_start < timenow < self.voting_end):
+            mode = 'voting'
+        else:
+            mode = 'listing'
 
-            # get the articles for today
-            (local_articles, voted_articles,
-             other_articles, reserved_articles) = (
-                 arxivdb.get_articles_for_voting(database=self.database)
-            )
-
-            # if today's papers aren't ready yet, redirect to the papers display
-            if not local_articles and not voted_articles and not other_articles:
-
-                LOGGER.warning('no papers for today yet, '
-                               'redirecting to previous day papers')
-
-                (latestdate, local_articles,
-                 voted_articles, other_articles, reserved_articles) = (
-                     arxivdb.get_articles_for_listing(
-                         database=self.database
-                     )
-                )
-                todays_date = datetime.strptime(
-                    latestdate,
-                    '%Y-%m-%d'
-                ).strftime('%A, %b %d %Y')
-
-                # don't show a message on the weekend when no papers are loaded
-                if todays_utcdow in (5,6):
-                    flash_message = ""
-                else:
-                    flash_message = (
-                        "<div data-alert class=\"alert-box radius\">"
-                        "Papers for today haven't been imported yet. "
-                        "Here are the most recent papers. "
-                        "Please wait a few minutes and try again."
-                        "<a href=\"#\" class=\"close\">&times;</a></div>"
-                    )
-
-                # preprocess the local papers to highlight local author names
-                if len(local_articles) > 0:
-
-                    for lind in range(len(local_articles)):
-
-                        author_list = local_articles[lind][4]
-                        author_list = author_list.split(': ')[-1].split(',')
-
-                        local_indices = local_articles[lind][-2]
-
-                        if local_indices and len(local_indices) > 0:
-
-                            local_indices = [
-                                int(x) for x in local_indices.split(',')
-                            ]
-
-                            for li in local_indices:
-                                author_list[li] = '<strong>%s</strong>' % (
-                                    author_list[li]
-                                )
-
-                        # update this article's local authors
-                        local_articles[lind][4] = ', '.join(author_list)
-
-                # show the listing page
-                self.render("listing.html",
-                            user_name=user_name,
-                            local_today=local_today,
-                            todays_date=todays_date,
-                            local_articles=local_articles,
-                            voted_articles=voted_articles,
-                            other_articles=other_articles,
-                            reserved_articles=reserved_articles,
-                            flash_message=flash_message,
-                            reserve_interval_days=self.reserve_interval,
-                            new_user=new_user)
-
-            # if today's papers are ready, show them and ask for votes
-            else:
+        page = self.get_listing_page(mode, todays_utcdate, todays_utcdow)
 
-                # get this user's votes
-                user_articles = arxivdb.get_user_votes(todays_utcdate,
-                                                       user_name,
-                                                       database=self.database)
-                user_reserved = arxivdb.get_user_reservations(
-                    todays_utcdate,
-                    user_name,
-                    database=self.database
-                )
-                LOGGER.info('user has votes on: %s, has reservations on: %s'
-                            % (user_articles, user_reserved))
+        # if today's papers aren't ready yet, the page shows the latest papers
+        # and its own flash message
+        if page['flash_message'] is not None:
+            flash_message = page['flash_message']
 
-                # preprocess the local papers to highlight local author names
-                if len(local_articles) > 0:
+        # if today's papers are ready for voting, get this user's votes
+        if page['template'] == 'voting.html':
 
-                    for lind in range(len(local_articles)):
+            user_articles = arxivdb.get_user_votes(todays_utcdate,
+                                                   user_name,
+                                                   database=self.database)
+            user_reserved = arxivdb.get_user_reservations(
+                todays_utcdate,
+                user_name,
+                database=self.database
+            )
+            LOGGER.info('user has votes on: %s, has reservations on: %s'
+                        % (user_articles, user_reserved))
 
-                        author_list = local_articles[lind][4]
-                        author_list = author_list.split(': ')[-1].split(',')
+        else:
 
-                        local_indices = local_articles[lind][-2]
+            user_articles, user_reserved = None, None
+
+        # the page only changes with the listing's version and this user's
+        # votes and reservations, so if the browser has this version already,
+        # tell it so instead of filling in the page again
+        etag = make_page_etag(self,
+                              local_today,
+                              mode,
+                              page['listingdate'],
+                              page['version'],
+                              page['template'],
+                              flash_message,
+                              sorted(user_articles or []),
+                              sorted(user_reserved or []))
+        if check_not_modified(self, etag):
+            return
+
+        self.finish(fill_listing_page(page,
+                                      flash_message,
+                                      local_today,
+                                      self.xsrf_form_html(),
+                                      user_articles=user_articles,
+                                      user_reserved=user_reserved))
+
+
+
+    def get_listing_page(self,
+                         mode,
+                         todays_utcdate,
+                         todays_utcdow,
+                         astronomyonly=False):
+        '''
+        This returns the cached page for today's listing in mode ('voting' or
+        'listing'), rendering it again if the listing it shows has changed
+        since it was cached.
 
-                        if local_indices and len(local_indices) > 0:
+        '''
 
-                            local_indices = [
-                                int(x) for x in local_indices.split(',')
-                            ]
+        cachekey = (todays_utcdate, mode, astronomyonly)
+        page = LISTING_PAGE_CACHE.get(cachekey)
 
-                            for li in local_indices:
-                                author_list[li] = '<strong>%s</strong>' % (
-                                    author_list[li]
-                                )
+        if page and page['version'] == arxivdb.get_listing_version(
+                page['listingdate'],
+                self.database
+        ):
+            return page
 
-                        # update this article's local authors
-                        local_articles[lind][4] = ', '.join(author_list)
+        # get the data_version before the articles, so a commit by another
+        # process while we're rendering makes us render again next time
+        data_version = arxivdb.get_listing_version(todays_utcdate,
+                                                   self.database)[1]
 
-                # show the voting page
-                self.render("voting.html",
-                            user_name=user_name,
-                            local_today=local_today,
-                            todays_date=todays_date,
-                            local_articles=local_articles,
-                            voted_articles=voted_articles,
-                            other_articles=other_articles,
-                            reserved_articles=reserved_articles,
-                            flash_message=flash_message,
-                            new_user=new_user,
-                            reserve_interval_days=self.reserve_interval,
-                            user_articles=user_articles,
-                            user_reserved=user_reserved)
+        todays_date = datetime.now(tz=utc).strftime('%A, %b %d %Y')
+        page_flash_message = None
 
-        # otherwise, show the article list
+        # get the articles for today
+        if mode == 'voting':
+            (local_articles, voted_articles,
+             other_articles, reserved_articles) = (
+                 arxivdb.get_articles_for_voting(database=self.database,
+                                                 astronomyonly=astronomyonly)
+            )
         else:
-
-            # get the articles for today
             (latestdate, local_articles,
              voted_articles, other_articles, reserved_articles) = (
                  arxivdb.get_articles_for_listing(utcdate=todays_utcdate,
-                                                  database=self.database)
+                                                  database=self.database,
+                                                  astronomyonly=astronomyonly)
             )
 
-            # if today's papers aren't ready yet, show latest papers
-            if not local_articles and not voted_articles and not other_articles:
+        listingdate = todays_utcdate
 
-                (latestdate, local_articles,
-                 voted_articles, other_articles, reserved_articles) = (
-                     arxivdb.get_articles_for_listing(
-                         database=self.database
-                     )
-                )
-
-                todays_date = datetime.strptime(
-                    latestdate,
-                    '%Y-%m-%d'
-                ).strftime('%A, %b %d %Y')
-
-                # don't show a message on the weekend when no papers are loaded
-                if todays_utcdow in (5,6):
-                    flash_message = ""
-                else:
-                    flash_message = (
-                        "<div data-alert class=\"alert-box radius\">"
-                        "Papers for today haven't been imported yet. "
-                        "Here are the most recent papers. "
-                        "Please wait a few minutes and try again."
-                        "<a href=\"#\" class=\"close\">&times;</a></div>"
-                    )
+        # if today's papers aren't ready yet, show the latest papers
+        if not local_articles and not voted_articles and not other_articles:
 
-            # preprocess the local papers to highlight local author names
-            if len(local_articles) > 0:
+            LOGGER.warning('no papers for today yet, '
+                           'showing previous day papers')
 
-                for lind in range(len(local_articles)):
+            (latestdate, local_articles,
+             voted_articles, other_articles, reserved_articles) = (
+                 arxivdb.get_articles_for_listing(
+                     database=self.database,
+                     astronomyonly=astronomyonly
+                 )
+            )
+            listingdate = latestdate
+            todays_date = datetime.strptime(
+                latestdate,
+                '%Y-%m-%d'
+            ).strftime('%A, %b %d %Y')
+
+            # don't show a message on the weekend when no papers are loaded
+            if todays_utcdow in (5,6):
+                page_flash_message = ""
+            else:
+                page_flash_message = (
+                    "<div data-alert class=\"alert-box radius\">"
+                    "Papers for today haven't been imported yet. "
+                    "Here are the most recent papers. "
+                    "Please wait a few minutes and try again."
+                    "<a href=\"#\" class=\"close\">&times;</a></div>"
+                )
 
-                    author_list = local_articles[lind][4]
-                    author_list = author_list.split(': ')[-1].split(',')
+            template = 'listing.html'
 
-                    local_indices = local_articles[lind][-2]
+        elif mode == 'voting':
+            template = 'voting.html'
 
-                    if local_indices and len(local_indices) > 0:
+        else:
+            template = 'listing.html'
+
+        # the vote and reserve buttons are rendered for both states of each
+        # article here, so fill_listing_page can pick the right one per user
+        buttons = {}
+
+        def user_button(kind, article):
+
+            buttonkey = (kind, article[0])
+
+            if buttonkey not in buttons:
+                buttons[buttonkey] = {
+                    x:self.render_string(USER_BUTTON_TEMPLATES[kind],
+                                         article=article,
+                                         user_voted=x,
+                                         user_reserved=x)
+                    for x in (True, False)
+                }
+
+            return page_marker(kind, article[0])
+
+        html = self.render_string(
+            template,
+            user_name='',
+            local_today=page_marker('local_today'),
+            todays_date=todays_date,
+            local_articles=local_articles,
+            voted_articles=voted_articles,
+            other_articles=other_articles,
+            reserved_articles=reserved_articles,
+            flash_message=page_marker('flash_message'),
+            reserve_interval_days=self.reserve_interval,
+            new_user=False,
+            user_button=user_button,
+            _tt_modules=ObjectDict(
+                xsrf_form_html=lambda: page_marker('xsrf')
+            )
+        )
 
-                        local_indices = [
-                            int(x) for x in local_indices.split(',')
-                        ]
+        page = {'version':(arxivdb.LISTING_VERSIONS.get(listingdate, 0),
+                           data_version),
+                'listingdate':listingdate,
+                'template':template,
+                'flash_message':page_flash_message,
+                'html':html,
+                'buttons':buttons}
 
-                        for li in local_indices:
-                            author_list[li] = '<strong>%s</strong>' % (
-                                author_list[li]
-                            )
+        # drop the pages for earlier days
+        for key in list(LISTING_PAGE_CACHE.keys()):
+            if key[0] != todays_utcdate:
+                del LISTING_PAGE_CACHE[key]
 
-                    # update this article's local authors
-                    local_articles[lind][4] = ', '.join(author_list)
+        LISTING_PAGE_CACHE[cachekey] = page
 
-            # show the listing page
-            self.render("listing.html",
-                        user_name=user_name,
-                        local_today=local_today,
-                        todays_date=todays_date,
-                        local_articles=local_articles,
-                        voted_articles=voted_articles,
-                        other_articles=other_articles,
-                        reserved_articles=reserved_articles,
-                        reserve_interval_days=self.reserve_interval,
-                        flash_message=flash_message,
-                        new_user=new_user)
+        return page
 
 
 
@@ -748,9 +906,11 @@ class ReservationHandler(tornado.web.RequestHandler):
                    signer,
                    geofence,
                    countries,
-                   regions):
+                   regions,
+                   journal=None):
         '''
-        Sets up the database.
+        Sets up the database. If journal is a votejournal.VoteJournal, the
+        requests are recorded through it.
 
         '''
 
@@ -766,6 +926,7 @@ class ReservationHandler(tornado.web.RequestHandler):
 
         self.countries = countries
         self.regions = regions
+        self.journal = journal
 
 
     def post(self):
@@ -894,86 +1055,95 @@ class ReservationHandler(tornado.web.RequestHandler):
 
             else:
 
-                # first, check how many reservations this user has
-                user_reservations = arxivdb.get_user_reservations(
-                    todays_utcdate,
-                    user_name,
-                    database=self.database
-                )
-
-                # make sure it's less than 5 or we're not adding another
-                # reservation
-                if len(user_reservations) < 5 or reservetype != 'reserve':
-
-                    reserve_outcome = arxivdb.record_reservation(
+                # the user's reservation count is checked against the limit of
+                # 5 in the same transaction that records the reservation
+                if self.journal is not None:
+                    reserve_status, reserve_outcome = (
+                        self.journal.cast_reservation(
+                            arxivid,
+                            user_name,
+                            reservetype,
+                            utcdate=todays_utcdate,
+                            max_reservations=5
+                        )
+                    )
+                else:
+                    reserve_status, reserve_outcome = arxivdb.cast_reservation(
                         arxivid,
                         user_name,
                         reservetype,
+                        utcdate=todays_utcdate,
+                        max_reservations=5,
                         database=self.database
                     )
 
-                    if reserve_outcome is False or None:
+                if reserve_status == 'quota':
 
-                        message = ("That article doesn't exist, "
-                                   "and your reservation "
-                                   "has been discarded.")
+                    message = ("You've reserved 5 articles already.")
 
-                        jsondict = {'status':'failed',
-                                    'message':message,
-                                    'results':None}
-                        self.write(jsondict)
-                        self.finish()
+                    jsondict = {'status':'failed',
+                                'message':message,
+                                'results':None}
+                    self.write(jsondict)
+                    self.finish()
 
-                    else:
+                elif reserve_status != 'ok':
 
-                        if (reserve_outcome[0] == 1 and
-                            reserve_outcome[1] == user_name):
+                    message = ("That article doesn't exist, "
+                               "and your reservation "
+                               "has been discarded.")
+
+                    jsondict = {'status':'failed',
+                                'message':message,
+                                'results':None}
+                    self.write(jsondict)
+                    self.finish()
 
-                            message = ("Reservation successfully recorded for %s"
-                                       % arxivid)
+                else:
 
-                            jsondict = {'status':'success',
-                                        'message':message,
-                                        'results':{'reserved':reserve_outcome[0]}}
+                    LiveUpdatesHandler.queue_update(
+                        arxivid,
+                        reserved=reserve_outcome[0]
+                    )
 
-                        elif (reserve_outcome[0] == 1 and
-                              reserve_outcome[1] != user_name):
+                    if (reserve_outcome[0] == 1 and
+                        reserve_outcome[1] == user_name):
 
-                            message = ("Someeone else already reserved that paper!")
+                        message = ("Reservation successfully recorded for %s"
+                                   % arxivid)
 
-                            jsondict = {'status':'failed',
-                                        'message':message,
-                                        'results':{'reserved':reserve_outcome[0]}}
+                        jsondict = {'status':'success',
+                                    'message':message,
+                                    'results':{'reserved':reserve_outcome[0]}}
 
-                        elif (reserve_outcome[0] == 0):
+                    elif (reserve_outcome[0] == 1 and
+                          reserve_outcome[1] != user_name):
 
-                            message = ("Release successfully recorded for %s"
-                                       % arxivid)
+                        message = ("Someeone else already reserved that paper!")
 
-                            jsondict = {'status':'success',
-                                        'message':message,
-                                        'results':{'reserved':reserve_outcome[0]}}
+                        jsondict = {'status':'failed',
+                                    'message':message,
+                                    'results':{'reserved':reserve_outcome[0]}}
 
-                        else:
+                    elif (reserve_outcome[0] == 0):
 
-                            message = ("That article doesn't exist, "
-                                       "or your reservation "
-                                       "has been discarded because of a problem.")
+                        message = ("Release successfully recorded for %s"
+                                   % arxivid)
 
-                            jsondict = {'status':'failed',
-                                        'message':message,
-                                        'results':None}
+                        jsondict = {'status':'success',
+                                    'message':message,
+                                    'results':{'reserved':reserve_outcome[0]}}
 
-                        self.write(jsondict)
-                        self.finish()
+                    else:
 
-                else:
+                        message = ("That article doesn't exist, "
+                                   "or your reservation "
+                                   "has been discarded because of a problem.")
 
-                    message = ("You've reserved 5 articles already.")
+                        jsondict = {'status':'failed',
+                                    'message':message,
+                                    'results':None}
 
-                    jsondict = {'status':'failed',
-                                'message':message,
-                                'results':None}
                     self.write(jsondict)
                     self.finish()
 
@@ -1016,9 +1186,11 @@ class VotingHandler(tornado.web.RequestHandler):
                    signer,
                    geofence,
                    countries,
-                   regions):
+                   regions,
+                   journal=None):
         '''
-        Sets up the database.
+        Sets up the database. If journal is a votejournal.VoteJournal, the
+        requests are recorded through it.
 
         '''
 
@@ -1034,6 +1206,7 @@ class VotingHandler(tornado.web.RequestHandler):
 
         self.countries = countries
         self.regions = regions
+        self.journal = journal
 
 
     def post(self):
@@ -1054,7 +1227,7 @@ class VotingHandler(tornado.web.RequestHandler):
 
         if vote is allowed:
         - changes the nvote column for arxivid
-        - adds the current user to the voters column
+        - adds a row for the current user to the votes table
         - returns the nvotes for the arxivid along with
           success/failure
 
@@ -1195,39 +1368,49 @@ class VotingHandler(tornado.web.RequestHandler):
 
             else:
 
-                # first, check how many votes this user has
-                user_votes = arxivdb.get_user_votes(todays_utcdate,
-                                                    user_name,
-                                                    database=self.database)
-
-                # make sure it's less than 5 or the votetype isn't up
-                if len(user_votes) < 5 or votetype != 'up':
+                # the user's vote count is checked against the limit of 5 in
+                # the same transaction that records the vote
+                if self.journal is not None:
+                    vote_status, vote_outcome = self.journal.cast_vote(
+                        arxivid,
+                        user_name,
+                        votetype,
+                        utcdate=todays_utcdate,
+                        max_votes=5
+                    )
+                else:
+                    vote_status, vote_outcome = arxivdb.cast_vote(
+                        arxivid,
+                        user_name,
+                        votetype,
+                        utcdate=todays_utcdate,
+                        max_votes=5,
+                        database=self.database
+                    )
 
-                    vote_outcome = arxivdb.record_vote(arxivid,
-                                                       user_name,
-                                                       votetype,
-                                                       database=self.database)
+                if vote_status == 'missing':
 
-                    if vote_outcome is False:
+                    message = ("That article doesn't exist, and your vote "
+                               "has been discarded.")
 
-                        message = ("That article doesn't exist, and your vote "
-                                   "has been discarded.")
+                    jsondict = {'status':'failed',
+                                'message':message,
+                                'results':None}
+                    self.write(jsondict)
+                    self.finish()
 
-                        jsondict = {'status':'failed',
-                                    'message':message,
-                                    'results':None}
-                        self.write(jsondict)
-                        self.finish()
+                elif vote_status == 'ok':
 
-                    else:
+                    LiveUpdatesHandler.queue_update(arxivid,
+                                                    nvotes=vote_outcome)
 
-                        message = ("Vote successfully recorded for %s" % arxivid)
+                    message = ("Vote successfully recorded for %s" % arxivid)
 
-                        jsondict = {'status':'success',
-                                    'message':message,
-                                    'results':{'nvotes':vote_outcome}}
-                        self.write(jsondict)
-                        self.finish()
+                    jsondict = {'status':'success',
+                                'message':message,
+                                'results':{'nvotes':vote_outcome}}
+                    self.write(jsondict)
+                    self.finish()
 
                 else:
 
@@ -1263,6 +1446,98 @@ class VotingHandler(tornado.web.RequestHandler):
             self.finish()
 
 
+
+class LiveUpdatesHandler(tornado.websocket.WebSocketHandler):
+    '''
+    This pushes vote counts and reservation changes to the open voting pages
+    over a WebSocket, so people don't have to reload the page to see them.
+
+    Each message is a JSON list of {'arxiv_id', 'nvotes', 'reserved'} dicts,
+    one per paper that changed in the last LIVE_UPDATE_INTERVAL seconds. A
+    paper's dict only has the keys that changed. Nothing about who voted or
+    reserved is sent.
+
+    '''
+
+    # the open connections
+    clients = set()
+
+    # the changes waiting for the next push, keyed by arxivid
+    pending = {}
+    push_timeout = None
+
+
+    @classmethod
+    def queue_update(cls, arxivid, **changes):
+        '''
+        This queues the changes to a paper (nvotes=..., reserved=...) for the
+        next push.
+
+        '''
+
+        if not cls.clients:
+            return
+
+        update = cls.pending.setdefault(arxivid, {'arxiv_id':arxivid})
+        update.update(changes)
+
+        if cls.push_timeout is None:
+            cls.push_timeout = tornado.ioloop.IOLoop.current().call_later(
+                LIVE_UPDATE_INTERVAL,
+                cls.push_updates
+            )
+
+
+    @classmethod
+    def push_updates(cls):
+        '''
+        This sends the queued changes to all open connections.
+
+        '''
+
+        cls.push_timeout = None
+
+        if not cls.pending:
+            return
+
+        message = json.dumps(cls.pending.values())
+        cls.pending.clear()
+
+        for client in list(cls.clients):
+            try:
+                client.write_message(message)
+            except tornado.websocket.WebSocketClosedError:
+                cls.clients.discard(client)
+
+
+    def open(self):
+        '''
+        This adds a new connection.
+
+        '''
+
+        LiveUpdatesHandler.clients.add(self)
+
+
+    def on_message(self, message):
+        '''
+        Clients don't send anything, so this ignores any messages.
+
+        '''
+
+        pass
+
+
+    def on_close(self):
+        '''
+        This drops a closed connection.
+
+        '''
+
+        LiveUpdatesHandler.clients.discard(self)
+
+
+
 class EditHandler(tornado.web.RequestHandler):
     '''This handles all requests for the editing function.
 
@@ -1391,6 +1666,70 @@ class EditHandler(tornado.web.RequestHandler):
 
 
 
+class AbstractHandler(tornado.web.RequestHandler):
+    '''
+    This handles requests for paper abstracts. The listing pages don't include
+    the abstracts of the other articles, and load them from here in batches
+    when they're expanded or scrolled into view.
+
+    url: /astroph-coffee/abstract?ids=arxivid1,arxivid2,...
+
+    '''
+
+    def initialize(self, database):
+        '''
+        This sets up the database.
+
+        '''
+
+        self.database = database
+
+
+    def get(self):
+        '''
+        This handles GET requests.
+
+        '''
+
+        arxivids = self.get_argument('ids', '')
+        arxivids = [x.strip() for x in arxivids.split(',') if x.strip()]
+        arxivids = [x for x in arxivids if ARXIVID_REGEX.match(x)]
+
+        if not arxivids or len(arxivids) > ABSTRACT_BATCH_LIMIT:
+
+            self.set_status(400)
+            message = ("Ask for between 1 and %s abstracts at a time." %
+                       ABSTRACT_BATCH_LIMIT)
+            jsondict = {'status':'failed',
+                        'message':message,
+                        'results':None}
+            self.write(jsondict)
+            self.finish()
+            return
+
+        try:
+
+            abstracts = arxivdb.get_article_abstracts(arxivids,
+                                                      database=self.database)
+            jsondict = {'status':'success',
+                        'message':'found %s abstracts' % len(abstracts),
+                        'results':abstracts}
+
+        except Exception as e:
+
+            LOGGER.exception('could not get abstracts for %s' % arxivids)
+            self.set_status(500)
+            jsondict = {'status':'failed',
+                        'message':'There was a database error.',
+                        'results':None}
+
+        # tornado adds an ETag computed from the body, so repeated requests
+        # for the same batch get a 304
+        self.write(jsondict)
+        self.finish()
+
+
+
 class AboutHandler(tornado.web.RequestHandler):
 
     '''
@@ -1727,6 +2066,58 @@ class ArchiveHandler(tornado.web.RequestHandler):
                 year, month, day = archivedate.groups()
                 listingdate = '%s-%s-%s' % (year, month, day)
 
+                # if this day is frozen and has been pre-rendered, serve that
+                # instead (unless there's a flash message to show)
+                if not flash_message:
+                    static_page = staticarchive.get_static_page(
+                        listingdate,
+                        self.database
+                    )
+                else:
+                    static_page = None
+
+                if static_page:
+
+                    accept_encoding = self.request.headers.get(
+                        'Accept-Encoding', ''
+                    )
+                    if ('gzip' in accept_encoding and
+                        os.path.exists('%s.gz' % static_page)):
+                        static_page = '%s.gz' % static_page
+                        self.set_header('Content-Encoding', 'gzip')
+
+                    self.set_header('Vary', 'Accept-Encoding')
+
+                    # these pages only change when they're rendered again, so
+                    # the file's mtime is when this page last changed. the
+                    # gzipped copy is a different representation and gets its
+                    # own ETag.
+                    page_mtime = os.path.getmtime(static_page)
+                    etag = make_etag(static_page, page_mtime)
+                    if check_not_modified(self, etag,
+                                          last_modified=page_mtime):
+                        return
+
+                    self.set_header('Content-Type', 'text/html; charset=UTF-8')
+
+                    with open(static_page, 'rb') as infd:
+                        self.write(infd.read())
+
+                    self.finish()
+                    return
+
+                # otherwise, the page can only change with the listing's version
+                etag = make_page_etag(
+                    self,
+                    local_today,
+                    'archive',
+                    listingdate,
+                    arxivdb.get_listing_version(listingdate, self.database),
+                    flash_message
+                )
+                if check_not_modified(self, etag):
+                    return
+
                 # get the articles for today
                 (latestdate, local_articles,
                  voted_articles, other_articles, reserved_articles) = (
@@ -1776,31 +2167,6 @@ class ArchiveHandler(tornado.web.RequestHandler):
                         tzinfo=utc
                         ).strftime('%A, %b %d %Y')
 
-
-                    # preprocess the local papers to highlight local author names
-                    if len(local_articles) > 0:
-
-                        for lind in range(len(local_articles)):
-
-                            author_list = local_articles[lind][4]
-                            author_list = author_list.split(': ')[-1].split(',')
-
-                            local_indices = local_articles[lind][-2]
-
-                            if local_indices and len(local_indices) > 0:
-
-                                local_indices = [
-                                    int(x) for x in local_indices.split(',')
-                                ]
-
-                                for li in local_indices:
-                                    author_list[li] = '<strong>%s</strong>' % (
-                                        author_list[li]
-                                    )
-
-                            # update this article's local authors
-                            local_articles[lind][4] = ', '.join(author_list)
-
                     # show the listing page
                     self.render("archivelisting.html",
                                 user_name=user_name,
@@ -1816,6 +2182,16 @@ class ArchiveHandler(tornado.web.RequestHandler):
 
             else:
 
+                etag = make_page_etag(
+                    self,
+                    local_today,
+                    'archive-index',
+                    arxivdb.get_archive_version(self.database),
+                    flash_message
+                )
+                if check_not_modified(self, etag):
+                    return
+
                 (archive_dates, archive_npapers,
                  archive_nlocal, archive_nvoted) = arxivdb.get_archive_index(
                      database=self.database
@@ -1834,6 +2210,14 @@ class ArchiveHandler(tornado.web.RequestHandler):
 
         else:
 
+            etag = make_page_etag(self,
+                                  local_today,
+                                  'archive-index',
+                                  arxivdb.get_archive_version(self.database),
+                                  flash_message)
+            if check_not_modified(self, etag):
+                return
+
             (archive_dates, archive_npapers,
              archive_nlocal, archive_nvoted) = arxivdb.get_archive_index(
                  database=self.database
@@ -2217,6 +2601,12 @@ class FTSHandler(tornado.web.RequestHandler):
         ## CONTENT RENDERING ##
         #######################
 
+        # the search form only changes with the flash message. the results are
+        # POSTed, so they can't be validated this way.
+        etag = make_page_etag(self, local_today, 'search', flash_message)
+        if check_not_modified(self, etag):
+            return
+
         self.render("search.html",
                     user_name=user_name,
                     local_today=local_today,
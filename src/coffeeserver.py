@@ -63,6 +63,7 @@ from tornado.options import define, options
 ####################################
 
 import coffeehandlers
+import votejournal
 
 
 ###############################
@@ -133,6 +134,16 @@ if __name__ == '__main__':
         detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES
     )
 
+    # votes and reservations are queued in this journal and written to the
+    # database in group commits
+    VOTE_JOURNAL = votejournal.VoteJournal(
+        DATABASE,
+        CONF.get('sqlite3','vote_journal'),
+        flush_interval=float(CONF.get('sqlite3','vote_flush_interval_ms')),
+        flush_ops=int(CONF.get('sqlite3','vote_flush_ops'))
+    )
+    VOTE_JOURNAL.replay()
+
     # get the times of day (UTC) to switch between voting and list mode
     VOTING_START = CONF.get('times','voting_start')
     VOTING_END = CONF.get('times','voting_end')
@@ -260,7 +271,8 @@ if __name__ == '__main__':
           'signer':FLASHSIGNER,
           'geofence': (GEOFENCE_DB, GEOFENCE_IPS, EDITOR_IPS),
           'countries':GEOFENCE_COUNTRIES,
-          'regions':GEOFENCE_REGIONS}),
+          'regions':GEOFENCE_REGIONS,
+          'journal':VOTE_JOURNAL}),
         (r'/astroph-coffee/reserve',coffeehandlers.ReservationHandler,
          {'database':DATABASE,
           'voting_start':VOTING_START,
@@ -269,7 +281,9 @@ if __name__ == '__main__':
           'signer':FLASHSIGNER,
           'geofence': (GEOFENCE_DB, GEOFENCE_IPS, EDITOR_IPS),
           'countries':GEOFENCE_COUNTRIES,
-          'regions':GEOFENCE_REGIONS}),
+          'regions':GEOFENCE_REGIONS,
+          'journal':VOTE_JOURNAL}),
+        (r'/astroph-coffee/live',coffeehandlers.LiveUpdatesHandler),
         (r'/astroph-coffee/edit',coffeehandlers.EditHandler,
          {'database':DATABASE,
           'voting_start':VOTING_START,
@@ -288,6 +302,8 @@ if __name__ == '__main__':
           'geofence': (GEOFENCE_DB, GEOFENCE_IPS, EDITOR_IPS),
           'countries':GEOFENCE_COUNTRIES,
           'regions':GEOFENCE_REGIONS}),
+        (r'/astroph-coffee/abstract',coffeehandlers.AbstractHandler,
+         {'database':DATABASE}),
         (r'/astroph-coffee/about',coffeehandlers.AboutHandler,
          {'database':DATABASE}),
         (r'/astroph-coffee/about/',coffeehandlers.AboutHandler,
@@ -312,6 +328,8 @@ if __name__ == '__main__':
         static_url_prefix='/astroph-coffee/static/',
         xsrf_cookies=True,
         debug=DEBUG,
+        # keeps the live update connections open through the proxy
+        websocket_ping_interval=30,
     )
 
     # start up the HTTP server and our application. xheaders = True turns on
@@ -328,6 +346,7 @@ if __name__ == '__main__':
     except KeyboardInterrupt:
         LOGGER.info('shutting down...')
 
+        VOTE_JOURNAL.close()
         DATABASE.close()
         if GEOFENCE_DB:
             GEOFENCE_DB.close()
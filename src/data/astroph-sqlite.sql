@@ -24,11 +24,116 @@ create table arxiv (
        reserved integer default 0,
        local_author_indices text,
        local_author_specaffils text,
+       content_hash text,
+       author_html text,
        primary key(utcdate, day_serial, article_type, arxiv_id)
 );
 
 create index arxiv_idx on arxiv(arxiv_id);
 
+-- this covers the group by utcdate in the archive index and the local, voted,
+-- and reserved filters on each day's listing
+create index arxiv_archive_idx on arxiv(utcdate, local_authors, nvotes, reserved);
+
+-- one row per vote. the votes_* triggers below keep arxiv.nvotes equal to the
+-- number of rows for each paper. the arxiv.voters column is no longer used.
+create table votes (
+       arxiv_id text,
+       utcdate date,
+       user_id text,
+       primary key (arxiv_id, utcdate, user_id)
+);
+
+-- this covers each user's votes for a day (the vote quota and the voted
+-- markers on the listing pages)
+create index votes_user_idx on votes(utcdate, user_id);
+
+-- one row per reserved paper and listing date. the primary key allows one
+-- reserver per paper. arxiv.reserved and arxiv.reservers are set along with
+-- it for the listings. rows older than the reservation window are purged by
+-- arxivdb.purge_expired_reservations.
+create table reservations (
+       arxiv_id text,
+       utcdate date,
+       user_id text,
+       reserved_utc double precision,
+       primary key (arxiv_id, utcdate)
+);
+
+-- this covers each user's reservations in the reservation window (the
+-- reservation cap and the reserved markers on the listing pages)
+create index reservations_user_idx on reservations(user_id, utcdate);
+
+-- the sequence number of the last operation from each write-behind vote
+-- journal file that was written to the database (see votejournal.py)
+create table vote_journal (
+       journal_path text,
+       last_seq integer,
+       primary key (journal_path)
+);
+
+-- this caches the local author match decisions for each normalized paper
+-- author. roster_hash is a hash of the local author roster and the match
+-- thresholds, so decisions for an old roster are never used.
+create table author_match_cache (
+       roster_hash text,
+       paper_author text,
+       paper_fname text,
+       matched_fname text,
+       fname_score integer,
+       matched_author text,
+       fullname_score integer,
+       primary key (roster_hash, paper_author, paper_fname)
+);
+
+-- this holds the normalized author lists of the papers, so the local authors
+-- can be re-tagged across the archive when the local author roster changes
+create table paper_authors (
+       utcdate date,
+       arxiv_id text,
+       author_index integer,
+       paper_author text,
+       paper_fname text,
+       primary key (utcdate, arxiv_id, author_index)
+);
+
+create index paper_authors_author_idx on paper_authors(paper_author);
+create index paper_authors_fname_idx on paper_authors(paper_fname);
+
+-- this records the wall time, row count, and status of each stage of each
+-- nightly ingest run (see arxivingest.py)
+create table ingest_runs (
+       run_id integer,
+       stage text,
+       started_utc double precision,
+       wall_time double precision,
+       nrows integer,
+       status text,
+       error text,
+       artifact text,
+       primary key (run_id, stage)
+);
+
+-- this holds the per-day paper, local paper, and voted paper counts for the
+-- archive index. it's kept current by the summary_* triggers below.
+create table daily_summary (
+       utcdate date,
+       npapers integer,
+       nlocal integer,
+       nvoted integer,
+       primary key (utcdate)
+);
+
+-- this records which archive days have pre-rendered pages on disk (see
+-- staticarchive.py). the static_* triggers below mark a day stale when any of
+-- its rows change, so its page is re-rendered.
+create table static_pages (
+       utcdate date,
+       rendered_utc double precision,
+       stale integer default 0,
+       primary key (utcdate)
+);
+
 create table users (
        useremail text,
        registered boolean,
@@ -91,8 +196,78 @@ create trigger fts_after_insert after insert on arxiv begin
                       new.nvotes);
 end;
 
+-- these keep the daily_summary table in step with the arxiv table. updates only
+-- touch the summary if one of the columns it counts changes.
+create trigger summary_after_insert after insert on arxiv begin
+       insert or ignore into daily_summary (utcdate, npapers, nlocal, nvoted)
+              values (new.utcdate, 0, 0, 0);
+       update daily_summary set
+              npapers = npapers + 1,
+              nlocal = nlocal +
+                       (case when new.local_authors = 1 then 1 else 0 end),
+              nvoted = nvoted + (case when new.nvotes > 0 then 1 else 0 end)
+              where utcdate = new.utcdate;
+end;
+
+create trigger summary_after_delete after delete on arxiv begin
+       update daily_summary set
+              npapers = npapers - 1,
+              nlocal = nlocal -
+                       (case when old.local_authors = 1 then 1 else 0 end),
+              nvoted = nvoted - (case when old.nvotes > 0 then 1 else 0 end)
+              where utcdate = old.utcdate;
+       delete from daily_summary where utcdate = old.utcdate and npapers <= 0;
+end;
+
+create trigger summary_after_update
+       after update of utcdate, local_authors, nvotes on arxiv begin
+       update daily_summary set
+              npapers = npapers - 1,
+              nlocal = nlocal -
+                       (case when old.local_authors = 1 then 1 else 0 end),
+              nvoted = nvoted - (case when old.nvotes > 0 then 1 else 0 end)
+              where utcdate = old.utcdate;
+       insert or ignore into daily_summary (utcdate, npapers, nlocal, nvoted)
+              values (new.utcdate, 0, 0, 0);
+       update daily_summary set
+              npapers = npapers + 1,
+              nlocal = nlocal +
+                       (case when new.local_authors = 1 then 1 else 0 end),
+              nvoted = nvoted + (case when new.nvotes > 0 then 1 else 0 end)
+              where utcdate = new.utcdate;
+       delete from daily_summary where utcdate = old.utcdate and npapers <= 0;
+end;
+
+-- these mark the pre-rendered archive pages for changed days stale
+create trigger static_after_insert after insert on arxiv begin
+       update static_pages set stale = 1 where utcdate = new.utcdate;
+end;
+
+create trigger static_after_delete after delete on arxiv begin
+       update static_pages set stale = 1 where utcdate = old.utcdate;
+end;
+
+create trigger static_after_update after update on arxiv begin
+       update static_pages set stale = 1 where utcdate = old.utcdate;
+       update static_pages set stale = 1 where utcdate = new.utcdate;
+end;
+
+-- these keep arxiv.nvotes current as votes are cast and withdrawn
+create trigger votes_after_insert after insert on votes begin
+       update arxiv set nvotes = nvotes + 1
+              where utcdate = new.utcdate and arxiv_id = new.arxiv_id;
+end;
+
+create trigger votes_after_delete after delete on votes begin
+       update arxiv set nvotes = nvotes - 1
+              where utcdate = old.utcdate and arxiv_id = old.arxiv_id;
+end;
 
 
 -- SQLite specific settings
 pragma journal_mode = wal;
 pragma journal_size_limit = 52428800;
+
+-- the schema version of this file. older databases are migrated up to this
+-- version with dbschema.migrate_database()
+pragma user_version = 8;
@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+
+'''
+dbschema - Waqas Bhatti (wbhatti@astro.princeton.edu) - Nov 2017
+
+Contains the versioned schema migrations for the astroph-coffee database and an
+index advisor that runs EXPLAIN QUERY PLAN on the queries issued by the
+arxivdb, webdb, and fulltextsearch modules.
+
+The schema version of a database is kept in PRAGMA user_version. New databases
+created from data/astroph-sqlite.sql start at SCHEMA_VERSION. Older databases
+are brought up to date with migrate_database(), which applies each migration
+newer than the database's user_version in order.
+
+'''
+
+from datetime import datetime
+
+from pytz import utc
+
+# local imports
+import arxivdb
+import arxivingest
+import webdb
+import fulltextsearch
+import staticarchive
+
+
+## SCHEMA MIGRATIONS
+
+def _migrate_pipeline_tables(database):
+    '''
+    This adds the columns and tables used by the ingest pipeline to databases
+    created before them.
+
+    '''
+
+    arxivdb.ensure_content_hash_column(database)
+    arxivdb.ensure_author_match_cache_table(database)
+    arxivdb.ensure_paper_authors_table(database)
+    arxivingest.ensure_ingest_runs_table(database)
+
+
+
+def _migrate_daily_summary(database):
+    '''
+    This adds the daily_summary table and its triggers and fills it in from the
+    arxiv table.
+
+    '''
+
+    arxivdb.ensure_daily_summary_table(database)
+    arxivdb.rebuild_daily_summary(database=database)
+
+
+
+def _migrate_votes_table(database):
+    '''
+    This adds the votes table and its triggers, moves the votes from the old
+    voters column into it, and recounts nvotes from it.
+
+    '''
+
+    arxivdb.ensure_votes_table(database)
+    arxivdb.rebuild_vote_counts(database=database)
+
+
+# each migration is (version, description, steps). a step is either an SQL
+# statement or a function that takes the database connection. all steps must be
+# safe to run again on a database that already has them, since SQLite commits
+# implicitly before DDL statements and a migration may be interrupted halfway.
+SCHEMA_MIGRATIONS = [
+    (1,
+     'content_hash column, author match cache, paper authors, ingest runs',
+     [_migrate_pipeline_tables]),
+    (2,
+     'covering index for the archive index and local/voted/reserved filters',
+     ['create index if not exists arxiv_archive_idx '
+      'on arxiv(utcdate, local_authors, nvotes, reserved)']),
+    (3,
+     'daily_summary table and triggers for the archive index',
+     [_migrate_daily_summary]),
+    (4,
+     'static_pages table and triggers for the pre-rendered archive',
+     [staticarchive.ensure_static_pages_table]),
+    (5,
+     'author_html column with the pre-rendered local author lists',
+     [arxivdb.ensure_author_html_column]),
+    (6,
+     'votes table replacing the comma-separated voters column',
+     [_migrate_votes_table]),
+    (7,
+     'reservations table replacing the reservers column lookups',
+     [arxivdb.ensure_reservations_table]),
+    (8,
+     'vote_journal table for the write-behind vote journal',
+     [arxivdb.ensure_vote_journal_table]),
+]
+
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+
+
+def get_schema_version(database):
+    '''
+    This returns the schema version (PRAGMA user_version) of the database.
+
+    '''
+
+    cursor = database.cursor()
+    cursor.execute('pragma user_version')
+    version = cursor.fetchone()[0]
+    cursor.close()
+
+    return version
+
+
+
+def migrate_database(database=None, verbose=True):
+    '''
+    This applies all migrations newer than the database's schema version and
+    returns the new schema version.
+
+    '''
+
+    # open the database if needed and get a cursor
+    if not database:
+        database, cursor = arxivdb.opendb()
+        closedb = True
+    else:
+        cursor = database.cursor()
+        closedb = False
+
+    version = get_schema_version(database)
+
+    for migration_version, description, steps in SCHEMA_MIGRATIONS:
+
+        if migration_version <= version:
+            continue
+
+        if verbose:
+            print('migrating database to schema version %s: %s' %
+                  (migration_version, description))
+
+        for step in steps:
+            if callable(step):
+                step(database)
+            else:
+                cursor.execute(step)
+
+        # pragmas can't take parameters, but migration_version is always an int
+        cursor.execute('pragma user_version = %d' % migration_version)
+        database.commit()
+        version = migration_version
+
+    # at the end, close the cursor and DB connection
+    if closedb:
+        cursor.close()
+        database.close()
+
+    return version
+
+
+
+## INDEX ADVISOR
+
+class RecordingCursor(object):
+    '''
+    This wraps a DB cursor and records every query executed through it.
+
+    '''
+
+    def __init__(self, cursor, queries):
+        self.cursor = cursor
+        self.queries = queries
+
+
+    def execute(self, query, params=()):
+        # the functions' own transactions are left out, since beginning one
+        # would commit the writes of the functions run before them
+        if query.lower().startswith('begin'):
+            return self
+        self.queries.append((query, tuple(params)))
+        return self.cursor.execute(query, params)
+
+
+    def executemany(self, query, paramlist):
+        paramlist = list(paramlist)
+        if paramlist:
+            self.queries.append((query, tuple(paramlist[0])))
+        return self.cursor.executemany(query, paramlist)
+
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+
+class RecordingDatabase(object):
+    '''
+    This wraps a DB connection so the queries issued by the module functions
+    can be collected. Begins, commits, and closes are ignored, so everything
+    the functions write can be rolled back afterwards.
+
+    '''
+
+    def __init__(self, database):
+        self.database = database
+        self.queries = []
+
+
+    def cursor(self):
+        return RecordingCursor(self.database.cursor(), self.queries)
+
+
+    def commit(self):
+        pass
+
+
+    def close(self):
+        pass
+
+
+    def __getattr__(self, attr):
+        return getattr(self.database, attr)
+
+
+
+def collect_queries(database):
+    '''
+    This runs the arxivdb, webdb, and fulltextsearch functions used by the
+    server against the database, and returns the distinct (query, params)
+    pairs they issue. All writes are rolled back.
+
+    '''
+
+    cursor = database.cursor()
+    cursor.execute('select utcdate, arxiv_id from arxiv '
+                   'order by utcdate desc limit 1')
+    row = cursor.fetchone()
+    cursor.close()
+
+    if row:
+        utcdate, arxivid = row[0].strftime('%Y-%m-%d'), row[1]
+    else:
+        utcdate = datetime.now(tz=utc).strftime('%Y-%m-%d')
+        arxivid = '0000.00000'
+
+    username = 'index-advisor'
+    ftscolumns = ['arxiv_id','day_serial','title','authors','utcdate','nvotes']
+
+    recorder = RecordingDatabase(database)
+
+    calls = [
+        (arxivdb.get_articles_for_listing, (), {'utcdate':utcdate}),
+        (arxivdb.get_articles_for_listing, (), {'utcdate':utcdate,
+                                                'astronomyonly':True}),
+        (arxivdb.get_articles_for_voting, (), {}),
+        (arxivdb.get_archive_index, (), {}),
+        (arxivdb.get_user_reservations, (utcdate, username), {}),
+        (arxivdb.get_user_votes, (utcdate, username), {}),
+        (arxivdb.cast_vote, (arxivid, username, 'up'), {'utcdate':utcdate,
+                                                        'max_votes':5}),
+        (arxivdb.cast_reservation, (arxivid, username, 'reserve'),
+         {'utcdate':utcdate, 'max_reservations':5}),
+        (arxivdb.modify_presenters, (arxivid, username, 'add'), {}),
+        (webdb.get_local_authors, (), {}),
+        (webdb.session_check, ('index-advisor-token',), {}),
+        (fulltextsearch.fts4_phrase_query_paginated,
+         ('galaxy', list(ftscolumns)), {}),
+        (fulltextsearch.fts4_phrase_query_paginated,
+         ('galaxy', list(ftscolumns)), {'sortcol':'relevance'}),
+    ]
+
+    for func, args, kwargs in calls:
+        try:
+            func(*args, database=recorder, **kwargs)
+        except Exception as e:
+            print('could not run %s for the index advisor: %r' %
+                  (func.__name__, e))
+
+    database.rollback()
+
+    # keep the first set of params seen for each distinct query
+    queries = {}
+    for query, params in recorder.queries:
+        if query not in queries:
+            queries[query] = params
+
+    return sorted(queries.items())
+
+
+
+def explain_query(cursor, query, params=()):
+    '''
+    This runs EXPLAIN QUERY PLAN on the query and returns a list of the plan
+    detail strings, and lists of the full table scans and temp B-trees in the
+    plan.
+
+    '''
+
+    cursor.execute('explain query plan %s' % query, params)
+    details = [x[-1] for x in cursor.fetchall()]
+
+    # SQLite < 3.24 says 'SCAN TABLE x', later versions say 'SCAN x'. scans
+    # that use an index or a virtual table (i.e. the FTS index) aren't full
+    # table scans.
+    fullscans = [x for x in details
+                 if x.startswith('SCAN') and
+                 'INDEX' not in x and
+                 'VIRTUAL TABLE' not in x]
+    tempbtrees = [x for x in details if 'TEMP B-TREE' in x]
+
+    return details, fullscans, tempbtrees
+
+
+
+def advise_indexes(database=None, verbose=True):
+    '''
+    This collects the queries issued by the server modules, runs EXPLAIN QUERY
+    PLAN on each, and returns a list of dicts for the queries that do full
+    table scans or build temp B-trees.
+
+    '''
+
+    # open the database if needed and get a cursor
+    if not database:
+        database, cursor = arxivdb.opendb()
+        closedb = True
+    else:
+        cursor = database.cursor()
+        closedb = False
+
+    flagged = []
+
+    for query, params in collect_queries(database):
+
+        try:
+            details, fullscans, tempbtrees = explain_query(cursor,
+                                                           query,
+                                                           params)
+        except Exception as e:
+            print('could not explain query %s: %r' % (query, e))
+            continue
+
+        if fullscans or tempbtrees:
+
+            flagged.append({'query':query,
+                            'plan':details,
+                            'fullscans':fullscans,
+                            'tempbtrees':tempbtrees})
+
+            if verbose:
+                print('%s\n  %s' % (query, '\n  '.join(details)))
+
+    if verbose:
+        print('schema version %s, %s queries with full scans or temp B-trees' %
+              (get_schema_version(database), len(flagged)))
+
+    # at the end, close the cursor and DB connection
+    if closedb:
+        cursor.close()
+        database.close()
+
+    return flagged
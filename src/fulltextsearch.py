@@ -284,12 +284,14 @@ def fts4_phrase_query_paginated(querystr,
             queryparams = (querystr,)
 
 
-        # use page limit if necessary
-        if pagelimit and pagelimit > 0:
-            query = '%s limit %s' % (query, pagelimit)
-        else:
+        # use page limit if necessary. this is bound as a parameter so the
+        # query text stays the same for any page size and the prepared
+        # statement can be reused from the connection's statement cache
+        if not (pagelimit and pagelimit > 0):
             pagelimit = 100
-            query = '%s limit %s' % (query, pagelimit)
+
+        query = '%s limit ?' % query
+        queryparams = queryparams + (pagelimit,)
 
         print(query, queryparams)
 
@@ -18,6 +18,119 @@ var coffee = {
     // this stores the original number of search matches before filtering
     original_nmatches: 0,
 
+    // the abstracts of the other papers on the listing pages are loaded from
+    // /astroph-coffee/abstract when they're shown, this many at a time
+    abstract_batch_size: 25,
+
+    // these are the arxivids of the abstracts being loaded right now
+    abstracts_pending: {},
+
+    // this holds the timer for loading abstracts after scrolling
+    abstract_scroll_timer: null,
+
+    // the voting page reconnects to /astroph-coffee/live after this many
+    // milliseconds if the connection is lost
+    live_update_retry: 10000,
+
+    // this loads the abstracts for the lazy abstract elements in abstractelems.
+    // the ones that can't be loaded are marked as failed so they aren't asked
+    // for again until their paper title is clicked.
+    load_abstracts: function (abstractelems) {
+
+        var arxivids = [];
+        var nloaded = 0;
+
+        abstractelems.filter('[data-abstract="lazy"]')
+            .each(function (ind, elem) {
+
+                var arxivid = $(elem).attr('data-arxivid');
+
+                if (!(arxivid in coffee.abstracts_pending) &&
+                    arxivids.length < coffee.abstract_batch_size) {
+                    arxivids.push(arxivid);
+                    coffee.abstracts_pending[arxivid] = true;
+                }
+
+            });
+
+        if (arxivids.length == 0) {
+            return;
+        }
+
+        $.getJSON('/astroph-coffee/abstract',
+                  {ids: arxivids.join(',')},
+                  function (data) {
+
+                      if (data.status == 'success') {
+
+                          $.each(data.results, function (arxivid, abstract) {
+
+                              var abstractelem = $('.paper-abstract')
+                                  .filter('[data-arxivid="' + arxivid + '"]')
+                                  .filter('[data-abstract="lazy"]');
+                              var abstractpara = abstractelem.find('p');
+
+                              abstractpara.text(abstract);
+                              abstractelem.attr('data-abstract', 'loaded');
+                              nloaded = nloaded + abstractelem.length;
+
+                              if (typeof MathJax != 'undefined') {
+                                  MathJax.Hub.Queue(['Typeset',
+                                                     MathJax.Hub,
+                                                     abstractpara[0]]);
+                              }
+
+                          });
+
+                      }
+
+                  }).always(function () {
+
+                      arxivids.forEach(function (arxivid) {
+
+                          delete coffee.abstracts_pending[arxivid];
+
+                          // the request failed or this abstract wasn't in
+                          // the results
+                          $('.paper-abstract')
+                              .filter('[data-arxivid="' + arxivid + '"]')
+                              .filter('[data-abstract="lazy"]')
+                              .attr('data-abstract', 'failed')
+                              .find('p')
+                              .text("Couldn't load the abstract, " +
+                                    "click the paper title to try again.");
+
+                      });
+
+                      // if more abstracts came into view while we were
+                      // loading these, get them too. this only happens after
+                      // a request that worked, so a server that's down doesn't
+                      // get asked over and over.
+                      if (nloaded > 0) {
+                          coffee.load_visible_abstracts();
+                      }
+
+                  });
+
+    },
+
+    // this loads the lazy abstracts that are shown on or near the screen
+    load_visible_abstracts: function () {
+
+        var viewheight = $(window).height();
+        var viewtop = $(window).scrollTop() - viewheight;
+        var viewbottom = $(window).scrollTop() + 2*viewheight;
+
+        var abstractelems = $('.paper-abstract[data-abstract="lazy"]:visible')
+            .filter(function () {
+                var elemtop = $(this).offset().top;
+                return (elemtop > viewtop && elemtop < viewbottom);
+            });
+
+        coffee.load_abstracts(abstractelems);
+
+    },
+
     // this handles actual voting
     vote_on_paper: function(arxivid) {
 
@@ -146,6 +259,11 @@ var coffee = {
         // value on page-load and uses that for .data()
         var reservetype = reservebutton.attr('data-reservetype');
 
+        // someone else has reserved this paper
+        if (reservetype == 'reserved') {
+            return;
+        }
+
         var xsrftoken = $('#voting-form input').val();
         var messagebar = $('#message-bar');
 
@@ -279,7 +397,8 @@ var coffee = {
                     }
                     else if (i == 2) {
                         $('.other-paper-listing .paper-abstract')
-                            .slideDown('fast');
+                            .slideDown('fast')
+                            .promise().done(coffee.load_visible_abstracts);
                     }
 
                 }
@@ -339,6 +458,112 @@ var coffee = {
 
     },
 
+    // pre-rendered archive pages aren't tied to a session, so their search
+    // forms have an empty _xsrf token. this fills it in from the _xsrf cookie,
+    // setting a new one if there isn't one yet.
+    static_xsrf_setup: function () {
+
+        var xsrfinput = $('.search-form input[name="_xsrf"]');
+        if (xsrfinput.length == 0 || xsrfinput.val()) {
+            return;
+        }
+
+        var token = null;
+        var match = document.cookie.match(/(?:^|;\s*)_xsrf=([^;]*)/);
+
+        if (match) {
+            token = decodeURIComponent(match[1]);
+        }
+
+        else {
+
+            var hexchars = '0123456789abcdef';
+            token = '';
+
+            for (var i = 0; i < 32; i++) {
+                token = token + hexchars[Math.floor(Math.random()*16)];
+            }
+
+            document.cookie = '_xsrf=' + token + '; path=/';
+
+        }
+
+        xsrfinput.val(token);
+
+    },
+
+    // this applies a change pushed by the server to a paper on the voting page.
+    // update has the arxiv_id and the nvotes and/or reserved state that
+    // changed.
+    apply_live_update: function (update) {
+
+        var arxividfilter = '[data-arxivid="' + update.arxiv_id + '"]';
+
+        if ('nvotes' in update) {
+
+            $('.vote-total').filter(arxividfilter).text(update.nvotes);
+
+            if (update.nvotes != 1) {
+                $('.vote-postfix').filter(arxividfilter).text('votes');
+            }
+            else {
+                $('.vote-postfix').filter(arxividfilter).text('vote');
+            }
+
+        }
+
+        if ('reserved' in update) {
+
+            var reservebutton = $('.reserve-button').filter(arxividfilter);
+            var reservetype = reservebutton.attr('data-reservetype');
+
+            // someone else reserved this paper. if it's this user's
+            // reservation, the button already says so.
+            if (update.reserved == 1 && reservetype == 'reserve') {
+
+                reservebutton
+                    .addClass('disabled')
+                    .html('Paper already reserved')
+                    .attr('data-reservetype','reserved');
+
+            }
+
+            // someone else released this paper
+            else if (update.reserved == 0 && reservetype == 'reserved') {
+
+                reservebutton
+                    .removeClass('disabled')
+                    .html('<strong>Reserve</strong> for later discussion')
+                    .attr('data-reservetype','reserve');
+
+            }
+
+        }
+
+    },
+
+    // this opens the WebSocket the server pushes vote counts and reservations
+    // to, so the voting page stays current without reloading
+    live_update_setup: function () {
+
+        if (!('WebSocket' in window)) {
+            return;
+        }
+
+        var scheme = (window.location.protocol == 'https:') ? 'wss:' : 'ws:';
+        var socket = new WebSocket(scheme + '//' + window.location.host +
+                                   '/astroph-coffee/live');
+
+        socket.onmessage = function (evt) {
+            JSON.parse(evt.data).forEach(coffee.apply_live_update);
+        };
+
+        socket.onclose = function (evt) {
+            setTimeout(coffee.live_update_setup, coffee.live_update_retry);
+        };
+
+    },
+
     // sets up all event bindings
     action_setup: function () {
 
@@ -346,6 +571,9 @@ var coffee = {
         $.cookie.json = true;
         coffee.restore_cookie_settings();
 
+        // fill in the search form token on pre-rendered pages
+        coffee.static_xsrf_setup();
+
         // store the nmatches early
         var nmatch_elem = $('.nmatches');
         if (nmatch_elem.length > 0) {
@@ -359,10 +587,27 @@ var coffee = {
             var arxivid = $(this).data('arxivid');
             var abstractfilter = '[data-arxivid="' + arxivid + '"]';
             var abstractelem = $('.paper-abstract').filter(abstractfilter);
+
+            // try the abstract again if it couldn't be loaded before
+            abstractelem.filter('[data-abstract="failed"]')
+                .attr('data-abstract', 'lazy');
+
+            coffee.load_abstracts(abstractelem);
             abstractelem.slideToggle('fast');
 
         });
 
+        // load the abstracts of the other papers as they're scrolled into view
+        if ($('.paper-abstract[data-abstract="lazy"]').length > 0) {
+
+            $(window).on('scroll resize', function (evt) {
+                clearTimeout(coffee.abstract_scroll_timer);
+                coffee.abstract_scroll_timer =
+                    setTimeout(coffee.load_visible_abstracts, 100);
+            });
+
+        }
+
         // handle clicking on the vote button
         $('.vote-button').on('click', function(evt) {
 
@@ -550,7 +795,9 @@ var coffee = {
         $('#preferences-pane').on('click','#show-other-check',function (evt) {
 
             if ($(this).prop('checked') == true) {
-                $('.other-paper-listing .paper-abstract').slideDown('fast');
+                $('.other-paper-listing .paper-abstract')
+                    .slideDown('fast')
+                    .promise().done(coffee.load_visible_abstracts);
             }
             else {
                 $('.other-paper-listing .paper-abstract').slideUp('fast');
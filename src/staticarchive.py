@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+
+'''
+staticarchive - Waqas Bhatti (wbhatti@astro.princeton.edu) - Nov 2017
+
+Contains the static page generator for the astroph-coffee archive.
+
+Once a listing date is older than the reservation window, nothing on its
+archive page can change except through editorial changes to the arxiv table
+(re-tagging local authors, corrections, etc.). The generator renders the
+archivelisting.html page for each of these frozen days to
+[paths] static_archive/YYYYMMDD.html (plus a gzipped copy for nginx's
+gzip_static), so the ArchiveHandler or nginx can serve them directly.
+
+The static_pages table records which days have been rendered. Triggers on the
+arxiv table mark a day stale whenever its rows change, and the next run of
+generate_static_archive re-renders it.
+
+'''
+
+import os
+import os.path
+import gzip
+import time
+import ConfigParser
+from datetime import datetime, timedelta
+
+from pytz import utc
+
+import tornado.web
+import tornado.template
+from tornado.util import ObjectDict
+
+CONF = ConfigParser.ConfigParser()
+CONF.read('conf/astroph.conf')
+
+STATICPATH = os.path.abspath(CONF.get('paths','static'))
+TEMPLATEPATH = os.path.join(STATICPATH,'templates')
+STATIC_URL_PREFIX = '/astroph-coffee/static/'
+
+# the rendered pages go here
+STATIC_ARCHIVE_DIR = CONF.get('paths','static_archive')
+
+RESERVE_INTERVAL_DAYS = int(CONF.get('times','reserve_interval_days'))
+
+# local imports
+import arxivdb
+
+
+## TRACKING RENDERED PAGES
+
+# these mark a rendered day stale when any of its rows in the arxiv table
+# change. updates for days that were never rendered (e.g. votes on today's
+# papers) don't match any rows here.
+STATIC_PAGES_TRIGGERS = (
+    "create trigger if not exists static_after_insert "
+    "after insert on arxiv begin "
+    "update static_pages set stale = 1 where utcdate = new.utcdate; "
+    "end",
+    "create trigger if not exists static_after_delete "
+    "after delete on arxiv begin "
+    "update static_pages set stale = 1 where utcdate = old.utcdate; "
+    "end",
+    "create trigger if not exists static_after_update "
+    "after update on arxiv begin "
+    "update static_pages set stale = 1 where utcdate = old.utcdate; "
+    "update static_pages set stale = 1 where utcdate = new.utcdate; "
+    "end",
+)
+
+
+def ensure_static_pages_table(database):
+    '''
+    This creates the static_pages table and the triggers that mark its rows
+    stale in databases created before it existed.
+
+    '''
+
+    cursor = database.cursor()
+    cursor.execute(
+        'create table if not exists static_pages ('
+        'utcdate date, '
+        'rendered_utc double precision, '
+        'stale integer default 0, '
+        'primary key (utcdate))'
+    )
+    for trigger in STATIC_PAGES_TRIGGERS:
+        cursor.execute(trigger)
+    database.commit()
+    cursor.close()
+
+
+
+def get_frozen_cutoff(today=None):
+    '''
+    This returns the latest date whose archive page can no longer change
+    through votes or reservations.
+
+    A listing shows the reserved papers from the RESERVE_INTERVAL_DAYS before
+    it, and papers can be reserved up to RESERVE_INTERVAL_DAYS after their
+    listing date, so a day is frozen once it's more than RESERVE_INTERVAL_DAYS
+    old.
+
+    '''
+
+    if today is None:
+        today = datetime.now(tz=utc).date()
+
+    return today - timedelta(days=RESERVE_INTERVAL_DAYS + 1)
+
+
+
+def static_page_path(listingdate, outdir=STATIC_ARCHIVE_DIR):
+    '''
+    This returns the path to the rendered page for listingdate (a
+    datetime.date or a YYYY-MM-DD string).
+
+    '''
+
+    if isinstance(listingdate, basestring):
+        listingdate = datetime.strptime(listingdate, '%Y-%m-%d').date()
+
+    return os.path.join(outdir, '%s.html' % listingdate.strftime('%Y%m%d'))
+
+
+
+def get_static_page(listingdate, database, outdir=STATIC_ARCHIVE_DIR):
+    '''
+    This returns the path to the rendered page for listingdate (a YYYY-MM-DD
+    string) if there's one on disk that's still current, or None otherwise.
+
+    '''
+
+    listing_dt = datetime.strptime(listingdate, '%Y-%m-%d').date()
+    if listing_dt > get_frozen_cutoff():
+        return None
+
+    pagepath = static_page_path(listing_dt, outdir=outdir)
+    if not os.path.exists(pagepath):
+        return None
+
+    cursor = database.cursor()
+
+    try:
+        cursor.execute('select stale from static_pages where utcdate = ?',
+                       (listingdate,))
+        row = cursor.fetchone()
+    except Exception as e:
+        row = None
+    finally:
+        cursor.close()
+
+    if row and not row[0]:
+        return pagepath
+    else:
+        return None
+
+
+
+## RENDERING PAGES
+
+def static_url(path):
+    '''
+    This returns the versioned URL for a file in the static directory, the same
+    way RequestHandler.static_url does for the server.
+
+    '''
+
+    settings = {'static_path':STATICPATH,
+                'static_url_prefix':STATIC_URL_PREFIX}
+    return tornado.web.StaticFileHandler.make_static_url(settings, path)
+
+
+
+def static_xsrf_form_html():
+    '''
+    This stands in for the xsrf_form_html UI module. Static pages aren't tied
+    to a session, so the token is filled in from the _xsrf cookie by
+    coffee.static_xsrf_setup() in coffee.js.
+
+    '''
+
+    return '<input type="hidden" name="_xsrf" value=""/>'
+
+
+
+def render_archive_listing(listingdate, database, loader=None):
+    '''
+    This renders the archivelisting.html page for listingdate (a YYYY-MM-DD
+    string) without a request, and returns the HTML. Returns None if there are
+    no papers for this date.
+
+    '''
+
+    if loader is None:
+        loader = tornado.template.Loader(TEMPLATEPATH)
+
+    (latestdate, local_articles,
+     voted_articles, other_articles, reserved_articles) = (
+         arxivdb.get_articles_for_listing(utcdate=listingdate,
+                                          database=database)
+     )
+
+    if (not local_articles and
+        not voted_articles and
+        not other_articles and
+        not reserved_articles):
+        return None
+
+    listing_dt = datetime.strptime(listingdate, '%Y-%m-%d')
+    archive_datestr = listing_dt.strftime('%A, %b %d %Y')
+
+    template = loader.load('archivelisting.html')
+
+    return template.generate(
+        static_url=static_url,
+        _tt_modules=ObjectDict(xsrf_form_html=static_xsrf_form_html),
+        user_name='',
+        local_today=datetime.now(tz=utc).strftime('%Y-%m-%d %H:%M %Z'),
+        todays_date=archive_datestr,
+        local_articles=local_articles,
+        voted_articles=voted_articles,
+        other_articles=other_articles,
+        reserved_articles=reserved_articles,
+        reserve_interval_days=RESERVE_INTERVAL_DAYS,
+        flash_message='',
+        new_user=False
+    )
+
+
+
+def write_static_page(html, pagepath):
+    '''
+    This writes the rendered html to pagepath and a gzipped copy to
+    pagepath.gz. Both are written to temporary files first and moved into
+    place, so the server never sees a partial page.
+
+    '''
+
+    tmppath = '%s.tmp' % pagepath
+    with open(tmppath, 'wb') as outfd:
+        outfd.write(html)
+    os.rename(tmppath, pagepath)
+
+    tmpgzpath = '%s.gz.tmp' % pagepath
+    with gzip.open(tmpgzpath, 'wb') as outfd:
+        outfd.write(html)
+    os.rename(tmpgzpath, '%s.gz' % pagepath)
+
+
+
+def generate_static_archive(outdir=STATIC_ARCHIVE_DIR,
+                            database=None,
+                            force=False,
+                            verbose=True):
+    '''
+    This renders the archive pages for all frozen days that haven't been
+    rendered yet, whose rendered page is missing, or that were marked stale by
+    changes to the arxiv table. If force is True, all frozen days are
+    re-rendered. Returns the number of pages rendered.
+
+    '''
+
+    # open the database if needed and get a cursor
+    if not database:
+        database, cursor = arxivdb.opendb()
+        closedb = True
+    else:
+        cursor = database.cursor()
+        closedb = False
+
+    ensure_static_pages_table(database)
+
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    cutoff = get_frozen_cutoff()
+
+    archive_dates = arxivdb.get_archive_index(database=database)[0]
+    frozen_dates = [x for x in archive_dates if x <= cutoff]
+
+    cursor.execute('select utcdate, stale from static_pages')
+    rendered = dict(cursor.fetchall())
+
+    # a listing also shows the reserved papers from the days before it, so a
+    # stale day makes the pages for the days after it in the reservation
+    # window stale too
+    stale_dates = set()
+    for utcdate, stale in rendered.items():
+        if stale:
+            for x in range(RESERVE_INTERVAL_DAYS + 1):
+                stale_dates.add(utcdate + timedelta(days=x))
+
+    loader = tornado.template.Loader(TEMPLATEPATH)
+    nrendered = 0
+
+    for utcdate in frozen_dates:
+
+        pagepath = static_page_path(utcdate, outdir=outdir)
+
+        if (not force and
+            utcdate in rendered and
+            utcdate not in stale_dates and
+            os.path.exists(pagepath)):
+            continue
+
+        try:
+
+            html = render_archive_listing(utcdate.strftime('%Y-%m-%d'),
+                                          database,
+                                          loader=loader)
+
+            # this day's papers are gone, so drop its page too
+            if html is None:
+                cursor.execute('delete from static_pages where utcdate = ?',
+                               (utcdate,))
+                database.commit()
+                for stalefile in (pagepath, '%s.gz' % pagepath):
+                    if os.path.exists(stalefile):
+                        os.remove(stalefile)
+                continue
+
+            write_static_page(html, pagepath)
+
+            cursor.execute('insert or replace into static_pages '
+                           '(utcdate, rendered_utc, stale) values (?,?,0)',
+                           (utcdate, time.time()))
+            database.commit()
+            nrendered = nrendered + 1
+
+        except Exception as e:
+
+            print('could not render the archive page for %s: %s' %
+                  (utcdate, e))
+            database.rollback()
+
+    if verbose:
+        print('rendered %s archive pages, %s frozen days in the archive' %
+              (nrendered, len(frozen_dates)))
+
+    # at the end, close the cursor and DB connection
+    if closedb:
+        cursor.close()
+        database.close()
+
+    return nrendered
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+
+'''
+votejournal - Waqas Bhatti (wbhatti@astro.princeton.edu) - Nov 2017
+
+Contains the write-behind journal for votes and reservations.
+
+Each vote or reservation used to be its own transaction and commit on the
+server's one database connection, so when voting opened, the server spent most
+of its time waiting on commits. The VoteJournal decides each vote or
+reservation from the day snapshots in arxivdb, which hold the vote counts,
+voters, and reservers for the reservation window, updates the snapshots in
+place, and answers the request right away. The queued operations are written to
+the database in one transaction every flush_interval milliseconds, or as soon
+as flush_ops of them are waiting. The vote and reservation limits are checked
+again by the database when they're written.
+
+The queued operations are also written before a day snapshot is loaded again
+from the database (because another connection committed something), so they
+can't be lost from it. Any operations the database turns down when they're
+written are taken back out of the snapshots.
+
+Each operation is appended to the journal file before it's acknowledged. The
+sequence number of the last operation written to the database is stored in the
+vote_journal table in the same transaction, so replay() writes the operations a
+crash left in the file exactly once. The file is emptied after each flush. It's
+flushed to the OS but not fsynced, so it survives the server process crashing,
+but not the machine.
+
+Operations for papers that aren't in the day snapshots go to
+arxivdb.cast_vote and arxivdb.cast_reservation directly, after the queued
+operations are flushed.
+
+'''
+
+import os.path
+import json
+import logging
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+from datetime import datetime
+from pytz import utc
+
+import tornado.ioloop
+
+import arxivdb
+
+
+# how long to wait before trying again if a flush fails (e.g. the database was
+# locked by the nightly update for too long)
+FLUSH_RETRY_SECONDS = 1.0
+
+
+class VoteJournal(object):
+    '''
+    This queues votes and reservations and writes them to the database in
+    group commits.
+
+    '''
+
+    def __init__(self,
+                 database,
+                 journal_path,
+                 flush_interval=5.0,
+                 flush_ops=100,
+                 ioloop=None):
+        '''
+        Sets up the journal. flush_interval is in milliseconds. Call replay()
+        before casting any votes.
+
+        '''
+
+        self.database = database
+        self.journal_path = journal_path
+        self.flush_interval = flush_interval
+        self.flush_ops = flush_ops
+
+        if ioloop is None:
+            ioloop = tornado.ioloop.IOLoop.current()
+        self.ioloop = ioloop
+
+        self.pending = []
+        self.flush_timeout = None
+        self.journal_fd = None
+        self.seq = 0
+
+
+    def replay(self):
+        '''
+        This writes the operations left in the journal file by a crash to the
+        database, empties the file, and opens it for new operations. Returns
+        the number of operations written.
+
+        '''
+
+        arxivdb.ensure_vote_journal_table(self.database)
+
+        ops = []
+
+        if os.path.exists(self.journal_path):
+
+            with open(self.journal_path,'rb') as infd:
+                for line in infd:
+                    try:
+                        ops.append(json.loads(line))
+                    except ValueError:
+                        # the crash can cut the last line short
+                        LOGGER.warning('skipping a damaged line in '
+                                       'the vote journal %s' %
+                                       self.journal_path)
+
+        nreplayed = 0
+
+        if ops:
+            nreplayed = arxivdb.apply_vote_journal(ops,
+                                                   self.journal_path,
+                                                   database=self.database)
+            LOGGER.info('replayed %s of %s operations from '
+                        'the vote journal %s' %
+                        (nreplayed, len(ops), self.journal_path))
+
+        self.seq = max(
+            [arxivdb.get_vote_journal_seq(self.journal_path,
+                                          database=self.database)] +
+            [x['seq'] for x in ops]
+        )
+        self.journal_fd = open(self.journal_path,'wb')
+
+        # the queued operations are written before any day snapshot is loaded
+        # again from the database, whether for a vote or for a page
+        arxivdb.SNAPSHOT_RELOAD_HOOKS.append(self.flush)
+
+        return nreplayed
+
+
+    def cast_vote(self, arxivid, username, vote,
+                  utcdate=None,
+                  max_votes=None):
+        '''
+        This records a vote like arxivdb.cast_vote and returns the same
+        (status, nvotes), but only queues the vote for the database.
+
+        '''
+
+        if utcdate is None:
+            utcdate = datetime.now(tz=utc).strftime('%Y-%m-%d')
+
+        outcome = arxivdb.snapshot_vote(arxivid,
+                                        username,
+                                        vote,
+                                        utcdate,
+                                        max_votes,
+                                        self.database)
+
+        if outcome is None:
+            self.flush()
+            return arxivdb.cast_vote(arxivid,
+                                     username,
+                                     vote,
+                                     utcdate=utcdate,
+                                     max_votes=max_votes,
+                                     database=self.database)
+
+        if outcome[0] == 'ok':
+            self.append('vote', arxivid, username, vote, utcdate, max_votes)
+
+        return outcome
+
+
+    def cast_reservation(self, arxivid, username, reservation,
+                         utcdate=None,
+                         max_reservations=None):
+        '''
+        This records a reservation like arxivdb.cast_reservation and returns
+        the same (status, row), but only queues the reservation for the
+        database.
+
+        '''
+
+        if utcdate is None:
+            utcdate = datetime.now(tz=utc).strftime('%Y-%m-%d')
+
+        outcome = arxivdb.snapshot_reservation(arxivid,
+                                               username,
+                                               reservation,
+                                               utcdate,
+                                               max_reservations,
+                                               self.database)
+
+        if outcome is None:
+            self.flush()
+            return arxivdb.cast_reservation(arxivid,
+                                            username,
+                                            reservation,
+                                            utcdate=utcdate,
+                                            max_reservations=max_reservations,
+                                            database=self.database)
+
+        if outcome[0] == 'ok':
+            self.append('reservation', arxivid, username, reservation,
+                        utcdate, max_reservations)
+
+        return outcome
+
+
+    def append(self, kind, arxivid, username, action, utcdate, limit):
+        '''
+        This writes an operation to the journal file and queues it for the next
+        flush. See arxivdb.apply_vote_journal for the args.
+
+        '''
+
+        self.seq = self.seq + 1
+
+        op = {'seq':self.seq,
+              'kind':kind,
+              'arxivid':arxivid,
+              'username':username,
+              'action':action,
+              'utcdate':utcdate,
+              'limit':limit,
+              'utc':time.time()}
+
+        self.journal_fd.write('%s\n' % json.dumps(op))
+        self.journal_fd.flush()
+
+        self.pending.append(op)
+
+        if len(self.pending) >= self.flush_ops:
+            self.ioloop.add_callback(self.flush)
+        elif self.flush_timeout is None:
+            self.flush_timeout = self.ioloop.call_later(
+                self.flush_interval/1000.0,
+                self.flush
+            )
+
+
+    def flush(self):
+        '''
+        This writes the queued operations to the database in one transaction
+        and empties the journal file. Returns the number of operations written.
+
+        '''
+
+        if self.flush_timeout is not None:
+            self.ioloop.remove_timeout(self.flush_timeout)
+            self.flush_timeout = None
+
+        if not self.pending:
+            return 0
+
+        ops, self.pending = self.pending, []
+
+        try:
+
+            nwritten = arxivdb.apply_vote_journal(ops,
+                                                  self.journal_path,
+                                                  database=self.database)
+
+        except Exception as e:
+
+            LOGGER.exception('could not write %s journaled votes and '
+                             'reservations to the database, '
+                             'will try again' % len(ops))
+            self.pending = ops + self.pending
+            self.flush_timeout = self.ioloop.call_later(FLUSH_RETRY_SECONDS,
+                                                        self.flush)
+            return 0
+
+        # everything in the file is in the database now
+        self.journal_fd.seek(0)
+        self.journal_fd.truncate()
+
+        return nwritten
+
+
+    def close(self):
+        '''
+        This flushes the queued operations and closes the journal file.
+
+        '''
+
+        self.flush()
+
+        if self.flush in arxivdb.SNAPSHOT_RELOAD_HOOKS:
+            arxivdb.SNAPSHOT_RELOAD_HOOKS.remove(self.flush)
+
+        if self.journal_fd is not None:
+            self.journal_fd.close()
+            self.journal_fd = None